@@ -0,0 +1,101 @@
+#  -*- coding: utf-8 -*-
+__author__ = "kubik.augustyn@post.cz"
+
+import argparse
+import subprocess
+import sys
+from os import remove
+from shutil import which
+from tempfile import NamedTemporaryFile
+from typing import Final
+
+from esoml.language import EsoML
+from esoml.types import EsoMLOptions, OutputMode, OptimizationLevel, Backend
+
+from benchmarks.generate import ProgramSpec, generateProgram
+from benchmarks.run import SUITES, DEFAULT_SUITES
+
+# Compiles (without running) the bundle given as the first argument, the best time of the runs in
+# milliseconds. V8 caches the code of the sources it already compiled, so every run gets a source
+# of its own. V8 is the engine of Chromium, but it's still only an estimate of a browser's parse
+# time.
+PARSE_SCRIPT: Final[str] = """
+const source = require("fs").readFileSync(process.argv[1], "utf-8")
+const vm = require("vm")
+let best = Infinity
+for (let i = 0; i < Number(process.argv[2]); i++) {
+    const start = process.hrtime.bigint()
+    new vm.Script(source + "\\n//" + i)
+    best = Math.min(best, Number(process.hrtime.bigint() - start) / 1e6)
+}
+console.log(best)
+"""
+
+
+def measureParseTime(bundle: str, repeat: int) -> float | None:
+    # In milliseconds, None without node
+    if which("node") is None:
+        return None
+    with NamedTemporaryFile("w", suffix=".js", encoding="utf-8", delete=False) as f:
+        f.write(bundle)
+    try:
+        result = subprocess.run(["node", "-e", PARSE_SCRIPT, f.name, str(repeat)],
+                                capture_output=True, text=True, check=True)
+    finally:
+        remove(f.name)
+    return float(result.stdout)
+
+
+def benchmarkBackend(source: str, backend: Backend, repeat: int,
+                     optimizationLevel: OptimizationLevel) -> dict[str, float | None]:
+    # The bundle as shipped to the browsers
+    file = EsoML().compile(source, EsoMLOptions(locale="en_US", outputMode=OutputMode.MINIFIED,
+                                                production=True,
+                                                optimizationLevel=optimizationLevel,
+                                                backend=backend))
+    bundle: str = file.export()
+    return {
+        "bundleSize": len(bundle),
+        "codeSize": len(file.exportCodes()),
+        "parseTime": measureParseTime(bundle, repeat),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Compares the bundle size and the parse time of the backends")
+    parser.add_argument("suites", nargs="*", default=list(DEFAULT_SUITES),
+                        help=f"The suites to run, out of {', '.join(SUITES)}")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Parses of each bundle, the best wins")
+    parser.add_argument("--optimization-level", type=int, default=OptimizationLevel.O1.value,
+                        choices=[level.value for level in OptimizationLevel])
+    args = parser.parse_args()
+    if which("node") is None:
+        print("node was not found, only the sizes are compared")
+
+    for name in args.suites:
+        if name not in SUITES:
+            parser.error(f"Unknown suite {name!r}")
+        spec: ProgramSpec = SUITES[name]
+        print(f"{name}: {spec.instructions:,} instructions, {spec}")
+        source: str = generateProgram(spec)
+        results: dict[Backend, dict[str, float | None]] = {
+            backend: benchmarkBackend(source, backend, args.repeat,
+                                      OptimizationLevel(args.optimization_level))
+            for backend in Backend
+        }
+        closures: dict[str, float | None] = results[Backend.CLOSURES]
+        for backend, result in results.items():
+            line: str = (f"  {backend.value:>8}: {result['bundleSize']:12,} characters "
+                         f"({result['codeSize']:,} of code, "
+                         f"{result['bundleSize'] / closures['bundleSize']:5.2f}x closures)")
+            if result["parseTime"] is not None:
+                line += (f", parsed in {result['parseTime']:8.2f}ms "
+                         f"({result['parseTime'] / closures['parseTime']:5.2f}x closures)")
+            print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,235 @@
+#  -*- coding: utf-8 -*-
+__author__ = "kubik.augustyn@post.cz"
+
+import argparse
+from random import Random
+from typing import Final
+
+from esoml.lexer import EsoMLLexer
+
+BASE_11_DIGITS: Final[str] = "0123456789a"
+
+
+class ProgramSpec:
+    sections: int  # The number of render sections (besides main), code sections are added for events
+    instructionsPerSection: int
+    nestingDepth: int  # The maximum depth of nested cont/ifis blocks
+    closeChance: float  # How likely an open block gets closed instead of emitting an instruction
+    strings: int
+    romEntries: int
+    locales: int
+    seed: int
+
+    def __init__(self, sections: int = 10, instructionsPerSection: int = 100,
+                 nestingDepth: int = 4, strings: int = 50, romEntries: int = 10,
+                 locales: int = 1, seed: int = 0, closeChance: float = 0.25) -> None:
+        self.sections = max(sections, 1)
+        self.instructionsPerSection = max(instructionsPerSection, 1)
+        self.nestingDepth = max(nestingDepth, 0)
+        self.strings = max(strings, 1)
+        self.romEntries = max(romEntries, 2)
+        self.locales = max(locales, 1)
+        self.seed = seed
+        self.closeChance = closeChance
+
+    @property
+    def instructions(self) -> int:
+        return self.sections * self.instructionsPerSection
+
+    def __repr__(self) -> str:
+        return (f"ProgramSpec(sections={self.sections}, "
+                f"instructionsPerSection={self.instructionsPerSection}, "
+                f"nestingDepth={self.nestingDepth}, strings={self.strings}, "
+                f"romEntries={self.romEntries}, locales={self.locales}, seed={self.seed}, "
+                f"closeChance={self.closeChance})")
+
+
+def toBase11(number: int) -> str:
+    if number == 0:
+        return "0"
+    digits: list[str] = []
+    negative: bool = number < 0
+    number = abs(number)
+    while number:
+        number, digit = divmod(number, 11)
+        digits.append(BASE_11_DIGITS[digit])
+    return ("-" if negative else "") + "".join(reversed(digits))
+
+
+def localeName(index: int) -> str:
+    if index == 0:
+        return "en_US"
+    first, second = divmod(index, 26)
+    letters: str = chr(ord("a") + first % 26) + chr(ord("a") + second)
+    return f"{letters}_{letters.upper()}"
+
+
+def assignKeys(count: int) -> list[tuple[str, int]]:
+    # Picks (base 8 id, key) pairs for consecutive lines of a section. Every third line offset
+    # of an id's length maps to only 105 keys, so the ids are zero-padded to a length which
+    # avoids that, and ids whose key would be a duplicate (a compile error) are skipped.
+    keys: list[tuple[str, int]] = []
+    used: set[int] = set()
+    candidate: int = 1
+    while len(keys) < count:
+        line: int = len(keys)
+        digits: str = oct(candidate)[2:]
+        candidate += 1
+        length: int = len(digits)
+        while (line % length) % 3 == 2:
+            length += 1
+        idStr: str = digits.rjust(length, "0")
+        key: int = EsoMLLexer.convertIDToKey(idStr, line)
+        if key in used:
+            continue
+        used.add(key)
+        keys.append((idStr, key))
+    return keys
+
+
+class ProgramGenerator:
+    spec: ProgramSpec
+    random: Random
+    stringKeys: list[tuple[str, int]]
+    romKeys: list[tuple[str, int]]
+    lines: list[str]
+
+    def __init__(self, spec: ProgramSpec) -> None:
+        self.spec = spec
+        self.random = Random(spec.seed)
+        self.stringKeys = assignKeys(spec.strings)
+        self.romKeys = assignKeys(spec.romEntries)
+        self.lines = []
+
+    def generate(self) -> str:
+        spec = self.spec
+        for locale in range(spec.locales):
+            self.generateStrings(localeName(locale))
+            self.generateROM(localeName(locale))
+
+        # The render sections expect at least 2 numbers on the stack
+        self.lines.append(".code init")
+        self.lines.append(f"push {self.romKeys[0][1]}c")
+        self.lines.append(f"push {self.romKeys[1][1]}c")
+        self.lines.append("")
+
+        self.lines.append(".render main")
+        for section in range(spec.sections):
+            self.lines.append(f"call section{section}")
+        self.lines.append("")
+
+        for section in range(spec.sections):
+            self.lines.append(f".render section{section}")
+            self.generateBody(section, spec.instructionsPerSection, True)
+            self.lines.append("")
+            self.lines.append(f".code handler{section}")
+            self.lines.append(f"push {self.romKey()}c")
+            self.lines.append("madd")
+            self.lines.append("rend")
+            self.lines.append("")
+        return "\n".join(self.lines)
+
+    def generateStrings(self, locale: str) -> None:
+        self.lines.append(f".strings {locale}")
+        for i, (idStr, _) in enumerate(self.stringKeys):
+            self.lines.append(f"Let {idStr} be translated to {locale} string number {i}.")
+        self.lines.append("")
+
+    def generateROM(self, locale: str) -> None:
+        self.lines.append(f".rom {locale}")
+        for i, (idStr, _) in enumerate(self.romKeys):
+            self.lines.append(f"Remember that {idStr} will always be {toBase11(i + 1)}.")
+        self.lines.append("")
+
+    def stringKey(self) -> int:
+        return self.random.choice(self.stringKeys)[1]
+
+    def romKey(self) -> int:
+        return self.random.choice(self.romKeys)[1]
+
+    def generateBody(self, section: int, instructions: int, isRender: bool) -> None:
+        # Every block is stack neutral, so the program is valid at runtime as well
+        closers: list[str] = []
+        emitted: int = 0
+        # The first section always reaches the maximum depth once
+        forceDepth: int = self.spec.nestingDepth if section == 0 else 0
+
+        while emitted < instructions:
+            remaining: int = instructions - emitted - len(closers)
+            roll: float = self.random.random()
+            if len(closers) < self.spec.nestingDepth and remaining > 4 and \
+                    (len(closers) < forceDepth or roll < 0.15):
+                if len(closers) + 1 >= forceDepth:
+                    forceDepth = 0
+                if isRender and self.random.random() < 0.6:
+                    self.lines.append(self.random.choice(("cont", "cont div", "cont p", "cont b")))
+                    closers.append("econ")
+                    emitted += 1
+                else:
+                    self.lines.append("copy")
+                    self.lines.append(f"push {self.romKey()}c")
+                    self.lines.append("comp")
+                    self.lines.append("ifis")
+                    closers.append("endi")
+                    emitted += 4
+            elif closers and (remaining <= 0 or roll < self.spec.closeChance):
+                self.lines.append(closers.pop())
+                emitted += 1
+            else:
+                emitted += self.generateLeaf(section, isRender)
+        while closers:
+            self.lines.append(closers.pop())
+
+    def generateLeaf(self, section: int, isRender: bool) -> int:
+        choice: float = self.random.random()
+        if isRender and choice < 0.35:
+            self.lines.append(f"text {self.stringKey()}t")
+        elif isRender and choice < 0.45:
+            self.lines.append("text 0s")
+        elif isRender and choice < 0.5:
+            self.lines.append(self.random.choice(("elem br", "elem hr")))
+        elif isRender and choice < 0.55:
+            self.lines.append(f"show {self.stringKey()}t")
+        elif isRender and choice < 0.6:
+            self.lines.append(f"hear click handler{section}")
+        elif choice < 0.75:
+            self.lines.append(f"push {self.romKey()}c")
+            self.lines.append("pops")
+            return 2
+        elif choice < 0.85:
+            self.lines.append("swap")
+        else:
+            self.lines.append("copy")
+            self.lines.append(f"push {self.romKey()}c")
+            self.lines.append(self.random.choice(("madd", "msub", "mmul")))
+            self.lines.append("pops")
+            return 4
+        return 1
+
+
+def generateProgram(spec: ProgramSpec) -> str:
+    return ProgramGenerator(spec).generate()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generates a valid EsoML program")
+    parser.add_argument("output", help="The path of the generated .eml file")
+    parser.add_argument("--sections", type=int, default=10)
+    parser.add_argument("--instructions-per-section", type=int, default=100)
+    parser.add_argument("--nesting-depth", type=int, default=4)
+    parser.add_argument("--strings", type=int, default=50)
+    parser.add_argument("--rom-entries", type=int, default=10)
+    parser.add_argument("--locales", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--close-chance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    spec = ProgramSpec(args.sections, args.instructions_per_section, args.nesting_depth,
+                       args.strings, args.rom_entries, args.locales, args.seed, args.close_chance)
+    with open(args.output, "w", encoding="utf-8") as f:
+        f.write(generateProgram(spec))
+    print(f"Generated {spec} into {args.output}")
+
+
+if __name__ == '__main__':
+    main()
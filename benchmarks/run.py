@@ -0,0 +1,150 @@
+#  -*- coding: utf-8 -*-
+__author__ = "kubik.augustyn@post.cz"
+
+import argparse
+import json
+import sys
+from os.path import dirname, abspath, join, exists
+from time import perf_counter
+from typing import Callable, Final, Any
+
+from kutil.language.Token import TokenOutput, Token
+
+from esoml.compiler import EsoMLCompiler
+from esoml.lexer import EsoMLLexer
+from esoml.parser import EsoMLParser
+from esoml.types import EsoMLOptions, OutputMode
+
+from benchmarks.generate import ProgramSpec, generateProgram
+
+BASELINES_PATH: Final[str] = join(dirname(abspath(__file__)), "baselines.json")
+PHASES: Final[tuple[str, ...]] = ("lex", "parse", "compile", "export")
+
+# Name --> program, roughly 1k to 1M instructions
+SUITES: Final[dict[str, ProgramSpec]] = {
+    "1k": ProgramSpec(sections=10, instructionsPerSection=100, nestingDepth=4, strings=50),
+    "10k": ProgramSpec(sections=50, instructionsPerSection=200, nestingDepth=6, strings=200),
+    "100k": ProgramSpec(sections=200, instructionsPerSection=500, nestingDepth=8, strings=1000,
+                        romEntries=50),
+    "1M": ProgramSpec(sections=1000, instructionsPerSection=1000, nestingDepth=8, strings=5000,
+                      romEntries=100),
+    "locales": ProgramSpec(sections=20, instructionsPerSection=100, nestingDepth=4, strings=500,
+                           romEntries=50, locales=20),
+    "deep": ProgramSpec(sections=1, instructionsPerSection=2000, nestingDepth=200, strings=10),
+    # The blocks are rarely closed before the end, so most of the code is nested in every level.
+    # The time per instruction should stay the same as the nesting gets 4x deeper.
+    "deep-2k": ProgramSpec(sections=1, instructionsPerSection=8000, nestingDepth=2000, strings=10,
+                           closeChance=0.01),
+    "deep-8k": ProgramSpec(sections=1, instructionsPerSection=32000, nestingDepth=8000,
+                           strings=10, closeChance=0.01),
+}
+DEFAULT_SUITES: Final[tuple[str, ...]] = ("1k", "10k", "100k", "locales", "deep")
+
+
+def timeIt[TResult](function: Callable[[], TResult], repeat: int) -> tuple[float, TResult]:
+    # Returns the best time of all the runs together with the result of the last one
+    best: float = float("inf")
+    result: TResult | None = None
+    for _ in range(repeat):
+        start: float = perf_counter()
+        result = function()
+        best = min(best, perf_counter() - start)
+    return best, result
+
+
+def benchmarkSuite(spec: ProgramSpec, repeat: int, outputMode: OutputMode,
+                   useNodeStore: bool = False) -> dict[str, float]:
+    source: str = generateProgram(spec)
+    lexer, parser, compiler = EsoMLLexer(), EsoMLParser(useNodeStore), EsoMLCompiler()
+
+    def options() -> EsoMLOptions:
+        return EsoMLOptions(locale="en_US", outputMode=outputMode)
+
+    def lex() -> list[Token]:
+        return list(lexer.tokenizeInner(source, options(), TokenOutput()))
+
+    lexTime, tokens = timeIt(lex, repeat)
+    parseTime, ast = timeIt(lambda: parser.parseInner(TokenOutput(iter(tokens)), options()),
+                            repeat)
+    compileTime, file = timeIt(lambda: compiler.compile(ast, options()), repeat)
+    exportTime, output = timeIt(file.export, repeat)
+
+    return {
+        "lex": lexTime,
+        "parse": parseTime,
+        "compile": compileTime,
+        "export": exportTime,
+        "tokens": len(tokens),
+        "instructionsPerSecond": spec.instructions / (lexTime + parseTime + compileTime),
+        "outputSize": len(output),
+    }
+
+
+def loadBaselines() -> dict[str, dict[str, float]]:
+    if not exists(BASELINES_PATH):
+        return {}
+    with open(BASELINES_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def saveBaselines(baselines: dict[str, dict[str, Any]]) -> None:
+    with open(BASELINES_PATH, "w", encoding="utf-8") as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compareToBaseline(name: str, results: dict[str, float], baseline: dict[str, float] | None,
+                      threshold: float) -> list[str]:
+    regressions: list[str] = []
+    for phase in PHASES:
+        line: str = f"  {phase:>8}: {results[phase] * 1000:10.2f}ms"
+        if baseline is not None and phase in baseline:
+            ratio: float = results[phase] / baseline[phase] if baseline[phase] else 1
+            line += f"  ({ratio:5.2f}x baseline)"
+            if ratio > threshold:
+                line += "  REGRESSION"
+                regressions.append(f"{name}/{phase}: {ratio:.2f}x slower than the baseline")
+        print(line)
+    print(f"  {results['instructionsPerSecond']:,.0f} instructions/s (lex + parse + compile), "
+          f"{results['tokens']:,} tokens, {results['outputSize']:,} characters of output")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks the EsoML compiler phases")
+    parser.add_argument("suites", nargs="*", default=list(DEFAULT_SUITES),
+                        help=f"The suites to run, out of {', '.join(SUITES)}")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each phase, the best wins")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="The slowdown ratio against the baseline considered a regression")
+    parser.add_argument("--output-mode", default=OutputMode.COMPACT.value,
+                        choices=[mode.value for mode in OutputMode])
+    parser.add_argument("--node-store", action="store_true",
+                        help="Parses into the array-backed NodeStore instead of the AST")
+    parser.add_argument("--save", action="store_true",
+                        help="Stores the results as the new baselines")
+    args = parser.parse_args()
+
+    baselines = loadBaselines()
+    regressions: list[str] = []
+    for name in args.suites:
+        if name not in SUITES:
+            parser.error(f"Unknown suite {name!r}")
+        spec: ProgramSpec = SUITES[name]
+        print(f"{name}: {spec.instructions:,} instructions, {spec}")
+        results = benchmarkSuite(spec, args.repeat, OutputMode(args.output_mode), args.node_store)
+        regressions += compareToBaseline(name, results, baselines.get(name), args.threshold)
+        if args.save:
+            baselines[name] = results
+
+    if args.save:
+        saveBaselines(baselines)
+        print(f"Saved the baselines to {BASELINES_PATH}")
+    if regressions:
+        print("Regressions:", *regressions, sep="\n  ")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,415 @@
+#  -*- coding: utf-8 -*-
+__author__ = "kubik.augustyn@post.cz"
+
+import logging
+from enum import Enum, unique, auto
+from typing import Final, Iterator
+
+from kutil.language.AST import AST
+from kutil.language.Error import CompilerError
+
+from esoml.lexer import Instruction
+from esoml.nodes import *
+from esoml.optimizer import ProgramConstants
+from esoml.tokens import ValueRef
+
+logger = logging.getLogger(__name__)
+
+INFINITY: Final[float] = float("inf")
+
+
+@unique
+class StepKind(Enum):
+    STACK = auto()  # An instruction working with the stack
+    CALL = auto()
+    IF = auto()  # Pops the condition, the steps up to the matching END_IF run only if it was 1
+    END_IF = auto()
+
+
+# A single instruction of a section, the sections are flattened, so that walking them is cheap
+class StackStep:
+    __slots__ = ("kind", "nodeI", "name", "required", "effect", "lowest", "hasFastPath", "callee")
+
+    kind: StepKind
+    nodeI: int
+    name: str  # For the error messages
+    required: int  # The depth the runtime checks for, 0 if it doesn't check the depth
+    effect: int  # The change of the depth
+    lowest: int  # The lowest depth reached while running, relative to the one before
+    hasFastPath: bool  # Whether the runtime has an unchecked variant of the instruction
+    callee: str | None
+
+    def __init__(self, kind: StepKind, nodeI: int, name: str, required: int = 0, effect: int = 0,
+                 lowest: int = 0, hasFastPath: bool = False, callee: str | None = None) -> None:
+        self.kind = kind
+        self.nodeI = nodeI
+        self.name = name
+        self.required = required
+        self.effect = effect
+        self.lowest = lowest
+        self.hasFastPath = hasFastPath
+        self.callee = callee
+
+
+# What running a section does to the stack, relative to the depth it was entered with.
+# None stands for an unknown bound (-inf for the lower bounds, +inf for the upper ones).
+class StackSummary:
+    minDelta: int | None
+    maxDelta: int | None
+    dip: int | None  # The lowest depth reached, the section can stop there because of an error
+    # (need, required, name) of the instruction that surely underflows when the section is entered
+    # with less than need values on the stack, the one with the highest need
+    failure: tuple[int, int, str] | None
+
+    def __init__(self, minDelta: int | None, maxDelta: int | None, dip: int | None,
+                 failure: tuple[int, int, str] | None) -> None:
+        self.minDelta = minDelta
+        self.maxDelta = maxDelta
+        self.dip = dip
+        self.failure = failure
+
+    def __repr__(self) -> str:
+        return (f"StackSummary(minDelta={self.minDelta}, maxDelta={self.maxDelta}, "
+                f"dip={self.dip}, failure={self.failure})")
+
+
+def addBound(bound: int | None, delta: int | None) -> int | None:
+    return None if bound is None or delta is None else bound + delta
+
+
+# Finds the stack instructions whose runtime checks can never fail, so that they can be compiled
+# into the unchecked variants, and raises a CompilerError for an underflow that surely happens.
+# The value stack lives as long as the page, so the depth when main or an event listener starts
+# is only bounded by what init leaves on the stack, and only if none of them can end (or fail)
+# with less values on the stack than it started with. The depth is then bounded at the start of
+# every section by the call sites and inside the sections by the instructions, across the calls
+# (using the summaries of the callees) and if statements (both outcomes). Recursive sections are
+# only assumed to be entered with an empty stack and to have an unknown effect.
+class StackAnalysis:
+    ast: AST
+    constants: ProgramConstants
+    steps: dict[str, list[StackStep]]  # Label --> the flattened code section
+    listeners: set[str]  # The labels of all the event listeners
+    summaries: dict[str, StackSummary]  # Only of the sections that aren't recursive
+    candidates: dict[str, list[tuple[int, int]]]  # Label --> (node, the entry depth it needs)
+    callSites: dict[str, list[tuple[str, int | None]]]  # Label --> (callee, the depth lower bound)
+    unchecked: set[int]  # The nodes that need no check, whatever the depth is
+
+    def __init__(self, ast: AST, constants: ProgramConstants | None = None) -> None:
+        self.ast = ast
+        self.constants = constants if constants is not None else ProgramConstants.fromAST(ast)
+        self.steps = {}
+        self.listeners = set()
+        self.summaries = {}
+        self.candidates = {}
+        self.callSites = {}
+        self.unchecked = set()
+
+    def analyze(self) -> frozenset[int]:
+        # Returns the indices of the nodes that can be compiled without the runtime stack checks
+        for root in self.ast.rootNodes():
+            if root.type is NodeType.SECTION_CODE:
+                assert isinstance(root, SectionCodeNode)
+                # The last section with a label replaces the others, just like in the runtime
+                self.steps[root.label] = self.flatten(root)
+        order, recursive = self.callOrder()
+        for label in order:
+            summary: StackSummary = self.analyzeSection(label)
+            if label not in recursive:
+                self.summaries[label] = summary
+        self.checkUnderflows()
+
+        checked: int = len(self.unchecked)
+        for label, depth in self.entryDepths(order, recursive).items():
+            for nodeI, needed in self.candidates[label]:
+                checked += 1
+                if depth >= needed:
+                    self.unchecked.add(nodeI)
+        logger.info("The stack analysis proved %d out of %d checked instructions safe",
+                    len(self.unchecked), checked)
+        return frozenset(self.unchecked)
+
+    def flatten(self, root: SectionCodeNode) -> list[StackStep]:
+        steps: list[StackStep] = []
+        # Each level: (its children not flattened yet, whether it's an if statement)
+        stack: list[tuple[Iterator[int], bool]] = [(iter(root.children), False)]
+        while stack:
+            children, isIf = stack[-1]
+            for nodeI in children:
+                node: ASTNode = self.ast.getNode(nodeI)
+                if node.type is NodeType.CONTAINER:
+                    stack.append((iter(node.children), False))
+                    break
+                if node.type is NodeType.IF_STATEMENT:
+                    steps.append(StackStep(StepKind.IF, nodeI, self.describe(
+                        Instruction.START_IF.value, root.label), 1, -1, -1, True))
+                    stack.append((iter(node.children), True))
+                    break
+                step: StackStep | None = self.stepFor(node, nodeI, root.label)
+                if step is not None:
+                    steps.append(step)
+            else:
+                stack.pop()
+                if isIf:
+                    steps.append(StackStep(StepKind.END_IF, -1, ""))
+        return steps
+
+    def stepFor(self, node: ASTNode, nodeI: int, label: str) -> StackStep | None:
+        if node.type is NodeType.STACK_PUSH:
+            assert isinstance(node, StackPushNode)
+            name: str = self.describe(Instruction.STACK_PUSH.value, label)
+            value: ValueRef | LiteralValue = node.value
+            if isinstance(value, LiteralValue) or value.kind is ValueRef.ValueRefKind.STRING:
+                return StackStep(StepKind.STACK, nodeI, name, 0, 1, 0, True)
+            if value.kind is ValueRef.ValueRefKind.CONSTANT:
+                # The value of the constant is checked unless it is safe in every locale
+                return StackStep(StepKind.STACK, nodeI, name, 0, 1, 0,
+                                 value.key in self.constants.safeROMKeys)
+            # A negative offset is always out of bounds, so it can never go without the check
+            return StackStep(StepKind.STACK, nodeI, name, value.key + 1, 1, 0, value.key >= 0)
+        elif node.type is NodeType.RAW_VALUE:
+            assert isinstance(node, RawValueNode)
+            if not isinstance(node.value, ValueRef) or \
+                    node.value.kind is not ValueRef.ValueRefKind.STACK:
+                return None
+            instruction: Instruction = Instruction.SHOW if node.injectRaw else Instruction.TEXT
+            return StackStep(StepKind.STACK, nodeI, self.describe(instruction.value, label),
+                             node.value.key + 1, 0, 0, node.value.key >= 0)
+        elif node.type is NodeType.STACK_COPY:
+            return StackStep(StepKind.STACK, nodeI,
+                             self.describe(Instruction.STACK_COPY.value, label), 1, 1, 0, True)
+        elif node.type is NodeType.STACK_POP:
+            return StackStep(StepKind.STACK, nodeI,
+                             self.describe(Instruction.STACK_POP.value, label), 1, -1, -1, True)
+        elif node.type is NodeType.STACK_SWAP:
+            assert isinstance(node, StackSwapNode)
+            return StackStep(StepKind.STACK, nodeI, self.describe(
+                f"{Instruction.STACK_SWAP.value} {node.offA} {node.offB}", label),
+                             max(node.offA, node.offB) + 1, 0, 0, True)
+        elif node.type is NodeType.COMPARE:
+            return StackStep(StepKind.STACK, nodeI,
+                             self.describe(Instruction.COMPARE.value, label), 2, -1, -1, True)
+        elif node.type is NodeType.MATH_OP:
+            assert isinstance(node, MathOpNode)
+            # Both values are popped before the result is checked, so a failed calculation leaves
+            # the stack two values lower
+            return StackStep(StepKind.STACK, nodeI,
+                             self.describe(mathInstructions[node.operation].value, label),
+                             2, -1, -2, True)
+        elif node.type is NodeType.READ:
+            # The read value is always checked
+            return StackStep(StepKind.STACK, nodeI, self.describe(Instruction.READ.value, label),
+                             0, 1, 0)
+        elif node.type is NodeType.CALL:
+            assert isinstance(node, CallNode)
+            return StackStep(StepKind.CALL, nodeI, self.describe(Instruction.CALL.value, label),
+                             callee=node.label)
+        elif node.type is NodeType.ADD_EVENT_LISTENER:
+            assert isinstance(node, AddEventListenerNode)
+            self.listeners.add(node.listener)
+        return None
+
+    @staticmethod
+    def describe(instruction: str, label: str) -> str:
+        return f"{instruction!r} in the section {label!r}"
+
+    def callOrder(self) -> tuple[list[str], set[str]]:
+        graph: dict[str, list[str]] = {
+            label: [step.callee for step in steps if step.kind is StepKind.CALL and
+                    step.callee in self.steps]
+            for label, steps in self.steps.items()
+        }
+        return orderCallGraph(graph)
+
+    def analyzeSection(self, label: str) -> StackSummary:
+        # The bounds are relative to the depth the section was entered with
+        low, high, dip = 0, 0, 0
+        failure: tuple[int, int, str] | None = None
+        definite: bool = True  # Whether the instruction surely runs once the section is entered
+        outerStates: list[tuple[int | None, int | None, bool]] = []  # Before the if statements
+        candidates: list[tuple[int, int]] = self.candidates.setdefault(label, [])
+        callSites: list[tuple[str, int | None]] = self.callSites.setdefault(label, [])
+
+        for step in self.steps[label]:
+            if step.kind is StepKind.END_IF:
+                # Either the block ran, or it didn't
+                bodyLow, bodyHigh = low, high
+                low, high, definite = outerStates.pop()
+                low = None if low is None or bodyLow is None else min(low, bodyLow)
+                high = None if high is None or bodyHigh is None else max(high, bodyHigh)
+                continue
+            if step.kind is StepKind.CALL:
+                callSites.append((step.callee, low))
+                summary: StackSummary | None = self.summaries.get(step.callee)
+                if summary is None:
+                    # A recursive or an undefined section
+                    low = high = dip = None
+                    continue
+                if definite and high is not None and summary.failure is not None:
+                    need, required, name = summary.failure
+                    if failure is None or need - high > failure[0]:
+                        failure = (need - high, required, name)
+                dip = None if dip is None or low is None or summary.dip is None else \
+                    min(dip, low + summary.dip)
+                low, high = addBound(low, summary.minDelta), addBound(high, summary.maxDelta)
+                continue
+
+            if step.hasFastPath:
+                if step.required == 0:
+                    self.unchecked.add(step.nodeI)
+                elif low is not None:
+                    candidates.append((step.nodeI, step.required - low))
+            if definite and high is not None and step.required > 0 and \
+                    (failure is None or step.required - high > failure[0]):
+                failure = (step.required - high, step.required, step.name)
+            dip = None if dip is None or low is None else min(dip, low + step.lowest)
+            low, high = addBound(low, step.effect), addBound(high, step.effect)
+            if step.kind is StepKind.IF:
+                outerStates.append((low, high, definite))
+                definite = False
+        return StackSummary(low, high, dip, failure)
+
+    def checkUnderflows(self) -> None:
+        # init runs right after the page loads, starting with an empty stack, and main renders
+        # right after it, so their instructions outside the if statements surely run
+        depth: int = 0  # The upper bound of the depth
+        for label in ("init", "main"):
+            if label not in self.steps:
+                continue
+            summary: StackSummary | None = self.summaries.get(label)
+            if summary is None:
+                return
+            if summary.failure is not None and summary.failure[0] > depth:
+                need, required, name = summary.failure
+                raise CompilerError(ValueError(
+                    f"Stack underflow: {name} needs {required} value(s) on the stack, but there "
+                    f"can be at most {depth + required - need} of them"))
+            if summary.maxDelta is None:
+                return
+            depth += summary.maxDelta
+
+    def entryDepths(self, order: list[str], recursive: set[str]) -> dict[str, int]:
+        # Returns the lower bound of the depth every section is entered with
+        initDepth: int = 0
+        if "init" in self.steps:
+            init: StackSummary | None = self.summaries.get("init")
+            initDepth = max(init.minDelta, 0) if init is not None and \
+                init.minDelta is not None else 0
+        roots: set[str] = {label for label in self.listeners | {"main"} if label in self.steps}
+        # What init left on the stack stays there only if no run of the roots can take it away
+        stable: bool = all(self.summaries.get(label) is not None and
+                           self.summaries[label].dip is not None and
+                           self.summaries[label].dip >= 0 for label in roots)
+        incoming: dict[str, float] = {label: initDepth if stable else 0 for label in roots}
+        if "init" in self.steps:
+            incoming["init"] = 0
+
+        depths: dict[str, int] = {}
+        for label in reversed(order):
+            depth: float = 0 if label in recursive else incoming.get(label, INFINITY)
+            if depth == INFINITY:
+                depth = 0  # Never runs
+            depths[label] = depth = int(depth)
+            for callee, low in self.callSites[label]:
+                if callee in self.steps:
+                    callDepth: int = 0 if low is None else max(depth + low, 0)
+                    incoming[callee] = min(incoming.get(callee, INFINITY), callDepth)
+        return depths
+
+
+def findStaticContainers(ast: AST) -> frozenset[int]:
+    # Returns the outermost containers rendering the same elements every time, as they only hold
+    # elements and strings, constants or literals, so the runtime can render them once and then
+    # only clone them
+    static: set[int] = set()
+    for root in ast.rootNodes():
+        if root.type is not NodeType.SECTION_CODE:
+            continue
+        assert isinstance(root, SectionCodeNode)
+        # Each level: [node index, its children not checked yet, whether all the checked ones are
+        # static, the static containers among them]. The section and if statements are never static.
+        stack: list[list] = [[-1, iter(root.children), False, []]]
+        while stack:
+            level: list = stack[-1]
+            for nodeI in level[1]:
+                node: ASTNode = ast.getNode(nodeI)
+                if node.type in {NodeType.CONTAINER, NodeType.IF_STATEMENT}:
+                    stack.append([nodeI, iter(node.children), node.type is NodeType.CONTAINER, []])
+                    break
+                if not isStaticLeaf(node):
+                    level[2] = False
+            else:
+                stack.pop()
+                nodeI, _, isStatic, staticChildren = level
+                if isStatic and stack:
+                    stack[-1][3].append(nodeI)
+                    continue
+                static.update(staticChildren)
+                if stack:
+                    stack[-1][2] = False
+    return frozenset(static)
+
+
+def isStaticLeaf(node: ASTNode) -> bool:
+    if node.type is NodeType.ELEM:
+        return True
+    if node.type is NodeType.RAW_VALUE:
+        assert isinstance(node, RawValueNode)
+        return not isinstance(node.value, ValueRef) or \
+            node.value.kind is not ValueRef.ValueRefKind.STACK
+    return False
+
+
+def orderCallGraph(graph: dict[str, list[str]]) -> tuple[list[str], set[str]]:
+    # Returns the sections ordered so that the callees go before their callers, and the sections
+    # that can call themselves (Tarjan's algorithm without recursion). The graph maps a label to
+    # the labels it calls, all of them in the graph.
+    indices: dict[str, int] = {}
+    lowLinks: dict[str, int] = {}
+    components: list[str] = []  # The stack of the sections not assigned to a component yet
+    onStack: set[str] = set()
+    order: list[str] = []
+    recursive: set[str] = set()
+
+    for start in graph:
+        if start in indices:
+            continue
+        indices[start] = lowLinks[start] = len(indices)
+        components.append(start)
+        onStack.add(start)
+        work: list[tuple[str, Iterator[str]]] = [(start, iter(graph[start]))]
+        while work:
+            label, callees = work[-1]
+            for callee in callees:
+                if callee not in indices:
+                    indices[callee] = lowLinks[callee] = len(indices)
+                    components.append(callee)
+                    onStack.add(callee)
+                    work.append((callee, iter(graph[callee])))
+                    break
+                if callee in onStack:
+                    lowLinks[label] = min(lowLinks[label], indices[callee])
+            else:
+                work.pop()
+                if work:
+                    caller: str = work[-1][0]
+                    lowLinks[caller] = min(lowLinks[caller], lowLinks[label])
+                if lowLinks[label] != indices[label]:
+                    continue
+                component: list[str] = []
+                while not component or component[-1] != label:
+                    component.append(components.pop())
+                    onStack.discard(component[-1])
+                if len(component) > 1 or label in graph[label]:
+                    recursive.update(component)
+                order.extend(component)
+    return order, recursive
+
+
+# MathOpNode.Operation --> its instruction
+mathInstructions: Final[dict[MathOpNode.Operation, Instruction]] = {
+    MathOpNode.Operation.ADD: Instruction.MATH_ADD,
+    MathOpNode.Operation.SUB: Instruction.MATH_SUB,
+    MathOpNode.Operation.MUL: Instruction.MATH_MULT,
+    MathOpNode.Operation.DIV: Instruction.MATH_DIV,
+}
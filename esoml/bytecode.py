@@ -0,0 +1,124 @@
+#  -*- coding: utf-8 -*-
+__author__ = "kubik.augustyn@post.cz"
+
+import struct
+from base64 import b64encode
+from enum import IntEnum, unique
+from typing import Final, Any
+
+from esoml.nodes import LiteralValue
+from esoml.tokens import ValueRef
+
+
+# The instructions of the bytecode backend, the runtime's interpreter (runBytecode in lib.js) has
+# the same numbers. An instruction is its opcode, its ID (only outside production) and operands.
+# All the operands except for the jumps and the templates are indexes into the section's constants.
+@unique
+class Opcode(IntEnum):
+    CONTAINER = 0  # tag (-1 for none), end
+    STATIC_CONTAINER = 1  # template, tag (-1 for none), end
+    IF_STATEMENT = 2  # end
+    IF_STATEMENT_UNCHECKED = 3  # end
+    ELEM = 4  # tag
+    RAW_VALUE = 5  # injectRaw (0 or 1), value kind, value
+    CALL = 6  # label
+    RENDER = 7
+    ADD_EVENT_LISTENER = 8  # event, listener
+    STACK_PUSH = 9  # value kind, value
+    STACK_PUSH_UNCHECKED = 10  # value kind, value
+    STACK_COPY = 11
+    STACK_COPY_UNCHECKED = 12
+    STACK_POP = 13
+    STACK_POP_UNCHECKED = 14
+    STACK_SWAP = 15  # offA, offB
+    STACK_SWAP_UNCHECKED = 16  # offA, offB
+    COMPARE = 17
+    COMPARE_UNCHECKED = 18
+    READ = 19
+    MATH_OP = 20  # operation
+    MATH_OP_UNCHECKED = 21  # operation
+
+
+# How the interpreter gets a value out of the constant it refers to
+@unique
+class ValueKind(IntEnum):
+    STRING = 0  # getString(key)
+    CONSTANT = 1  # getConstant(key)
+    STACK = 2  # getStack(offset)
+    STACK_UNCHECKED = 3  # getStackUnchecked(offset)
+    LITERAL = 4  # The constant itself
+
+
+# The variants of the instructions proved safe by the stack analysis, see StackAnalysis
+uncheckedOpcodes: Final[dict[Opcode, Opcode]] = {
+    Opcode.IF_STATEMENT: Opcode.IF_STATEMENT_UNCHECKED,
+    Opcode.STACK_PUSH: Opcode.STACK_PUSH_UNCHECKED,
+    Opcode.STACK_COPY: Opcode.STACK_COPY_UNCHECKED,
+    Opcode.STACK_POP: Opcode.STACK_POP_UNCHECKED,
+    Opcode.STACK_SWAP: Opcode.STACK_SWAP_UNCHECKED,
+    Opcode.COMPARE: Opcode.COMPARE_UNCHECKED,
+    Opcode.MATH_OP: Opcode.MATH_OP_UNCHECKED,
+}
+refValueKinds: Final[dict[ValueRef.ValueRefKind, ValueKind]] = {
+    ValueRef.ValueRefKind.STRING: ValueKind.STRING,
+    ValueRef.ValueRefKind.CONSTANT: ValueKind.CONSTANT,
+    ValueRef.ValueRefKind.STACK: ValueKind.STACK,
+}
+NO_TAG: Final[int] = -1
+
+
+# Encodes the code of a single section, so that a section is self-contained and can be compiled on
+# its own (streaming, incremental compilation). The code is shipped as base64 of 32-bit little
+# endian integers, which the runtime decodes into an Int32Array, the constants as a JS array.
+class BytecodeWriter:
+    production: bool
+    code: list[int]
+    constants: list[str | int]
+    constantIndexes: dict[tuple[type, str | int], int]  # (type, constant) --> its index
+
+    def __init__(self, production: bool) -> None:
+        self.production = production
+        self.code = []
+        self.constants = []
+        self.constantIndexes = {}
+
+    def constant(self, constant: str | int) -> int:
+        # 1 and "1" are different constants
+        key: tuple[type, str | int] = (type(constant), constant)
+        index: int | None = self.constantIndexes.get(key)
+        if index is None:
+            index = self.constantIndexes[key] = len(self.constants)
+            self.constants.append(constant)
+        return index
+
+    def value(self, value: ValueRef | LiteralValue, unchecked: bool = False) -> tuple[int, int]:
+        # The value kind and value operands
+        if isinstance(value, LiteralValue):
+            return ValueKind.LITERAL, self.constant(value.value)
+        kind: ValueKind = refValueKinds[value.kind]
+        if unchecked and kind is ValueKind.STACK:
+            kind = ValueKind.STACK_UNCHECKED
+        return kind, self.constant(value.key)
+
+    def emit(self, opcode: Opcode, id_: int | None, *operands: int) -> None:
+        self.code.append(opcode)
+        if not self.production:
+            self.code.append(id_)
+        self.code.extend(operands)
+
+    def open(self, opcode: Opcode, id_: int | None, *operands: int) -> int:
+        # Emits an instruction with children, returns the slot of its end, filled by close
+        self.emit(opcode, id_, *operands, 0)
+        return len(self.code) - 1
+
+    def close(self, slot: int) -> None:
+        self.code[slot] = len(self.code)
+
+    def export(self) -> str:
+        # The arguments of the runtime's bytecode function after the label and isRenderable
+        encoded: str = b64encode(struct.pack(f"<{len(self.code)}i", *self.code)).decode("ascii")
+        return f"'{encoded}',[{','.join(map(constantCode, self.constants))}]"
+
+
+def constantCode(constant: Any) -> str:
+    return ascii(constant) if isinstance(constant, str) else str(constant)
@@ -0,0 +1,65 @@
+#  -*- coding: utf-8 -*-
+__author__ = "kubik.augustyn@post.cz"
+
+from collections import OrderedDict
+from hashlib import sha256
+from typing import Callable
+
+
+def hashSource(source: str) -> str:
+    return sha256(source.encode("utf-8")).hexdigest()
+
+
+class LRUCache[TKey, TValue]:
+    maxSize: int
+    hits: int
+    misses: int
+    evictions: int
+    _entries: OrderedDict[TKey, TValue]
+
+    def __init__(self, maxSize: int = 32) -> None:
+        if maxSize < 1:
+            raise ValueError("The cache must be able to hold at least one entry")
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def get(self, key: TKey, default: TValue | None = None) -> TValue | None:
+        if key not in self._entries:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key: TKey, value: TValue) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxSize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def getOrCompute(self, key: TKey, compute: Callable[[], TValue]) -> TValue:
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        self.misses += 1
+        value: TValue = compute()
+        self.put(key, value)
+        return value
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __contains__(self, key: TKey) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __repr__(self) -> str:
+        return (f"LRUCache(size={len(self)}/{self.maxSize}, hits={self.hits}, "
+                f"misses={self.misses}, evictions={self.evictions})")
@@ -1,21 +1,56 @@
 #  -*- coding: utf-8 -*-
 __author__ = "kubik.augustyn@post.cz"
 
+from esoml.cache import LRUCache, hashSource
 from esoml.compiler import EsoMLCompiledFile
 
 from esoml.language import EsoML
+from esoml.prerender import prerenderMain
+from esoml.program import ParsedProgram
+from esoml.streaming import StreamingCompiler
 
 from esoml.types import EsoMLOptions
 
 _lang: EsoML | None = None  # Reuse the instance
+_programs: LRUCache[str, ParsedProgram] = LRUCache(maxSize=8)  # Source hash --> program
 
 
-def compileEsoML(code: str, options: EsoMLOptions | None = None) -> EsoMLCompiledFile:
+def _getLanguage() -> EsoML:
     global _lang
     if _lang is None:
         lang: EsoML = EsoML()
         _lang = lang
     else:
         lang: EsoML = _lang
+    return lang
+
+
+def parseEsoML(code: str) -> ParsedProgram:
+    return _programs.getOrCompute(hashSource(code), lambda: _getLanguage().parse(code))
+
+
+def compileEsoML(code: str | ParsedProgram, options: EsoMLOptions | None = None) -> \
+        EsoMLCompiledFile:
+    options: EsoMLOptions = options or EsoMLOptions()
+    program: ParsedProgram = parseEsoML(code) if isinstance(code, str) else code
+    return _getLanguage().compile(program, options)
+
+
+def compileEsoMLAllLocales(code: str | ParsedProgram, options: EsoMLOptions | None = None) -> \
+        dict[str, EsoMLCompiledFile]:
+    options: EsoMLOptions = options or EsoMLOptions()
+    program: ParsedProgram = parseEsoML(code) if isinstance(code, str) else code
+    return _getLanguage().compileAllLocales(program, options)
+
+
+def prerenderEsoML(code: str | ParsedProgram, locale: str | None = None) -> str | None:
+    # The HTML of the first render of main, None if the page can't be prerendered
+    program: ParsedProgram = parseEsoML(code) if isinstance(code, str) else code
+    return prerenderMain(program, EsoMLOptions(locale=locale).getCompilerOptions().locale)
+
+
+def compileEsoMLFile(path: str, options: EsoMLOptions | None = None) -> EsoMLCompiledFile:
+    # Streams the file section by section instead of reading, lexing and parsing it all at once
+    # The whole-program optimizations are skipped, see StreamingCompiler
     options: EsoMLOptions = options or EsoMLOptions()
-    return lang.compile(code, options)
+    return StreamingCompiler().compileFile(path, options)
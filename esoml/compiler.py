@@ -1,35 +1,100 @@
 #  -*- coding: utf-8 -*-
 __author__ = "kubik.augustyn@post.cz"
 
-from kutil import readFile
+import logging
+from typing import Iterator, Callable, Final, TextIO
+
 from kutil.language.Error import CompilerError
-from esoml.types import EsoMLOptions
+from esoml.analysis import StackAnalysis, findStaticContainers
+from esoml.bytecode import BytecodeWriter, Opcode, uncheckedOpcodes, NO_TAG
+from esoml.inlining import InliningPlan
+from esoml.runtime import loadRuntime
+from esoml.stats import CompileStats
+from esoml.tokens import ValueRef
+from esoml.types import EsoMLOptions, CompilerOptions, OutputMode, OptimizationLevel, Backend
 from kutil.language.AST import AST
 from jsbeautifier import beautify
 
 from esoml.nodes import *
+from esoml.nodestore import NodeStore, nodeTypes, NO_OPERAND
+
+logger = logging.getLogger(__name__)
 
 
 class EsoMLCompiledFile:
     unsafeMode: bool
+    locale: str | None
+    outputMode: OutputMode
+    production: bool
+    backend: Backend
+    frameBudget: float  # The settings of the runtime's render scheduler, see CompilerOptions
+    renderLoopLimit: int
     strings: dict[int, str]
     rom: dict[int, int]
     currentID: int
     codeSections: dict[str, str]
     codeSectionsRenderable: dict[str, bool]
+    uncheckedNodes: frozenset[int]  # The nodes to compile without the runtime stack checks
+    inlining: InliningPlan | None  # The calls to replace by the called sections, None for none
+    staticNodes: frozenset[int]  # The containers rendered once and cloned afterwards
+    templates: dict[int, int]  # Static container --> the index of its template in the runtime
+    stats: CompileStats
 
-    def __init__(self, unsafeMode: bool) -> None:
+    def __init__(self, unsafeMode: bool, locale: str | None = None,
+                 outputMode: OutputMode = OutputMode.PRETTY, production: bool = False,
+                 backend: Backend = Backend.CLOSURES, frameBudget: float = 8,
+                 renderLoopLimit: int = 60) -> None:
         self.unsafeMode = unsafeMode
+        self.locale = locale
+        self.outputMode = outputMode
+        self.production = production
+        self.backend = backend
+        self.frameBudget = frameBudget
+        self.renderLoopLimit = renderLoopLimit
         self.strings = {}
         self.rom = {}
         self.currentID = 0
         self.codeSections = {}
         self.codeSectionsRenderable = {}
+        self.uncheckedNodes = frozenset()
+        self.inlining = None
+        self.staticNodes = frozenset()
+        self.templates = {}
+        self.stats = CompileStats()
+
+    def localized(self, locale: str) -> "EsoMLCompiledFile":
+        # The compiled code sections are shared, only the constant tables are per-locale
+        file: EsoMLCompiledFile = EsoMLCompiledFile(self.unsafeMode, locale, self.outputMode,
+                                                    self.production, self.backend,
+                                                    self.frameBudget, self.renderLoopLimit)
+        file.currentID = self.currentID
+        file.codeSections = self.codeSections
+        file.codeSectionsRenderable = self.codeSectionsRenderable
+        return file
 
     def id(self) -> str:
         self.currentID += 1
         return hex(self.currentID)
 
+    def idArg(self) -> str:
+        # The ID argument of a runtime call, the production runtime takes no IDs
+        return "" if self.production else self.id()
+
+    def idArgPrefix(self) -> str:
+        # The same for the calls with more arguments
+        return "" if self.production else self.id() + ","
+
+    def bytecodeID(self) -> int | None:
+        # The ID operand of an instruction, see BytecodeWriter
+        if self.production:
+            return None
+        self.currentID += 1
+        return self.currentID
+
+    def template(self, nodeI: int) -> int:
+        # The inlined sections share the templates of their static containers
+        return self.templates.setdefault(nodeI, len(self.templates))
+
     def exportStrings(self) -> str:
         return self.exportConstants(self.strings, "strings")
 
@@ -43,21 +108,64 @@ class EsoMLCompiledFile:
         return func + "([" + ",".join(result) + "])"
 
     def exportCodes(self) -> str:
-        result: list[str] = []
+        return "".join(self.iterExportCodes())
+
+    def iterExportCodes(self) -> Iterator[str]:
+        # The compiled code of a section is a part on its own, so that it only gets copied once,
+        # into the joined output, and not into a bigger string per section first
+        separator: str = ""
+        if self.backend is Backend.BYTECODE:
+            function, opening, closing = "bytecode", "", ")"
+        else:
+            function, opening, closing = "code", "()=>{", "})"
         for label, compiled in self.codeSections.items():
             renderable: bool = self.codeSectionsRenderable[label]
-            result.append(f"code({ascii(label)},!{'0' if renderable else '1'},()=>{{{compiled}}})")
-        return ";".join(result)
+            yield f"{separator}{function}({ascii(label)},!{'0' if renderable else '1'},{opening}"
+            yield compiled
+            yield closing
+            separator = ";"
 
     def exportUnsafeMode(self) -> str:
         return f"setUnsafeMode(!{'0' if self.unsafeMode else '1'})"
 
+    def exportRenderScheduler(self) -> str:
+        return f"setRenderScheduler({self.frameBudget:g},{self.renderLoopLimit})"
+
     def export(self) -> str:
-        from os.path import dirname, abspath, join
-        lib = readFile(join(dirname(abspath(__file__)), "lib.js"), "text")
-        code = f'{self.exportUnsafeMode()};{self.exportStrings()};{self.exportROM()};{self.exportCodes()};'
-        # beautify = lambda code: code # Uncomment to temporarily disable the beautifier
-        return beautify(lib.replace(r"// EsoML COMPILED CODE", code))
+        if self.outputMode is not OutputMode.PRETTY:
+            return "".join(self.iterExport())
+        with self.stats.measure("export"):
+            before, after = loadRuntime(production=self.production)
+            result: str = beautify("".join((
+                before, self.exportUnsafeMode(), ";", self.exportRenderScheduler(), ";",
+                self.exportStrings(), ";", self.exportROM(),
+                ";", *self.iterExportCodes(), ";", after
+            )))
+        self.stats.outputSize = len(result)
+        return result
+
+    def iterExport(self) -> Iterator[str]:
+        if self.outputMode is OutputMode.PRETTY:
+            # The beautifier needs to see the whole bundle at once
+            return iter((self.export(),))
+        return self.stats.measureIterator("export", self.iterExportChunks())
+
+    def iterExportChunks(self) -> Iterator[str]:
+        before, after = loadRuntime(self.outputMode is OutputMode.MINIFIED, self.production)
+        yield before
+        yield self.exportUnsafeMode() + ";"
+        yield self.exportRenderScheduler() + ";"
+        yield self.exportStrings() + ";"
+        yield self.exportROM() + ";"
+        yield from self.iterExportCodes()
+        yield ";"
+        yield after
+
+    def exportTo(self, fp: TextIO) -> int:
+        written: int = 0
+        for chunk in self.iterExport():
+            written += fp.write(chunk)
+        return written
 
     def __repr__(self) -> str:
         codeSections = {}
@@ -67,23 +175,21 @@ class EsoMLCompiledFile:
             else:
                 codeSections[name] = "(code only)"
 
-        return (f"EsoMLCompiledFile(unsafeMode={self.unsafeMode}, strings={self.strings}, "
+        return (f"EsoMLCompiledFile(unsafeMode={self.unsafeMode}, locale={self.locale}, "
+                f"outputMode={self.outputMode}, production={self.production}, "
+                f"backend={self.backend}, strings={self.strings}, "
                 f"rom={self.rom}, codeSections={codeSections})")
 
 
 class EsoMLCompiler:
     def compile(self, ast: AST, options: EsoMLOptions) -> EsoMLCompiledFile:
         locale: str = options.getCompilerOptions().locale
-        unsafeMode: bool = options.getCompilerOptions().unsafeMode
-        file: EsoMLCompiledFile = EsoMLCompiledFile(unsafeMode)
-        print("Compiling with these compiler options:", repr(options.getCompilerOptions()))
+        logger.info("Compiling with these compiler options: %r", options.getCompilerOptions())
         # print(f"Compiling with the locale set to {locale} with unsafe mode set to {unsafeMode}")
 
-        self.compileConstants(ast, locale, NodeType.SECTION_STRINGS, SectionStringsNode,
-                              StringEntryNode, file.strings, "strings")
-        self.compileConstants(ast, locale, NodeType.SECTION_ROM, SectionROMNode, ROMEntryNode,
-                              file.rom, "rom")
-        self.compileCodeSections(ast, file)
+        code: EsoMLCompiledFile = self.compileCode(ast, options)
+        file: EsoMLCompiledFile = code.localized(locale)
+        self.compileLocale(ast, locale, file)
 
         # for label, code in file.codeSections.items():
         #     print(label + ":")
@@ -91,6 +197,50 @@ class EsoMLCompiler:
 
         return file
 
+    def compileAllLocales(self, ast: AST, options: EsoMLOptions) -> dict[str, EsoMLCompiledFile]:
+        logger.info("Compiling all locales with these compiler options: %r",
+                    options.getCompilerOptions())
+
+        code: EsoMLCompiledFile = self.compileCode(ast, options)
+        files: dict[str, EsoMLCompiledFile] = {}
+        for locale in self.findLocales(ast):
+            file: EsoMLCompiledFile = code.localized(locale)
+            self.compileLocale(ast, locale, file)
+            files[locale] = file
+        return files
+
+    def compileCode(self, ast: AST, options: EsoMLOptions) -> EsoMLCompiledFile:
+        # The code sections don't depend on the locale, so they can be shared across locales
+        compilerOptions: CompilerOptions = options.getCompilerOptions()
+        file: EsoMLCompiledFile = EsoMLCompiledFile(compilerOptions.unsafeMode,
+                                                    outputMode=compilerOptions.outputMode,
+                                                    production=compilerOptions.production,
+                                                    backend=compilerOptions.backend,
+                                                    frameBudget=compilerOptions.frameBudget,
+                                                    renderLoopLimit=compilerOptions.renderLoopLimit)
+        if compilerOptions.optimizationLevel >= OptimizationLevel.O1:
+            file.uncheckedNodes = StackAnalysis(ast).analyze()
+            file.staticNodes = findStaticContainers(ast)
+            if compilerOptions.inlineThreshold > 0:
+                file.inlining = InliningPlan(ast, compilerOptions.inlineThreshold)
+        self.compileCodeSections(ast, file)
+        return file
+
+    def compileLocale(self, ast: AST, locale: str, file: EsoMLCompiledFile) -> None:
+        self.compileConstants(ast, locale, NodeType.SECTION_STRINGS, SectionStringsNode,
+                              StringEntryNode, file.strings, "strings")
+        self.compileConstants(ast, locale, NodeType.SECTION_ROM, SectionROMNode, ROMEntryNode,
+                              file.rom, "rom")
+
+    @staticmethod
+    def findLocales(ast: AST) -> list[str]:
+        locales: dict[str, None] = {}  # Ordered set
+        for root in ast.rootNodes():
+            if root.type in {NodeType.SECTION_STRINGS, NodeType.SECTION_ROM}:
+                assert isinstance(root, LocalizedSectionNode)
+                locales[root.locale] = None
+        return list(locales)
+
     def compileConstants(self, ast: AST, locale: str, section: NodeType,
                          sectionNodeType: type[LocalizedSectionNode],
                          entryType: type[LocalizedSectionEntryNode], targetMap: dict,
@@ -105,95 +255,408 @@ class EsoMLCompiler:
                 continue
             if hasLocale:
                 # Ik, only checks for the current locale redefinition, but that's fine
-                raise CompilerError(ValueError(f"The current locale {locale} was already defined"))
+                raise self.localeRedefinedError(locale)
             hasLocale = True
-            for node in ast.getNodes(root.children):
-                assert isinstance(node, entryType)
-                if node.key in targetMap:
-                    raise CompilerError(KeyError(f"The {kind} map key {node.key} is already defined"
-                                                 f" with a value {targetMap[node.key]}"))
-                targetMap[node.key] = node.value
+            self.compileConstantEntries(ast, root, entryType, targetMap, kind)
         if not hasLocale:
-            raise CompilerError(ValueError(f'No {kind} section for {locale=} found in the program'))
+            raise self.localeMissingError(locale, kind)
+
+    @staticmethod
+    def compileConstantEntries(ast: AST, root: LocalizedSectionNode,
+                               entryType: type[LocalizedSectionEntryNode], targetMap: dict,
+                               kind: str) -> None:
+        for node in ast.getNodes(root.children):
+            assert isinstance(node, entryType)
+            if node.key in targetMap:
+                raise CompilerError(KeyError(f"The {kind} map key {node.key} is already defined"
+                                             f" with a value {targetMap[node.key]}"))
+            targetMap[node.key] = node.value
+
+    @staticmethod
+    def localeRedefinedError(locale: str) -> CompilerError:
+        return CompilerError(ValueError(f"The current locale {locale} was already defined"))
+
+    @staticmethod
+    def localeMissingError(locale: str, kind: str) -> CompilerError:
+        return CompilerError(ValueError(f'No {kind} section for {locale=} found in the program'))
 
     def compileCodeSections(self, ast: AST, file: EsoMLCompiledFile) -> None:
-        hasMain: bool = False
         for root in ast.rootNodes():
             if root.type is not NodeType.SECTION_CODE:
                 continue
             assert isinstance(root, SectionCodeNode)
-            if root.label == "main":
-                hasMain = True
+            self.compileCodeSection(ast, root, file)
+        self.checkHasMain(file)
+
+    def compileCodeSection(self, ast: AST, root: SectionCodeNode,
+                           file: EsoMLCompiledFile) -> None:
+        if file.backend is Backend.BYTECODE:
+            file.codeSections[root.label] = self.compileBytecode(ast, root, file)
+        else:
             file.codeSections[root.label] = self.compileNode(ast, root, file)
-            file.codeSectionsRenderable[root.label] = root.isRender
-        if not hasMain:
+        file.codeSectionsRenderable[root.label] = root.isRender
+
+    @staticmethod
+    def checkHasMain(file: EsoMLCompiledFile) -> None:
+        if "main" not in file.codeSections:
             raise CompilerError(ValueError(f'No "main" code section found in the program'))
 
     def compileNode(self, ast: AST, node: ASTNode, file: EsoMLCompiledFile) -> str:
-        if node.type is NodeType.SECTION_CODE:
-            assert isinstance(node, SectionCodeNode)
-            return self.compileContainerNode(ast, node, file)
-        elif node.type is NodeType.CONTAINER:
-            assert isinstance(node, ContainerNode)
-            return self.compileContainerNode(ast, node, file)
-        elif node.type is NodeType.IF_STATEMENT:
-            assert isinstance(node, IfStatementNode)
-            return self.compileIfStatementNode(ast, node, file)
-        elif node.type is NodeType.ELEM:
+        if node.type in parentNodeTypes:
+            return self.compileTree(ast, node, file)
+        return self.compileLeafNode(node, file)
+
+    def compileLeafNode(self, node: ASTNode, file: EsoMLCompiledFile) -> str:
+        if node.type is NodeType.ELEM:
             assert isinstance(node, ElemNode)
-            return f"elem({file.id()},{ascii(node.element)})"
+            return f"elem({file.idArgPrefix()}{ascii(node.element)})"
         elif node.type is NodeType.RAW_VALUE:
             assert isinstance(node, RawValueNode)
-            return f"rawValue({file.id()},!{0 if node.injectRaw else 1},{node.value})"
+            return f"rawValue({file.idArgPrefix()}!{0 if node.injectRaw else 1},{node.value})"
         elif node.type is NodeType.CALL:
             assert isinstance(node, CallNode)
-            return f"call({file.id()},{ascii(node.label)})"
+            return f"call({file.idArgPrefix()}{ascii(node.label)})"
         elif node.type is NodeType.RENDER:
             assert isinstance(node, RenderNode)
-            return f"scheduleRender({file.id()})"
+            return f"scheduleRender({file.idArg()})"
         elif node.type is NodeType.ADD_EVENT_LISTENER:
             assert isinstance(node, AddEventListenerNode)
-            return f"eventListen({file.id()},{ascii(node.event)},{ascii(node.listener)})"
+            return (f"eventListen({file.idArgPrefix()}{ascii(node.event)},"
+                    f"{ascii(node.listener)})")
         elif node.type is NodeType.STACK_PUSH:
             assert isinstance(node, StackPushNode)
-            return f"stackPush({file.id()},{node.value})"
+            return f"stackPush({file.idArgPrefix()}{node.value})"
         elif node.type is NodeType.STACK_COPY:
             assert isinstance(node, StackCopyNode)
-            return f"stackCopy({file.id()})"
+            return f"stackCopy({file.idArg()})"
         elif node.type is NodeType.STACK_POP:
             assert isinstance(node, StackPopNode)
-            return f"stackPop({file.id()})"
+            return f"stackPop({file.idArg()})"
         elif node.type is NodeType.STACK_SWAP:
             assert isinstance(node, StackSwapNode)
-            return f"stackSwap({file.id()},{node.offA},{node.offB})"
+            return f"stackSwap({file.idArgPrefix()}{node.offA},{node.offB})"
         elif node.type is NodeType.COMPARE:
             assert isinstance(node, CompareNode)
-            return f"compare({file.id()})"
+            return f"compare({file.idArg()})"
         elif node.type is NodeType.READ:
             assert isinstance(node, ReadNode)
-            return f"read({file.id()})"
+            return f"read({file.idArg()})"
         elif node.type is NodeType.MATH_OP:
             assert isinstance(node, MathOpNode)
-            return f"calc({file.id()},{ascii(node.operation.value)})"
+            return f"calc({file.idArgPrefix()}{ascii(node.operation.value)})"
         else:
             raise NotImplementedError(f"Cannot compile node of type {node.type.name}")
 
+    @staticmethod
+    def compileUncheckedLeafNode(node: ASTNode, file: EsoMLCompiledFile) -> str:
+        # The nodes the stack analysis proved safe, see StackAnalysis
+        if node.type is NodeType.RAW_VALUE:
+            assert isinstance(node, RawValueNode)
+            return (f"rawValue({file.idArgPrefix()}!{0 if node.injectRaw else 1},"
+                    f"{uncheckedValueCode(node.value)})")
+        elif node.type is NodeType.STACK_PUSH:
+            assert isinstance(node, StackPushNode)
+            return f"stackPushUnchecked({file.idArgPrefix()}{uncheckedValueCode(node.value)})"
+        elif node.type is NodeType.STACK_COPY:
+            return f"stackCopyUnchecked({file.idArg()})"
+        elif node.type is NodeType.STACK_POP:
+            return f"stackPopUnchecked({file.idArg()})"
+        elif node.type is NodeType.STACK_SWAP:
+            assert isinstance(node, StackSwapNode)
+            return f"stackSwapUnchecked({file.idArgPrefix()}{node.offA},{node.offB})"
+        elif node.type is NodeType.COMPARE:
+            return f"compareUnchecked({file.idArg()})"
+        elif node.type is NodeType.MATH_OP:
+            assert isinstance(node, MathOpNode)
+            return f"calcUnchecked({file.idArgPrefix()}{ascii(node.operation.value)})"
+        else:
+            raise NotImplementedError(f"No unchecked variant of node type {node.type.name}")
+
     def compileIfStatementNode(self, ast: AST, node: IfStatementNode,
                                file: EsoMLCompiledFile) -> str:
-        result: list[str] = []
-        for child in ast.getNodes(node.children):
-            result.append(self.compileNode(ast, child, file))
-        if_true: str = ";".join(result)
-        return f"ifStatement({file.id()},()=>{{{if_true}}})"
+        return self.compileTree(ast, node, file)
 
     def compileContainerNode(self, ast: AST, node: ContainerNode | SectionCodeNode,
                              file: EsoMLCompiledFile) -> str:
-        result: list[str] = []
-        for child in ast.getNodes(node.children):
-            result.append(self.compileNode(ast, child, file))
-        renderer: str = ";".join(result)
+        return self.compileTree(ast, node, file)
+
+    def compileTree(self, ast: AST, root: ASTNode, file: EsoMLCompiledFile) -> str:
+        # Walks the tree with an explicit stack instead of recursion, so the nesting depth is only
+        # limited by the memory. The IDs are assigned in post-order, the children get theirs first.
+        # All the levels write into a single list of parts, a level reserves a slot for its
+        # opening part when entered and fills it when left, so that no code gets copied per level.
+        if isinstance(ast, NodeStore):
+            return self.compileStoredTree(ast, root, file)
+        parts: list[str | None] = [None]
+        unchecked: frozenset[int] = file.uncheckedNodes
+        inline: dict[str, SectionCodeNode] = self.inlineTargets(root, file)
+        # Each level: (node, its index, its children not compiled yet, the slot of its opening part)
+        stack: list[tuple[ASTNode, int, Iterator[int], int]] = [(root, -1, iter(root.children), 0)]
+        while True:
+            node, nodeI, children, slot = stack[-1]
+            for childI in children:
+                if len(parts) != slot + 1:
+                    parts.append(";")
+                child: ASTNode = ast.getNode(childI)
+                if child.type in parentNodeTypes:
+                    parts.append(None)
+                    stack.append((child, childI, iter(child.children), len(parts) - 1))
+                    break
+                if inline and child.type is NodeType.CALL and child.label in inline:
+                    # The called section with its root container, instead of the call
+                    callee: SectionCodeNode = inline[child.label]
+                    parts.append(None)
+                    stack.append((callee, -1, iter(callee.children), len(parts) - 1))
+                    break
+                if childI in unchecked:
+                    parts.append(self.compileUncheckedLeafNode(child, file))
+                else:
+                    parts.append(self.compileLeafNode(child, file))
+            else:
+                stack.pop()
+                if nodeI in file.staticNodes:
+                    parts[slot], closing = self.staticWrapperParts(node.element, nodeI, file)
+                else:
+                    parts[slot], closing = self.wrapperParts(node, file, nodeI in unchecked)
+                parts.append(closing)
+                if not stack:
+                    return "".join(parts)
+
+    @staticmethod
+    def inlineTargets(root: ASTNode, file: EsoMLCompiledFile) -> dict[str, SectionCodeNode]:
+        if file.inlining is None or not isinstance(root, SectionCodeNode):
+            return {}
+        return file.inlining.targetsFor(root)
+
+    @staticmethod
+    def wrapperParts(node: ASTNode, file: EsoMLCompiledFile,
+                     unchecked: bool = False) -> tuple[str, str]:
+        # The code before and after the compiled children of the node
+        if node.type is NodeType.IF_STATEMENT:
+            function: str = "ifStatementUnchecked" if unchecked else "ifStatement"
+            return f"{function}({file.idArgPrefix()}()=>{{", "})"
         if isinstance(node, ContainerNode):
             element: str = ',' + ascii(node.element) if node.element is not None else ''
         else:
             element: str = ",'root'"
-        return f"container({file.id()},()=>{{{renderer}}}{element})"
+        return f"container({file.idArgPrefix()}()=>{{", f"}}{element})"
+
+    @staticmethod
+    def staticWrapperParts(element: str | None, nodeI: int,
+                           file: EsoMLCompiledFile) -> tuple[str, str]:
+        return (f"staticContainer({file.idArgPrefix()}{file.template(nodeI)},()=>{{",
+                "})" if element is None else f"}},{ascii(element)})")
+
+    def compileStoredTree(self, store: NodeStore, root: ASTNode, file: EsoMLCompiledFile) -> str:
+        # The same as compileTree, but reads the columns of the store instead of node objects
+        types, pool, operandsA = store.types, store.pool, store.operandsA
+        childStarts, childEnds = store.childStarts, store.childEnds
+        parts: list[str | None] = [None]
+        unchecked: frozenset[int] = file.uncheckedNodes
+        inline: dict[str, SectionCodeNode] = self.inlineTargets(root, file)
+        # Each level: (node index, -1 for a section, its children not compiled yet, the slot)
+        stack: list[tuple[int, Iterator[int], int]] = [(-1, iter(root.children), 0)]
+        while True:
+            nodeI, children, slot = stack[-1]
+            for childI in children:
+                if len(parts) != slot + 1:
+                    parts.append(";")
+                compiler: StoredNodeCompiler | None = storedNodeCompilers[types[childI]]
+                if compiler is None:
+                    parts.append(None)
+                    stack.append((childI, iter(range(childStarts[childI], childEnds[childI])),
+                                  len(parts) - 1))
+                    break
+                if inline and types[childI] == CALL and pool[operandsA[childI]] in inline:
+                    # The called section with its root container, instead of the call
+                    parts.append(None)
+                    stack.append((-1, iter(inline[pool[operandsA[childI]]].children),
+                                  len(parts) - 1))
+                    break
+                if childI in unchecked:
+                    compiler = storedUncheckedCompilers[types[childI]]
+                parts.append(compiler(store, childI, file))
+            else:
+                stack.pop()
+                if nodeI == -1:
+                    # Every section (the root or an inlined one) has the same wrapper
+                    parts[slot], closing = self.wrapperParts(root, file)
+                    parts.append(closing)
+                    if not stack:
+                        return "".join(parts)
+                    continue
+                nodeType: int = types[nodeI]
+                a: int = operandsA[nodeI]
+                if nodeI in file.staticNodes:
+                    parts[slot], closing = self.staticWrapperParts(
+                        None if a == NO_OPERAND else pool[a], nodeI, file)
+                    parts.append(closing)
+                elif nodeType == CONTAINER:
+                    parts[slot] = f"container({file.idArgPrefix()}()=>{{"
+                    parts.append("})" if a == NO_OPERAND else f"}},{ascii(pool[a])})")
+                elif nodeType == IF_STATEMENT:
+                    function: str = "ifStatementUnchecked" if nodeI in unchecked else \
+                        "ifStatement"
+                    parts[slot] = f"{function}({file.idArgPrefix()}()=>{{"
+                    parts.append("})")
+                else:
+                    raise NotImplementedError(
+                        f"Cannot compile node of type {nodeTypes[nodeType].name}")
+
+    def compileBytecode(self, ast: AST, root: SectionCodeNode, file: EsoMLCompiledFile) -> str:
+        # The same walk as compileTree, but encodes the nodes as the instructions of the runtime's
+        # interpreter, see esoml/bytecode.py. A level reserves the end of its opening instruction
+        # when entered and fills it when left. It reads both the AST and the NodeStore by nodes.
+        writer: BytecodeWriter = BytecodeWriter(file.production)
+        unchecked: frozenset[int] = file.uncheckedNodes
+        inline: dict[str, SectionCodeNode] = self.inlineTargets(root, file)
+        # Each level: (its children not compiled yet, the slot of its end)
+        stack: list[tuple[Iterator[int], int]] = [(
+            iter(root.children),
+            writer.open(Opcode.CONTAINER, file.bytecodeID(), writer.constant("root"))
+        )]
+        while stack:
+            children, slot = stack[-1]
+            for childI in children:
+                child: ASTNode = ast.getNode(childI)
+                if child.type is NodeType.CONTAINER:
+                    assert isinstance(child, ContainerNode)
+                    tag: int = NO_TAG if child.element is None else writer.constant(child.element)
+                    if childI in file.staticNodes:
+                        childSlot: int = writer.open(Opcode.STATIC_CONTAINER, file.bytecodeID(),
+                                                     file.template(childI), tag)
+                    else:
+                        childSlot: int = writer.open(Opcode.CONTAINER, file.bytecodeID(), tag)
+                elif child.type is NodeType.IF_STATEMENT:
+                    childSlot: int = writer.open(
+                        Opcode.IF_STATEMENT_UNCHECKED if childI in unchecked else
+                        Opcode.IF_STATEMENT, file.bytecodeID())
+                elif inline and child.type is NodeType.CALL and child.label in inline:
+                    # The called section with its root container, instead of the call
+                    child = inline[child.label]
+                    childSlot: int = writer.open(Opcode.CONTAINER, file.bytecodeID(),
+                                                 writer.constant("root"))
+                else:
+                    self.compileBytecodeLeaf(child, writer, file, childI in unchecked)
+                    continue
+                stack.append((iter(child.children), childSlot))
+                break
+            else:
+                stack.pop()
+                writer.close(slot)
+        return writer.export()
+
+    @staticmethod
+    def compileBytecodeLeaf(node: ASTNode, writer: BytecodeWriter, file: EsoMLCompiledFile,
+                            unchecked: bool) -> None:
+        opcode: Opcode | None = bytecodeOpcodes.get(node.type)
+        if opcode is None:
+            raise NotImplementedError(f"Cannot compile node of type {node.type.name}")
+        if unchecked:
+            opcode = uncheckedOpcodes.get(opcode, opcode)
+        id_: int | None = file.bytecodeID()
+        if node.type is NodeType.ELEM:
+            assert isinstance(node, ElemNode)
+            writer.emit(opcode, id_, writer.constant(node.element))
+        elif node.type is NodeType.RAW_VALUE:
+            assert isinstance(node, RawValueNode)
+            writer.emit(opcode, id_, int(node.injectRaw), *writer.value(node.value, unchecked))
+        elif node.type is NodeType.CALL:
+            assert isinstance(node, CallNode)
+            writer.emit(opcode, id_, writer.constant(node.label))
+        elif node.type is NodeType.ADD_EVENT_LISTENER:
+            assert isinstance(node, AddEventListenerNode)
+            writer.emit(opcode, id_, writer.constant(node.event), writer.constant(node.listener))
+        elif node.type is NodeType.STACK_PUSH:
+            assert isinstance(node, StackPushNode)
+            writer.emit(opcode, id_, *writer.value(node.value, unchecked))
+        elif node.type is NodeType.STACK_SWAP:
+            assert isinstance(node, StackSwapNode)
+            writer.emit(opcode, id_, writer.constant(node.offA), writer.constant(node.offB))
+        elif node.type is NodeType.MATH_OP:
+            assert isinstance(node, MathOpNode)
+            writer.emit(opcode, id_, writer.constant(node.operation.value))
+        else:
+            writer.emit(opcode, id_)
+
+
+def uncheckedValueCode(value: ValueRef | LiteralValue) -> str:
+    # The stack offsets of the nodes proved safe are in bounds
+    if isinstance(value, ValueRef) and value.kind is ValueRef.ValueRefKind.STACK:
+        return f"getStackUnchecked({hex(value.key)})"
+    return str(value)
+
+
+# The nodes with children
+parentNodeTypes: Final[frozenset[NodeType]] = frozenset({
+    NodeType.SECTION_CODE, NodeType.CONTAINER, NodeType.IF_STATEMENT
+})
+CONTAINER: Final[int] = NodeType.CONTAINER.value
+CALL: Final[int] = NodeType.CALL.value
+IF_STATEMENT: Final[int] = NodeType.IF_STATEMENT.value
+
+# The instructions of the nodes without any children, see compileBytecodeLeaf
+bytecodeOpcodes: Final[dict[NodeType, Opcode]] = {
+    NodeType.ELEM: Opcode.ELEM,
+    NodeType.RAW_VALUE: Opcode.RAW_VALUE,
+    NodeType.CALL: Opcode.CALL,
+    NodeType.RENDER: Opcode.RENDER,
+    NodeType.ADD_EVENT_LISTENER: Opcode.ADD_EVENT_LISTENER,
+    NodeType.STACK_PUSH: Opcode.STACK_PUSH,
+    NodeType.STACK_COPY: Opcode.STACK_COPY,
+    NodeType.STACK_POP: Opcode.STACK_POP,
+    NodeType.STACK_SWAP: Opcode.STACK_SWAP,
+    NodeType.COMPARE: Opcode.COMPARE,
+    NodeType.READ: Opcode.READ,
+    NodeType.MATH_OP: Opcode.MATH_OP,
+}
+
+type StoredNodeCompiler = Callable[[NodeStore, int, EsoMLCompiledFile], str]
+
+# A function compiling a stored node without any children
+storedLeafCompilers: Final[dict[NodeType, StoredNodeCompiler]] = {
+    NodeType.ELEM: lambda store, nodeI, file:
+    f"elem({file.idArgPrefix()}{ascii(store.pool[store.operandsA[nodeI]])})",
+    NodeType.RAW_VALUE: lambda store, nodeI, file:
+    f"rawValue({file.idArgPrefix()}!{1 - store.operandsB[nodeI]},"
+    f"{store.valueCode(store.operandsA[nodeI])})",
+    NodeType.CALL: lambda store, nodeI, file:
+    f"call({file.idArgPrefix()}{ascii(store.pool[store.operandsA[nodeI]])})",
+    NodeType.RENDER: lambda store, nodeI, file: f"scheduleRender({file.idArg()})",
+    NodeType.ADD_EVENT_LISTENER: lambda store, nodeI, file:
+    f"eventListen({file.idArgPrefix()}{ascii(store.pool[store.operandsA[nodeI]])},"
+    f"{ascii(store.pool[store.operandsB[nodeI]])})",
+    NodeType.STACK_PUSH: lambda store, nodeI, file:
+    f"stackPush({file.idArgPrefix()}{store.valueCode(store.operandsA[nodeI])})",
+    NodeType.STACK_COPY: lambda store, nodeI, file: f"stackCopy({file.idArg()})",
+    NodeType.STACK_POP: lambda store, nodeI, file: f"stackPop({file.idArg()})",
+    NodeType.STACK_SWAP: lambda store, nodeI, file:
+    f"stackSwap({file.idArgPrefix()}{store.pool[store.operandsA[nodeI]]},"
+    f"{store.pool[store.operandsB[nodeI]]})",
+    NodeType.COMPARE: lambda store, nodeI, file: f"compare({file.idArg()})",
+    NodeType.READ: lambda store, nodeI, file: f"read({file.idArg()})",
+    NodeType.MATH_OP: lambda store, nodeI, file:
+    f"calc({file.idArgPrefix()}{ascii(store.pool[store.operandsA[nodeI]].value)})",
+}
+# NodeType.value --> The above function, None for the nodes with children
+storedNodeCompilers: Final[tuple[StoredNodeCompiler | None, ...]] = tuple(
+    storedLeafCompilers.get(nodeType) for nodeType in nodeTypes)
+# The same for the nodes proved safe by the stack analysis, which have an unchecked variant
+storedUncheckedLeafCompilers: Final[dict[NodeType, StoredNodeCompiler]] = {
+    NodeType.RAW_VALUE: lambda store, nodeI, file:
+    f"rawValue({file.idArgPrefix()}!{1 - store.operandsB[nodeI]},"
+    f"{uncheckedValueCode(store.pool[store.operandsA[nodeI]])})",
+    NodeType.STACK_PUSH: lambda store, nodeI, file:
+    f"stackPushUnchecked({file.idArgPrefix()}"
+    f"{uncheckedValueCode(store.pool[store.operandsA[nodeI]])})",
+    NodeType.STACK_COPY: lambda store, nodeI, file: f"stackCopyUnchecked({file.idArg()})",
+    NodeType.STACK_POP: lambda store, nodeI, file: f"stackPopUnchecked({file.idArg()})",
+    NodeType.STACK_SWAP: lambda store, nodeI, file:
+    f"stackSwapUnchecked({file.idArgPrefix()}{store.pool[store.operandsA[nodeI]]},"
+    f"{store.pool[store.operandsB[nodeI]]})",
+    NodeType.COMPARE: lambda store, nodeI, file: f"compareUnchecked({file.idArg()})",
+    NodeType.MATH_OP: lambda store, nodeI, file:
+    f"calcUnchecked({file.idArgPrefix()}{ascii(store.pool[store.operandsA[nodeI]].value)})",
+}
+storedUncheckedCompilers: Final[tuple[StoredNodeCompiler | None, ...]] = tuple(
+    storedUncheckedLeafCompilers.get(nodeType) for nodeType in nodeTypes)
@@ -0,0 +1,224 @@
+#  -*- coding: utf-8 -*-
+__author__ = "kubik.augustyn@post.cz"
+
+from hashlib import sha256
+from typing import Any, Iterator
+
+from kutil.language.AST import AST
+from kutil.language.Token import TokenOutput, Token
+from kutil.language.Error import CompilerError, LexerError
+
+from esoml.lexer import EsoMLLexer
+from esoml.parser import EsoMLParser
+from esoml.compiler import EsoMLCompiler, EsoMLCompiledFile
+from esoml.nodes import *
+from esoml.optimizer import EsoMLOptimizer
+from esoml.stats import CompileStats, countNodes
+from esoml.types import EsoMLOptions, CompilerOptions, OptimizationLevel, Backend
+
+
+class SectionSource:
+    startsAtLine: int  # The line number of the section header
+    lines: list[str]  # The header followed by all the lines up to the next header
+    fingerprint: str
+
+    def __init__(self, startsAtLine: int, lines: list[str]) -> None:
+        self.startsAtLine = startsAtLine
+        self.lines = lines
+        self.fingerprint = ""
+
+    def updateFingerprint(self) -> None:
+        # The keys only depend on the line offset inside the section, so a section that just moved
+        # in the source compiles to the very same output
+        self.fingerprint = sha256("\n".join(self.lines).encode("utf-8")).hexdigest()
+
+    def numberedLines(self) -> Iterator[tuple[int, str]]:
+        return enumerate(self.lines, self.startsAtLine)
+
+
+class CompiledSection:
+    unsafeMode: bool
+    locale: str | None  # For the strings and ROM sections
+    nodeType: NodeType | None  # None for the unsafe_mode section
+    entries: dict[int, Any] | None  # For the strings and ROM sections
+    label: str | None  # For the code and render sections
+    code: str | None
+    isRender: bool
+
+    def __init__(self) -> None:
+        self.unsafeMode = False
+        self.locale = None
+        self.nodeType = None
+        self.entries = None
+        self.label = None
+        self.code = None
+        self.isRender = False
+
+
+class IncrementalCompiler:
+    lexer: EsoMLLexer
+    parser: EsoMLParser
+    compiler: EsoMLCompiler
+    optimizer: EsoMLOptimizer
+    compiledSections: dict[str, CompiledSection]  # Fingerprint --> compiled section
+    currentID: int  # Every (re)compiled section gets a fresh range of IDs, so they never clash
+    production: bool  # Whether the cached sections were compiled for production
+    optimizationLevel: OptimizationLevel  # The level the cached sections were optimized with
+    backend: Backend  # The backend the cached sections were compiled with
+    reusedSections: int  # Statistics of the last compilation
+    rebuiltSections: int
+    stats: CompileStats  # Only counts the tokens and nodes of the rebuilt sections
+
+    def __init__(self) -> None:
+        self.lexer = EsoMLLexer()
+        self.parser = EsoMLParser()
+        self.compiler = EsoMLCompiler()
+        self.optimizer = EsoMLOptimizer()
+        self.compiledSections = {}
+        self.currentID = 0
+        self.production = False
+        self.optimizationLevel = OptimizationLevel.O0
+        self.backend = Backend.CLOSURES
+        self.reusedSections = 0
+        self.rebuiltSections = 0
+        self.stats = CompileStats()
+
+    def compile(self, inputCode: str, options: EsoMLOptions) -> EsoMLCompiledFile:
+        compilerOptions: CompilerOptions = options.getCompilerOptions()
+        if compilerOptions.production != self.production or \
+                compilerOptions.optimizationLevel != self.optimizationLevel or \
+                compilerOptions.backend is not self.backend:
+            # The code of the cached sections has the IDs either everywhere or nowhere
+            self.production = compilerOptions.production
+            self.optimizationLevel = compilerOptions.optimizationLevel
+            self.backend = compilerOptions.backend
+            self.compiledSections = {}
+        sources: list[SectionSource] = self.splitSections(inputCode)
+        sections: list[CompiledSection] = []
+        compiledSections: dict[str, CompiledSection] = {}
+        self.reusedSections = self.rebuiltSections = 0
+        self.stats = CompileStats()
+        self.stats.sectionCount = len(sources)
+
+        for source in sources:
+            section: CompiledSection | None = self.compiledSections.get(source.fingerprint)
+            if section is None:
+                section = self.compileSection(source)
+                self.rebuiltSections += 1
+            else:
+                self.reusedSections += 1
+            compiledSections[source.fingerprint] = section
+            sections.append(section)
+
+        # Forget the sections that are no longer in the source
+        self.compiledSections = compiledSections
+        with self.stats.measure("link"):
+            file: EsoMLCompiledFile = self.link(sections, options)
+        file.stats = self.stats.copy()
+        return file
+
+    @staticmethod
+    def splitSections(inputCode: str) -> list[SectionSource]:
+        sources: list[SectionSource] = []
+        current: SectionSource | None = None
+
+        for lineNumber, line in enumerate(inputCode.splitlines(keepends=False), 1):
+            if line.startswith("."):
+                current = SectionSource(lineNumber, [line])
+                sources.append(current)
+            elif current is not None:
+                current.lines.append(line)
+            elif line:
+                # Content before the first section, let the lexer report the error
+                sources.append(SectionSource(lineNumber, [line]))
+        for source in sources:
+            source.updateFingerprint()
+        return sources
+
+    def compileSection(self, source: SectionSource) -> CompiledSection:
+        options: EsoMLOptions = EsoMLOptions(production=self.production,
+                                             optimizationLevel=self.optimizationLevel,
+                                             backend=self.backend)
+        with self.stats.measure("lex"):
+            try:
+                tokens: list[Token] = list(self.lexer.tokenizeLines(source.numberedLines(),
+                                                                    options))
+            except LexerError:
+                raise
+            except Exception as e:
+                raise LexerError(e) from None
+        self.stats.tokenCount += len(tokens)
+        with self.stats.measure("parse"):
+            ast: AST = self.parser.parse(TokenOutput(iter(tokens)), options)
+        self.stats.nodeCount += countNodes(ast)
+        # A section is compiled on its own, nothing is known about the other ones
+        ast = self.optimizer.optimize(ast, options, self.stats, wholeProgram=False)
+
+        with self.stats.measure("compile"):
+            return self.compileSectionAST(ast, options)
+
+    def compileSectionAST(self, ast: AST, options: EsoMLOptions) -> CompiledSection:
+        section: CompiledSection = CompiledSection()
+        section.unsafeMode = options.getCompilerOptions().unsafeMode
+        for root in ast.rootNodes():
+            section.nodeType = root.type
+            if root.type is NodeType.SECTION_CODE:
+                assert isinstance(root, SectionCodeNode)
+                file: EsoMLCompiledFile = EsoMLCompiledFile(
+                    False, production=options.getCompilerOptions().production,
+                    backend=options.getCompilerOptions().backend)
+                file.currentID = self.currentID
+                self.compiler.compileCodeSection(ast, root, file)
+                self.currentID = file.currentID
+                section.label = root.label
+                section.code = file.codeSections[root.label]
+                section.isRender = root.isRender
+            elif root.type is NodeType.SECTION_STRINGS:
+                assert isinstance(root, SectionStringsNode)
+                section.locale, section.entries = root.locale, {}
+                self.compiler.compileConstantEntries(ast, root, StringEntryNode, section.entries,
+                                                     "strings")
+            elif root.type is NodeType.SECTION_ROM:
+                assert isinstance(root, SectionROMNode)
+                section.locale, section.entries = root.locale, {}
+                self.compiler.compileConstantEntries(ast, root, ROMEntryNode, section.entries,
+                                                     "rom")
+            else:
+                raise CompilerError(NotImplementedError(f"Cannot compile section {root.type.name}"))
+        return section
+
+    def link(self, sections: list[CompiledSection], options: EsoMLOptions) -> EsoMLCompiledFile:
+        compilerOptions = options.getCompilerOptions()
+        if any(section.unsafeMode for section in sections):
+            compilerOptions.unsafeMode = True
+        locale: str = compilerOptions.locale
+        file: EsoMLCompiledFile = EsoMLCompiledFile(compilerOptions.unsafeMode, locale,
+                                                    compilerOptions.outputMode,
+                                                    compilerOptions.production,
+                                                    compilerOptions.backend,
+                                                    compilerOptions.frameBudget,
+                                                    compilerOptions.renderLoopLimit)
+        file.currentID = self.currentID
+
+        for nodeType, targetMap, kind in ((NodeType.SECTION_STRINGS, file.strings, "strings"),
+                                          (NodeType.SECTION_ROM, file.rom, "rom")):
+            localized: list[CompiledSection] = [section for section in sections if
+                                                section.nodeType is nodeType and
+                                                section.locale == locale]
+            if not localized:
+                raise self.compiler.localeMissingError(locale, kind)
+            if len(localized) > 1:
+                raise self.compiler.localeRedefinedError(locale)
+            targetMap.update(localized[0].entries)
+
+        for section in sections:
+            if section.nodeType is not NodeType.SECTION_CODE:
+                continue
+            file.codeSections[section.label] = section.code
+            file.codeSectionsRenderable[section.label] = section.isRender
+        self.compiler.checkHasMain(file)
+        return file
+
+    def __repr__(self) -> str:
+        return (f"IncrementalCompiler(sections={len(self.compiledSections)}, "
+                f"reused={self.reusedSections}, rebuilt={self.rebuiltSections})")
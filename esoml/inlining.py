@@ -0,0 +1,89 @@
+#  -*- coding: utf-8 -*-
+__author__ = "kubik.augustyn@post.cz"
+
+import logging
+from typing import Iterator
+
+from kutil.language.AST import AST
+
+from esoml.analysis import orderCallGraph
+from esoml.nodes import *
+
+logger = logging.getLogger(__name__)
+
+
+# Decides which calls get replaced by the body of the called section. The runtime runs a called
+# section as a section of its own, but what its code does only depends on whether that section is
+# renderable and on whether it runs as an event listener (or init), where the containers don't
+# render anything and rend schedules a new render instead of rendering again. So a section is
+# only inlined into the sections of the same kind, which never run as a listener nor as init.
+# It keeps its root container, so it renders the very same elements. Recursive sections are never
+# inlined, and the size of a section counts the sections inlined into it, so the code can't blow up.
+class InliningPlan:
+    ast: AST
+    threshold: int  # The biggest section to inline, in nodes
+    sections: dict[str, SectionCodeNode]  # Label --> the last section with it, like in the runtime
+    sizes: dict[str, int]  # Label --> the number of nodes, with the sections inlined into it
+    calls: dict[str, list[str]]  # Label --> the called labels, one per call
+    listeners: set[str]  # The labels of all the event listeners
+    targets: dict[bool, dict[str, SectionCodeNode]]  # isRender --> label --> the section to inline
+
+    def __init__(self, ast: AST, threshold: int) -> None:
+        self.ast = ast
+        self.threshold = threshold
+        self.sections = {}
+        self.sizes = {}
+        self.calls = {}
+        self.listeners = set()
+        self.targets = {False: {}, True: {}}
+        self.plan()
+
+    def plan(self) -> None:
+        for root in self.ast.rootNodes():
+            if root.type is NodeType.SECTION_CODE:
+                assert isinstance(root, SectionCodeNode)
+                self.sections[root.label] = root
+        for label, root in self.sections.items():
+            self.sizes[label], self.calls[label] = self.measure(root)
+
+        order, recursive = orderCallGraph({
+            label: [callee for callee in calls if callee in self.sections]
+            for label, calls in self.calls.items()
+        })
+        for label in order:
+            # The callees go first, so their final size is known already
+            root: SectionCodeNode = self.sections[label]
+            targets: dict[str, SectionCodeNode] = self.targets[root.isRender]
+            self.sizes[label] += sum(self.sizes[callee] - 1 for callee in self.calls[label]
+                                     if callee in targets)
+            if label not in recursive and self.sizes[label] <= self.threshold:
+                targets[label] = root
+        logger.info("Inlining the calls of %d out of %d sections",
+                    len(self.targets[False]) + len(self.targets[True]), len(self.sections))
+
+    def measure(self, root: SectionCodeNode) -> tuple[int, list[str]]:
+        size: int = 1
+        calls: list[str] = []
+        stack: list[Iterator[int]] = [iter(root.children)]
+        while stack:
+            for nodeI in stack[-1]:
+                node: ASTNode = self.ast.getNode(nodeI)
+                size += 1
+                if node.type is NodeType.CALL:
+                    assert isinstance(node, CallNode)
+                    calls.append(node.label)
+                elif node.type is NodeType.ADD_EVENT_LISTENER:
+                    assert isinstance(node, AddEventListenerNode)
+                    self.listeners.add(node.listener)
+                elif node.type in {NodeType.CONTAINER, NodeType.IF_STATEMENT}:
+                    stack.append(iter(node.children))
+                    break
+            else:
+                stack.pop()
+        return size, calls
+
+    def targetsFor(self, root: SectionCodeNode) -> dict[str, SectionCodeNode]:
+        # The sections whose calls get inlined into the section, also into the inlined ones
+        if root.label == "init" or root.label in self.listeners:
+            return {}
+        return self.targets[root.isRender]
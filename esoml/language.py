@@ -1,28 +1,101 @@
 #  -*- coding: utf-8 -*-
 __author__ = "kubik.augustyn@post.cz"
 
+from typing import Iterator, Iterable
+
 from kutil.language.Language import GenericLanguage  # Don't care it's not exported
 from kutil.language import AST
+from kutil.language.Token import TokenOutput, Token
+from kutil.language.Error import LexerError
 
+from esoml.cache import hashSource
 from esoml.lexer import EsoMLLexer
 from esoml.parser import EsoMLParser
 from esoml.compiler import EsoMLCompiler, EsoMLCompiledFile
+from esoml.optimizer import EsoMLOptimizer
+from esoml.program import ParsedProgram
+from esoml.stats import CompileStats, countNodes
+from esoml.tokens import Section, TokenKind, SectionStartToken
 from esoml.types import EsoMLOptions
 
 
 class EsoML(GenericLanguage):
     optionsClass = EsoMLOptions
+    lexer: EsoMLLexer
     compiler: EsoMLCompiler
+    optimizer: EsoMLOptimizer
 
-    def __init__(self):
-        super().__init__(EsoMLLexer(), EsoMLParser())
+    def __init__(self, useNodeStore: bool = False):
+        super().__init__(EsoMLLexer(), EsoMLParser(useNodeStore))
         self.compiler = EsoMLCompiler()
+        self.optimizer = EsoMLOptimizer()
+
+    def parse(self, inputCode: str) -> ParsedProgram:
+        # Lexing and parsing don't depend on the compiler options, except for the unsafe mode,
+        # which is remembered in the program instead
+        options: EsoMLOptions = EsoMLOptions()
+        sections: list[Section] = []
+        stats: CompileStats = CompileStats()
+
+        # The tokens are collected before parsing, so that both phases can be measured on their own
+        with stats.measure("lex"):
+            try:
+                # Straight from the lexer, the TokenOutput wrapper adds two calls to every token
+                tokens: list[Token] = list(self.lexer.tokenizeInner(inputCode, options,
+                                                                    TokenOutput()))
+            except LexerError:
+                raise
+            except Exception as e:
+                raise LexerError(e) from None
+        stats.tokenCount = len(tokens)
+        with stats.measure("parse"):
+            ast: AST = self.parseInner(TokenOutput(self.recordSections(tokens, sections)),
+                                       options)
+        stats.nodeCount = countNodes(ast)
+        stats.sectionCount = len(sections)
+        return ParsedProgram(ast, tuple(sections), options.getCompilerOptions().unsafeMode,
+                             hashSource(inputCode), stats)
+
+    @staticmethod
+    def recordSections(tokens: Iterable[Token], sections: list[Section]) -> Iterator[Token]:
+        for token in tokens:
+            if token.kind is TokenKind.SECTION_START:
+                assert isinstance(token, SectionStartToken)
+                sections.append(token.section)
+            yield token
+
+    def compile(self, inputCode: str | ParsedProgram, options: EsoMLOptions) -> \
+            EsoMLCompiledFile:
+        program: ParsedProgram = self.toProgram(inputCode, options)
+        stats: CompileStats = program.stats.copy()
+        # The parsed program is left untouched, so it can be compiled with other options again
+        ast: AST = self.optimizer.optimize(program.ast, options, stats)
+        with stats.measure("compile"):
+            file: EsoMLCompiledFile = self.compileInner(ast, options)
+        file.stats = stats
+        return file
+
+    def compileAllLocales(self, inputCode: str | ParsedProgram, options: EsoMLOptions) -> \
+            dict[str, EsoMLCompiledFile]:
+        # Lexes and parses once, then only emits the constant tables for each locale
+        program: ParsedProgram = self.toProgram(inputCode, options)
+        stats: CompileStats = program.stats.copy()
+        # Only the constants shared by all the locales are folded, so the code fits every one
+        ast: AST = self.optimizer.optimize(program.ast, options, stats)
+        with stats.measure("compile"):
+            files: dict[str, EsoMLCompiledFile] = self.compiler.compileAllLocales(ast, options)
+        for file in files.values():
+            file.stats = stats.copy()
+        return files
 
-    def compile(self, inputCode: str, options: EsoMLOptions) -> EsoMLCompiledFile:
-        ast: AST = super().run(inputCode, options)
-        return self.compileInner(ast, options)
+    def toProgram(self, inputCode: str | ParsedProgram, options: EsoMLOptions) -> ParsedProgram:
+        program: ParsedProgram = inputCode if isinstance(inputCode, ParsedProgram) else \
+            self.parse(inputCode)
+        if program.unsafeMode:
+            options.getCompilerOptions().unsafeMode = True
+        return program
 
-    def run(self, inputCode: str, options: EsoMLOptions) -> \
+    def run(self, inputCode: str | ParsedProgram, options: EsoMLOptions) -> \
             EsoMLCompiledFile:
         file = self.compile(inputCode, options)
         return file
@@ -1,7 +1,8 @@
 #  -*- coding: utf-8 -*-
 __author__ = "kubik.augustyn@post.cz"
 
-from typing import Iterator
+import re
+from typing import Iterator, Iterable, Callable
 from kutil.language import Lexer
 from kutil.language.Token import TokenOutput
 from kutil.language.Error import LexerError
@@ -36,31 +37,70 @@ class Instruction(Enum):
 # @formatter:on
 
 
-# Instruction --> Token that doesn't take any parameters
-instructionToSimpleToken: Final[dict[Instruction, type[Token]]] = {
-    Instruction.END_CONTAINER: EndContainerToken,
-    Instruction.RENDER: RenderToken,
-    Instruction.STACK_COPY: StackCopyToken,
-    Instruction.STACK_POP: StackPopToken,
-    Instruction.COMPARE: CompareToken,
-    Instruction.READ: ReadToken,
-    Instruction.MATH_ADD: MathAddToken,
-    Instruction.MATH_SUB: MathSubToken,
-    Instruction.MATH_MULT: MathMulToken,
-    Instruction.MATH_DIV: MathDivToken,
-    Instruction.START_IF: StartIfToken,
-    Instruction.END_IF: EndIfToken,
+def swapTokenFactory(parts: list[str]) -> StackSwapToken:
+    offA: int = int(parts[1]) if len(parts) >= 2 else 0
+    offB: int = int(parts[2]) if len(parts) >= 3 else 1
+    return StackSwapToken(max(offA, 0), max(offB, 0))  # Must be >= 0
+
+
+def sharedToken(tokenType: type[Token]) -> Callable[[list[str]], Token]:
+    token: Token = sharedTokens[tokenType]
+    return lambda parts: token
+
+
+# The opcode --> A function creating the token from the line split by spaces (the opcode included)
+instructionTokenFactories: Final[dict[str, Callable[[list[str]], Token]]] = {
+    Instruction.START_CONTAINER.value:
+        lambda parts: StartContainerToken(parts[1] if len(parts) >= 2 else None),
+    Instruction.END_CONTAINER.value: sharedToken(EndContainerToken),
+    Instruction.ELEM.value: lambda parts: ElemToken(parts[1]),
+    Instruction.TEXT.value: lambda parts: TextToken(internValueRef(parts[1])),
+    Instruction.SHOW.value: lambda parts: ShowToken(internValueRef(parts[1])),
+    Instruction.CALL.value: lambda parts: CallToken(parts[1]),
+    Instruction.RENDER.value: sharedToken(RenderToken),
+    Instruction.ADD_EVENT_LISTENER.value:
+        lambda parts: AddEventListenerToken(parts[1], parts[2]),
+    Instruction.STACK_PUSH.value: lambda parts: StackPushToken(internValueRef(parts[1])),
+    Instruction.STACK_COPY.value: sharedToken(StackCopyToken),
+    Instruction.STACK_POP.value: sharedToken(StackPopToken),
+    Instruction.STACK_SWAP.value: swapTokenFactory,
+    Instruction.COMPARE.value: sharedToken(CompareToken),
+    Instruction.READ.value: sharedToken(ReadToken),
+    Instruction.MATH_ADD.value: sharedToken(MathAddToken),
+    Instruction.MATH_SUB.value: sharedToken(MathSubToken),
+    Instruction.MATH_MULT.value: sharedToken(MathMulToken),
+    Instruction.MATH_DIV.value: sharedToken(MathDivToken),
+    Instruction.START_IF.value: sharedToken(StartIfToken),
+    Instruction.END_IF.value: sharedToken(EndIfToken),
 }
+assert len(instructionTokenFactories) == len(Instruction), "Every instruction needs a factory"
+
+
+# The usual forms of the entries, the id can't contain a space
+stringEntryPattern: Final[re.Pattern] = re.compile(r"Let ([^ ]*) be translated to (.*)\.",
+                                                   re.DOTALL)
+romEntryPattern: Final[re.Pattern] = re.compile(r"Remember that ([^ ]*) will always be (.*)\.",
+                                                re.DOTALL)
 
-# Instruction --> Token that takes 1 raw parameter
-instructionTo1ArgToken: Final[dict[Instruction, type[Token]]] = {
-    Instruction.START_CONTAINER: StartContainerToken,
-    Instruction.ELEM: ElemToken,
-    Instruction.CALL: CallToken,
-}
+
+sectionEndToken: Final[Token] = sharedTokens[SectionEndToken]
+codeSectionKinds: Final[frozenset[SectionKind]] = frozenset((SectionKind.CODE, SectionKind.RENDER))
 
 
 class EsoMLLexer(Lexer):
+    keepLines: bool  # Whether to store the lines of each section into Section.lines
+    sectionTokenizers: dict[SectionKind, Callable[[str, int, Section], Token]]
+
+    def __init__(self, keepLines: bool = False) -> None:
+        super().__init__()
+        self.keepLines = keepLines
+        self.sectionTokenizers = {
+            SectionKind.STRINGS: self.tokenizeStringsSectionLine,
+            SectionKind.ROM: self.tokenizeROMSectionLine,
+            SectionKind.CODE: self.tokenizeCodeSectionLine,
+            SectionKind.RENDER: self.tokenizeCodeSectionLine,
+        }
+
     @staticmethod
     def convertIDToKey(id_str: str, line: int) -> int:
         id_: int = int(id_str, 8)
@@ -77,117 +117,118 @@ class EsoMLLexer(Lexer):
 
     def tokenizeInner(self, inputCode: str, options: EsoMLOptions, output: TokenOutput) -> \
             Iterator[Token]:
-        codeLines: list[str] = inputCode.splitlines(keepends=False)
-        lineNumber: int = 1
-        sections: list[Section] = []
+        return self.tokenizeLines(enumerate(inputCode.splitlines(keepends=False), 1), options)
 
-        while lineNumber <= len(codeLines):
-            line = codeLines[lineNumber - 1]
+    def tokenizeLines(self, numberedLines: Iterable[tuple[int, str]], options: EsoMLOptions) -> \
+            Iterator[Token]:
+        # Accepts (line number, line) pairs, so any part of the source can be tokenized on its own
+        # Every line of a section produces exactly one token
+        section: Section | None = None
+        tokenizeLine: Callable[[str, int, Section], Token] | None = None
+        lines: list[str] | None = None
+        # The token of a code line doesn't depend on where the line is and nothing mutates the
+        # tokens, so the lines repeating across the code sections share them
+        codeTokens: dict[str, Token] = {}
+        cachedTokens: dict[str, Token] | None = None  # codeTokens inside a code section
+
+        for lineNumber, line in numberedLines:
+            if cachedTokens is not None:
+                token: Token | None = cachedTokens.get(line)
+                if token is not None:
+                    yield token
+                    if lines is not None:
+                        lines.append(line)
+                    continue
             if not line:
-                lineNumber += 1
                 continue
-            if not line.startswith("."):
-                self.error("The code must start with a section", lineNumber)
-            section = Section()
-            if " " not in line:
-                self.error("The section header must contain an argument", lineNumber)
-            kind, section.argument = line[1:].split(" ", maxsplit=1)
-            section.kind = SectionKind(kind)
-            lineNumber += 1
-            section.startsAtLine = lineNumber
-            lines = section.lines = []
-            yield SectionStartToken(section)
-            if section.kind is SectionKind.UNSAFE_MODE:
-                options.getCompilerOptions().unsafeMode = True
-            while lineNumber <= len(codeLines):
+            if line[0] == ".":
+                if section is not None:
+                    yield sectionEndToken
+                section = self.parseSectionHeader(line, lineNumber)
+                lines = section.lines
+                tokenizeLine = self.sectionTokenizers.get(section.kind)
+                cachedTokens = codeTokens if section.kind in codeSectionKinds else None
+                yield SectionStartToken(section)
                 if section.kind is SectionKind.UNSAFE_MODE:
-                    break
-
-                line = codeLines[lineNumber - 1]
-                if not line:
-                    lineNumber += 1
-                    continue
-                if line.startswith("."):
-                    break
-
-                yield from self.tokenizeSectionLine(section, line, lineNumber)
+                    options.getCompilerOptions().unsafeMode = True
+                    yield sectionEndToken
+                    section = None  # The unsafe_mode section has no contents
+                continue
+            if section is None:
+                self.error("The code must start with a section", lineNumber)
 
+            try:
+                if tokenizeLine is None:
+                    raise NotImplementedError(f"Unknown section kind: {section.kind.name}")
+                token = tokenizeLine(line, lineNumber, section)
+            except Exception as e:
+                raise LexerError([
+                    e,
+                    Exception(f"An error occurred at line {lineNumber}, see the above log")
+                ])
+            if cachedTokens is not None:
+                cachedTokens[line] = token
+            yield token
+
+            if lines is not None:
                 lines.append(line)
-                lineNumber += 1
-            yield SectionEndToken()
-            sections.append(section)
-
-    def tokenizeSectionLine(self, section: Section, line: str, lineNumber: int) -> Iterator[Token]:
-        try:
-            if section.kind is SectionKind.STRINGS:
-                yield from self.tokenizeStringsSectionLine(line, lineNumber, section)
-            elif section.kind in {SectionKind.CODE, SectionKind.RENDER}:
-                yield from self.tokenizeCodeSectionLine(line, lineNumber)
-            elif section.kind is SectionKind.ROM:
-                yield from self.tokenizeROMSectionLine(line, lineNumber, section)
-            else:
-                raise NotImplementedError(f"Unknown section kind: {section.kind.name}")
-        except Exception as e:
-            raise LexerError([
-                e,
-                Exception(f"An error occurred at line {lineNumber}, see the above log")
-            ])
-
-    def tokenizeStringsSectionLine(self, line: str, lineNumber: int, section: Section) -> \
-            Iterator[Token]:
+        if section is not None:
+            yield sectionEndToken
+
+    def parseSectionHeader(self, line: str, lineNumber: int) -> Section:
+        section = Section()
+        if " " not in line:
+            self.error("The section header must contain an argument", lineNumber)
+        kind, section.argument = line[1:].split(" ", maxsplit=1)
+        section.kind = SectionKind(kind)
+        section.startsAtLine = lineNumber + 1
+        section.lines = [] if self.keepLines else None
+        return section
+
+    def tokenizeStringsSectionLine(self, line: str, lineNumber: int, section: Section) -> Token:
         LET = "Let "
         EQUALS = " be translated to "
 
-        if not line.startswith(LET) or EQUALS not in line or not line.endswith("."):
-            self.error("Invalid string", lineNumber)
-        idEnd: int = line.index(" ", len(LET))
-        key = self.convertIDToKey(line[len(LET):idEnd], lineNumber - section.startsAtLine)
-        value = line[idEnd + len(EQUALS):-1]
-        yield StringEntryToken(key, value)
-
-    def tokenizeROMSectionLine(self, line: str, lineNumber: int, section: Section) -> Iterator[
-        Token]:
+        match: re.Match | None = stringEntryPattern.fullmatch(line)
+        if match is not None:
+            idStr, value = match.groups()
+        else:
+            # An unusual (or invalid) line, handle it exactly like it always was
+            if not line.startswith(LET) or EQUALS not in line or not line.endswith("."):
+                self.error("Invalid string", lineNumber)
+            idEnd: int = line.index(" ", len(LET))
+            idStr, value = line[len(LET):idEnd], line[idEnd + len(EQUALS):-1]
+        key = self.convertIDToKey(idStr, lineNumber - section.startsAtLine)
+        return StringEntryToken(key, value)
+
+    def tokenizeROMSectionLine(self, line: str, lineNumber: int, section: Section) -> Token:
         CONST = "Remember that "
         EQUALS = " will always be "
 
-        if not line.startswith(CONST) or EQUALS not in line or not line.endswith("."):
-            self.error("Invalid ROM entry", lineNumber)
-        idEnd: int = line.index(" ", len(CONST))
-        key = self.convertIDToKey(line[len(CONST):idEnd], lineNumber - section.startsAtLine)
-        value = int(line[idEnd + len(EQUALS):-1], 11)
-        yield ROMEntryToken(key, value)
-
-    def tokenizeCodeSectionLine(self, line: str, lineNumber: int) -> Iterator[Token]:
-        instructionStr, *arguments = line.split(" ")
-        instruction = Instruction(instructionStr)
+        match: re.Match | None = romEntryPattern.fullmatch(line)
+        if match is not None:
+            idStr, value = match.groups()
+        else:
+            # An unusual (or invalid) line, handle it exactly like it always was
+            if not line.startswith(CONST) or EQUALS not in line or not line.endswith("."):
+                self.error("Invalid ROM entry", lineNumber)
+            idEnd: int = line.index(" ", len(CONST))
+            idStr, value = line[len(CONST):idEnd], line[idEnd + len(EQUALS):-1]
+        key = self.convertIDToKey(idStr, lineNumber - section.startsAtLine)
+        return ROMEntryToken(key, int(value, 11))
+
+    def tokenizeCodeSectionLine(self, line: str, lineNumber: int, section: Section) -> Token:
+        parts: list[str] = line.split(" ")
+        factory: Callable[[list[str]], Token] | None = instructionTokenFactories.get(parts[0])
+        if factory is None:
+            # Every instruction has a factory, so this raises the ValueError of an unknown one
+            raise NotImplementedError(f"Unknown instruction: {Instruction(parts[0]).name}")
 
         try:
-            if instruction is Instruction.START_CONTAINER:
-                yield StartContainerToken(arguments[0] if len(arguments) >= 1 else None)
-            elif instruction in instructionToSimpleToken:
-                # Just to simplify the process, ignore type errors
-                yield instructionToSimpleToken[instruction]()
-            elif instruction in instructionTo1ArgToken:
-                # Just to simplify the process, ignore type errors
-                yield instructionTo1ArgToken[instruction](arguments[0])
-            elif instruction is Instruction.TEXT:
-                yield TextToken(ValueRef(arguments[0]))
-            elif instruction is Instruction.SHOW:
-                yield ShowToken(ValueRef(arguments[0]))
-            elif instruction is Instruction.STACK_PUSH:
-                yield StackPushToken(ValueRef(arguments[0]))
-            elif instruction is Instruction.STACK_SWAP:
-                offA: int = int(arguments[0]) if len(arguments) >= 1 else 0
-                offB: int = int(arguments[1]) if len(arguments) >= 2 else 1
-                offA, offB = max(offA, 0), max(offB, 0)  # Must be >= 0
-                yield StackSwapToken(offA, offB)
-            elif instruction is Instruction.ADD_EVENT_LISTENER:
-                yield AddEventListenerToken(arguments[0], arguments[1])
-            else:
-                raise NotImplementedError(f"Unknown instruction: {instruction.name}")
+            return factory(parts)
         except IndexError as e:
             raise IndexError(f"Argument index out of range. Check whether you've provided enough"
-                             f" arguments to the instruction {instruction}") from e
+                             f" arguments to the instruction {Instruction(parts[0])}") from e
 
     def error(self, message: str, lineNumber: int):
         raise LexerError(ValueError(message + " on line " + str(lineNumber)))
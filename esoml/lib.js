@@ -1,5 +1,6 @@
 const __author__ = "kubik.augustyn@post.cz"
 
+//#if debug
 class CallID {
     /**
      * @type {Map<number|symbol, CallID>}
@@ -35,6 +36,7 @@ class CallID {
         return newID
     }
 }
+//#endif
 
 class CodeSection {
     /**
@@ -101,15 +103,14 @@ class RenderingStackEntry {
 }
 
 const root = Symbol("ROOT")
-const rootID = new CallID(-1)
+const rootID = new CallID(-1) //#debug
 const MUST_BE_RENDERABLE = Symbol("MUST_BE_RENDERABLE")
 const MUST_BE_CALLABLE = Symbol("MUST_BE_CALLABLE")
 const CAN_BE_ANY = Symbol("CAN_BE_ANY")
 const CONTAINER_KIND = Symbol("CONTAINER_KIND")
 const IF_STATEMENT_KIND = Symbol("IF_STATEMENT_KIND")
-const RERENDER_TIMEOUT = 100
-const MAX_RE_RENDERS_PER_SECOND = 5
 
+//#if debug
 const log = {
     info: (...args) => !unsafeMode && console.log(...args),
     error: (...args) => !unsafeMode && console.error(...args),
@@ -117,6 +118,7 @@ const log = {
     groupCollapsed: (...args) => !unsafeMode && console.groupCollapsed(...args),
     groupEnd: () => !unsafeMode && console.groupEnd(),
 }
+//#endif
 
 /**
  * @type {boolean}
@@ -153,65 +155,148 @@ let currentCodeType = CAN_BE_ANY
 /**
  * @type {boolean}
  */
-let shouldRerender = false
+let shouldRerender = false // Whether the render being run scheduled the next one
+/**
+ * @type {boolean}
+ */
+let renderRequested = false // Whether a render waits for a frame
+/**
+ * @type {number}
+ */
+let framesToSkip = 0 // The frames the next render waits for, as the last one overran the budget
 /**
  * @type {number}
  */
-let scheduledRendersWhileRendering = 0
+let selfScheduledRenders = 0 // The renders in a row scheduled by the render before them
+/**
+ * @type {number}
+ */
+let frameBudget = 8 // In milliseconds, set by the compiled code like the ones below
+/**
+ * @type {number}
+ */
+let renderLoopLimit = 60
 /**
  * @type {HTMLElement|null}
  */
 let currentTarget = null
+/**
+ * @type {HTMLTemplateElement[]}
+ */
+let templates = []
+/**
+ * @type {boolean}
+ */
+let hydrating = false // Whether the next render hydrates the elements prerendered by the server
+/**
+ * @type {HTMLElement[]|null}
+ */
+let hydratedElements = null // The elements that got event listeners while hydrating
+/**
+ * @type {WeakMap<HTMLElement, [string, string, CallID][]>}
+ */
+let elementListeners = new WeakMap() // Element --> its event listeners: [type, label, ID]
+/**
+ * @type {Set<string>}
+ */
+let delegatedTypes = new Set() // The event types the root element listens to
+/**
+ * @type {HTMLElement|null}
+ */
+let rootElement = null
+/**
+ * @type {number}
+ */
+let patchedNodes = 0 // The nodes the last render created, removed or changed
+/**
+ * @type {number}
+ */
+let reusedNodes = 0 // The nodes the last render kept as they were
 
-function container(id_, renderer, tag = null) {
-    const id = CallID.from(id_)
+function container(id_, renderer, tag = null) { //#debug
+//#production function container(renderer, tag = null) {
+    const id = CallID.from(id_) //#debug
     if (!currentCodeSection.isRenderable || currentCodeType === MUST_BE_CALLABLE) {
         renderer()
         return
     }
 
+    appendContainer(renderContainer(
+        id, //#debug
+        renderer, tag), tag)
+}
+
+// A container the compiler proved static (it only shows strings and constants), so it's rendered
+// only once, into a template, and cloned on the next renders
+function staticContainer(id_, template, renderer, tag = null) { //#debug
+//#production function staticContainer(template, renderer, tag = null) {
+    const id = CallID.from(id_) //#debug
+    if (!currentCodeSection.isRenderable || currentCodeType === MUST_BE_CALLABLE) {
+        renderer()
+        return
+    }
+
+    if (!templates[template]) {
+        const element = document.createElement("template")
+        element.content.appendChild(renderContainer(
+            id, //#debug
+            renderer, tag))
+        templates[template] = element
+    }
+    log.info("Static container:", id, template, templates[template]) //#debug
+    appendContainer(templates[template].content.firstChild.cloneNode(true), tag)
+}
+
+function renderContainer(id, renderer, tag) { //#debug
+//#production function renderContainer(renderer, tag) {
     const info = new RenderingStackEntry(
-        id,
+        id, //#debug
+        //#production null,
         currentCodeSection,
         document.createElement(tag || "div"),
         CONTAINER_KIND
     )
-    info.element.setAttribute("x-id", "container-".concat(id.toString()))
+    info.element.setAttribute("x-id", "container-".concat(id.toString())) //#debug
     renderingStack.push(info)
     const oldTarget = currentTarget
     currentTarget = info.element;
-    (tag === "root" ? log.group : log.groupCollapsed)("Container:", id, tag || "div")
-    log.info("Info:", info)
+    (tag === "root" ? log.group : log.groupCollapsed)("Container:", id, tag || "div") //#debug
+    log.info("Info:", info) //#debug
     renderer()
     renderingStack.pop()
     currentTarget = oldTarget
-    log.groupEnd()
+    log.groupEnd() //#debug
+    return info.element
+}
 
+function appendContainer(element, tag) {
     const container = renderingStack[renderingStack.length - 1].element
-    if (tag !== "root") container.appendChild(info.element)
+    if (tag !== "root") container.appendChild(element)
     else {
         // Array.from is used because when you add the child to a different element, it is removed from the current
         // element, causing a change of info.element.children to not include the already iterated child
-        for (const child of Array.from(info.element.children))
+        for (const child of Array.from(element.children))
             container.appendChild(child)
     }
 }
 
-function elem(id_, tag) {
-    const id = CallID.from(id_)
-    log.info("Elem:", id, tag)
+function elem(id_, tag) { //#debug
+//#production function elem(tag) {
+    const id = CallID.from(id_) //#debug
+    log.info("Elem:", id, tag) //#debug
 
     const container = renderingStack[renderingStack.length - 1].element
     const elem = document.createElement(tag)
-    elem.setAttribute("x-id", "elem-".concat(id))
+    elem.setAttribute("x-id", "elem-".concat(id)) //#debug
     container.appendChild(elem)
 }
 
-function call(id_, label, type = CAN_BE_ANY) {
-    const id = CallID.from(id_)
+function call(id_, label, type = CAN_BE_ANY) { //#debug
+//#production function call(label, type = CAN_BE_ANY) {
+    const id = CallID.from(id_) //#debug
     if (!codeMap.has(label)) throw new Error("Cannot call an undefined section")
     const code = codeMap.get(label);
-    (type === MUST_BE_CALLABLE ? log.group : log.info)("Call:", code)
+    (type === MUST_BE_CALLABLE ? log.group : log.info)("Call:", code) //#debug
     if ((type === MUST_BE_RENDERABLE && renderingStack[renderingStack.length - 1].code.isRenderable !== code.isRenderable) ||
         (type !== CAN_BE_ANY && (type === MUST_BE_RENDERABLE ? !code.isRenderable : code.isRenderable)))
         throw new Error("Cannot directly call renderable code from a non-renderable section and vice versa")
@@ -226,52 +311,73 @@ function call(id_, label, type = CAN_BE_ANY) {
 
     currentCodeType = oldType
     currentCodeSection = oldSection
-    if (type === MUST_BE_CALLABLE) log.groupEnd()
+    if (type === MUST_BE_CALLABLE) log.groupEnd() //#debug
 }
 
-function eventListen(id_, type, listener) {
-    const id = CallID.from(id_)
-    log.info("Event listener:", id, type, listener)
+function eventListen(id_, type, listener) { //#debug
+//#production function eventListen(type, listener) {
+    const id = CallID.from(id_) //#debug
+    log.info("Event listener:", id, type, listener) //#debug
     const container = renderingStack[renderingStack.length - 1].element
-    container.addEventListener(type, e => {
-        const oldTarget = currentTarget
-        currentTarget = e.target
-        try {
-            call(id, listener, MUST_BE_CALLABLE)
-        } catch (e) {
-            renderError(e)
-        } finally {
-            currentTarget = oldTarget
+    if (!elementListeners.has(container)) elementListeners.set(container, [])
+    elementListeners.get(container).push([type, listener, id]) //#debug
+    //#production elementListeners.get(container).push([type, listener])
+    if (hydratedElements !== null) hydratedElements.push(container)
+    if (delegatedTypes.has(type)) return
+    // Captured, so that the events that don't bubble get there too
+    rootElement.addEventListener(type, dispatchDelegatedEvent, true)
+    delegatedTypes.add(type)
+}
+
+function dispatchDelegatedEvent(e) {
+    // Runs the listeners of the target and, if the event bubbles, of its ancestors, the innermost
+    // first, just as if the listeners were added to the elements themselves
+    const oldTarget = currentTarget
+    currentTarget = e.target
+    for (let element = e.target; element !== null; element = e.bubbles ? element.parentNode : null) {
+        for (const [type, listener, id] of elementListeners.get(element) || []) {
+            if (type !== e.type) continue
+            try {
+                call(id, listener, MUST_BE_CALLABLE) //#debug
+                //#production call(listener, MUST_BE_CALLABLE)
+            } catch (error) {
+                renderError(error)
+            }
         }
-    })
+        if (element === rootElement) break
+    }
+    currentTarget = oldTarget
 }
 
-function calc(id_, op) {
-    const id = CallID.from(id_)
-    log.groupCollapsed("Calculate:", id, op)
-    const A = stackPop(id)
-    const B = stackPop(id)
-    log.info(`Operation: result = ${A} ${op} ${B}`)
-    let result
+function calc(id_, op) { //#debug
+//#production function calc(op) {
+    const id = CallID.from(id_) //#debug
+    log.groupCollapsed("Calculate:", id, op) //#debug
+    const A = stackPop(id) //#debug
+    const B = stackPop(id) //#debug
+    //#production const A = stackPop()
+    //#production const B = stackPop()
+    log.info(`Operation: result = ${A} ${op} ${B}`) //#debug
+    const result = calculate(op, A, B)
+    stackPush(id, result) //#debug
+    //#production stackPush(result)
+    log.info(`Result: ${A} ${op} ${B} = ${result}`) //#debug
+    log.groupEnd() //#debug
+}
+
+function calculate(op, A, B) {
     switch (op) {
         case "+":
-            result = A + B
-            break
+            return A + B
         case "-":
-            result = A - B
-            break
+            return A - B
         case "*":
-            result = A * B
-            break
+            return A * B
         case "//":
-            result = Math.floor(A / B)
-            break
+            return Math.floor(A / B)
         default:
             throw new Error("Unknown operator: " + op)
     }
-    stackPush(id, result)
-    log.info(`Result: ${A} ${op} ${B} = ${result}`)
-    log.groupEnd()
 }
 
 function checkStackVal(val) {
@@ -292,56 +398,65 @@ function getStackIndex(off) {
     return valueStack.length - 1 - off
 }
 
-function stackPush(id_, val) {
-    const id = CallID.from(id_)
-    log.info("Push to the stack:", id, val)
+function stackPush(id_, val) { //#debug
+//#production function stackPush(val) {
+    const id = CallID.from(id_) //#debug
+    log.info("Push to the stack:", id, val) //#debug
     checkStackVal(val)
     valueStack.push(val)
 }
 
-function stackCopy(id_) {
-    const id = CallID.from(id_)
+function stackCopy(id_) { //#debug
+//#production function stackCopy() {
+    const id = CallID.from(id_) //#debug
     if (valueStack.length < 1)
         throw new Error(`Cannot duplicate the value at the top of the stack, because it's empty`)
-    log.info("Duplicate the top stack entry:", id)
+    log.info("Duplicate the top stack entry:", id) //#debug
     valueStack.push(valueStack[valueStack.length - 1])
 }
 
-function stackPop(id_) {
-    const id = CallID.from(id_)
+function stackPop(id_) { //#debug
+//#production function stackPop() {
+    const id = CallID.from(id_) //#debug
     if (valueStack.length < 1)
         throw new Error(`Cannot pop a value off the stack, because it's empty`)
     const val = valueStack.pop()
-    log.info("Pop a value from the stack:", id, val)
+    log.info("Pop a value from the stack:", id, val) //#debug
     return val
 }
 
-function stackSwap(id_, offA, offB) {
-    const id = CallID.from(id_)
+function stackSwap(id_, offA, offB) { //#debug
+//#production function stackSwap(offA, offB) {
+    const id = CallID.from(id_) //#debug
     checkStackOff(offA)
     checkStackOff(offB)
     const A = getStack(offA)
     const B = getStack(offB)
-    log.info("Swap 2 values on the top of the stack:", id, A, B)
+    log.info("Swap 2 values on the top of the stack:", id, A, B) //#debug
     valueStack[getStackIndex(offA)] = B
     valueStack[getStackIndex(offB)] = A
 }
 
-function compare(id_) {
-    const id = CallID.from(id_)
-    log.groupCollapsed("Compare:", id)
-    const A = stackPop(id)
-    const B = stackPop(id)
-    log.info(`Compare: result = ${A} == ${B}`)
+function compare(id_) { //#debug
+//#production function compare() {
+    const id = CallID.from(id_) //#debug
+    log.groupCollapsed("Compare:", id) //#debug
+    const A = stackPop(id) //#debug
+    const B = stackPop(id) //#debug
+    //#production const A = stackPop()
+    //#production const B = stackPop()
+    log.info(`Compare: result = ${A} == ${B}`) //#debug
     const result = Number(A === B)
-    stackPush(id, result)
-    log.info(`Result: ${A} === ${B} = ${result}`)
-    log.groupEnd()
+    stackPush(id, result) //#debug
+    //#production stackPush(result)
+    log.info(`Result: ${A} === ${B} = ${result}`) //#debug
+    log.groupEnd() //#debug
 }
 
-function read(id_) {
-    const id = CallID.from(id_)
-    log.info("Read:", id, currentTarget)
+function read(id_) { //#debug
+//#production function read() {
+    const id = CallID.from(id_) //#debug
+    log.info("Read:", id, currentTarget) //#debug
     if (currentTarget === null) throw new Error("Cannot read the contents of an element, when there's no element currently being targeted")
     let value = null
     if (currentTarget instanceof HTMLInputElement) {
@@ -377,37 +492,146 @@ function read(id_) {
         }
     } else value = currentTarget.innerHTML
 
-    stackPush(id, value)
+    stackPush(id, value) //#debug
+    //#production stackPush(value)
 }
 
-function ifStatement(id_, ifTrue) {
-    const id = CallID.from(id_)
-    const isTrue = stackPop(id_) === 1
-    log.group("If statement:", id, isTrue)
+function ifStatement(id_, ifTrue) { //#debug
+//#production function ifStatement(ifTrue) {
+    const id = CallID.from(id_) //#debug
+    const isTrue = stackPop(id_) === 1 //#debug
+    //#production const isTrue = stackPop() === 1
+    log.group("If statement:", id, isTrue) //#debug
     if (!isTrue) return
+    enterIfStatement(id, ifTrue) //#debug
+    //#production enterIfStatement(ifTrue)
+}
 
+function enterIfStatement(id, ifTrue) { //#debug
+//#production function enterIfStatement(ifTrue) {
     const info = new RenderingStackEntry(
-        id,
+        id, //#debug
+        //#production null,
         currentCodeSection,
         renderingStack[renderingStack.length - 1].element, // Inherit the element from the parent
         IF_STATEMENT_KIND
     )
     renderingStack.push(info)
-    log.info("Info:", info)
+    log.info("Info:", info) //#debug
     ifTrue()
     renderingStack.pop()
-    log.groupEnd()
+    log.groupEnd() //#debug
+}
+
+function scheduleRender(id_) { //#debug
+//#production function scheduleRender() {
+    const id = CallID.from(id_) //#debug
+    log.info("Schedule render:", id) //#debug
+    if (currentCodeType === MUST_BE_CALLABLE) requestRender(0)
+    else shouldRerender = true // The render requests the next one once it's done
+}
+
+function requestRender(skippedFrames) {
+    // All the renders requested until the next frame are coalesced into a single one
+    framesToSkip = skippedFrames
+    if (renderRequested) return
+    renderRequested = true
+    requestAnimationFrame(renderFrame)
 }
 
-function scheduleRender(id_) {
-    const id = CallID.from(id_)
-    log.info("Schedule render:", id)
-    if (currentCodeType === MUST_BE_CALLABLE) {
-        if (!shouldRerender) setTimeout(render, RERENDER_TIMEOUT)
-    } else {
-        scheduledRendersWhileRendering++
+function renderFrame() {
+    if (framesToSkip > 0) {
+        framesToSkip--
+        requestAnimationFrame(renderFrame)
+        return
     }
-    shouldRerender = true
+    renderRequested = false
+    render()
+}
+
+// The variants of the stack operations without the checks, the compiler only emits them where it
+// proved that the checks can never fail
+
+function stackPushUnchecked(id_, val) { //#debug
+//#production function stackPushUnchecked(val) {
+    const id = CallID.from(id_) //#debug
+    log.info("Push to the stack:", id, val) //#debug
+    valueStack.push(val)
+}
+
+function stackCopyUnchecked(id_) { //#debug
+//#production function stackCopyUnchecked() {
+    const id = CallID.from(id_) //#debug
+    log.info("Duplicate the top stack entry:", id) //#debug
+    valueStack.push(valueStack[valueStack.length - 1])
+}
+
+function stackPopUnchecked(id_) { //#debug
+//#production function stackPopUnchecked() {
+    const id = CallID.from(id_) //#debug
+    const val = valueStack.pop()
+    log.info("Pop a value from the stack:", id, val) //#debug
+    return val
+}
+
+function stackSwapUnchecked(id_, offA, offB) { //#debug
+//#production function stackSwapUnchecked(offA, offB) {
+    const id = CallID.from(id_) //#debug
+    const indexA = getStackIndex(offA)
+    const indexB = getStackIndex(offB)
+    const A = valueStack[indexA]
+    const B = valueStack[indexB]
+    log.info("Swap 2 values on the top of the stack:", id, A, B) //#debug
+    valueStack[indexA] = B
+    valueStack[indexB] = A
+}
+
+function compareUnchecked(id_) { //#debug
+//#production function compareUnchecked() {
+    const id = CallID.from(id_) //#debug
+    log.groupCollapsed("Compare:", id) //#debug
+    const A = stackPopUnchecked(id) //#debug
+    const B = stackPopUnchecked(id) //#debug
+    //#production const A = stackPopUnchecked()
+    //#production const B = stackPopUnchecked()
+    log.info(`Compare: result = ${A} == ${B}`) //#debug
+    const result = Number(A === B)
+    stackPushUnchecked(id, result) //#debug
+    //#production stackPushUnchecked(result)
+    log.info(`Result: ${A} === ${B} = ${result}`) //#debug
+    log.groupEnd() //#debug
+}
+
+function calcUnchecked(id_, op) { //#debug
+//#production function calcUnchecked(op) {
+    const id = CallID.from(id_) //#debug
+    log.groupCollapsed("Calculate:", id, op) //#debug
+    const A = stackPopUnchecked(id) //#debug
+    const B = stackPopUnchecked(id) //#debug
+    //#production const A = stackPopUnchecked()
+    //#production const B = stackPopUnchecked()
+    log.info(`Operation: result = ${A} ${op} ${B}`) //#debug
+    const result = calculate(op, A, B)
+    // The result is still checked
+    stackPush(id, result) //#debug
+    //#production stackPush(result)
+    log.info(`Result: ${A} ${op} ${B} = ${result}`) //#debug
+    log.groupEnd() //#debug
+}
+
+function ifStatementUnchecked(id_, ifTrue) { //#debug
+//#production function ifStatementUnchecked(ifTrue) {
+    const id = CallID.from(id_) //#debug
+    const isTrue = stackPopUnchecked(id_) === 1 //#debug
+    //#production const isTrue = stackPopUnchecked() === 1
+    log.group("If statement:", id, isTrue) //#debug
+    if (!isTrue) return
+    enterIfStatement(id, ifTrue) //#debug
+    //#production enterIfStatement(ifTrue)
+}
+
+function getStackUnchecked(key) {
+    return valueStack[getStackIndex(key)]
 }
 
 function getString(key) {
@@ -425,14 +649,15 @@ function getStack(key) {
     return valueStack[getStackIndex(key)]
 }
 
-function rawValue(id_, unsafeInnerHTML, content) {
-    const id = CallID.from(id_)
+function rawValue(id_, unsafeInnerHTML, content) { //#debug
+//#production function rawValue(unsafeInnerHTML, content) {
+    const id = CallID.from(id_) //#debug
     if (typeof content === "undefined" || content === null) {
-        log.info("Raw value undefined, skip:", id, unsafeInnerHTML, content)
+        log.info("Raw value undefined, skip:", id, unsafeInnerHTML, content) //#debug
         return
     }
     content = content.toString()
-    log.info("Raw value:", id, unsafeInnerHTML, content)
+    log.info("Raw value:", id, unsafeInnerHTML, content) //#debug
     const container = renderingStack[renderingStack.length - 1].element
     const elem = document.createElement("span")
     /**
@@ -448,7 +673,7 @@ function rawValue(id_, unsafeInnerHTML, content) {
         elem.innerText = content
         finalContainer = elem
     }
-    finalContainer.setAttribute("x-id", "rawValue-".concat(id))
+    finalContainer.setAttribute("x-id", "rawValue-".concat(id)) //#debug
     container.appendChild(finalContainer)
 }
 
@@ -470,56 +695,383 @@ function code(label, isRenderable, rendererOrCallee) {
     codeMap.set(label, new CodeSection(label, isRenderable, rendererOrCallee))
 }
 
+// The bytecode backend, see esoml/bytecode.py for the instructions, the numbers must be the same
+const OP_CONTAINER = 0
+const OP_STATIC_CONTAINER = 1
+const OP_IF_STATEMENT = 2
+const OP_IF_STATEMENT_UNCHECKED = 3
+const OP_ELEM = 4
+const OP_RAW_VALUE = 5
+const OP_CALL = 6
+const OP_RENDER = 7
+const OP_ADD_EVENT_LISTENER = 8
+const OP_STACK_PUSH = 9
+const OP_STACK_PUSH_UNCHECKED = 10
+const OP_STACK_COPY = 11
+const OP_STACK_COPY_UNCHECKED = 12
+const OP_STACK_POP = 13
+const OP_STACK_POP_UNCHECKED = 14
+const OP_STACK_SWAP = 15
+const OP_STACK_SWAP_UNCHECKED = 16
+const OP_COMPARE = 17
+const OP_COMPARE_UNCHECKED = 18
+const OP_READ = 19
+const OP_MATH_OP = 20
+const OP_MATH_OP_UNCHECKED = 21
+const VALUE_STRING = 0
+const VALUE_CONSTANT = 1
+const VALUE_STACK = 2
+const VALUE_STACK_UNCHECKED = 3
+
+/**
+ * @param label {string}
+ * @param isRenderable {boolean}
+ * @param encoded {string} The instructions as base64 of 32-bit little endian integers
+ * @param constants {(number|string)[]}
+ */
+function bytecode(label, isRenderable, encoded, constants) {
+    const program = decodeBytecode(encoded)
+    code(label, isRenderable, () => runBytecode(program, constants, 0, program.length))
+}
+
+function decodeBytecode(encoded) {
+    // Int32Array uses the byte order of the platform, which is little endian everywhere browsers run
+    const bytes = atob(encoded)
+    const buffer = new Uint8Array(bytes.length)
+    for (let i = 0; i < bytes.length; i++) buffer[i] = bytes.charCodeAt(i)
+    return new Int32Array(buffer.buffer)
+}
+
+// Runs the instructions from pc up to end, the children of an instruction are run by the runtime
+// function it calls (e.g. container), the same as the closures of the other backend
+function runBytecode(program, constants, pc, end) {
+    while (pc < end) {
+        const opcode = program[pc++]
+        const id = program[pc++] //#debug
+        switch (opcode) {
+            case OP_CONTAINER: {
+                const tag = program[pc++], next = program[pc++], start = pc
+                const renderer = () => runBytecode(program, constants, start, next)
+                container(id, renderer, tag === -1 ? null : constants[tag]) //#debug
+                //#production container(renderer, tag === -1 ? null : constants[tag])
+                pc = next
+                break
+            }
+            case OP_STATIC_CONTAINER: {
+                const template = program[pc++], tag = program[pc++], next = program[pc++], start = pc
+                const renderer = () => runBytecode(program, constants, start, next)
+                staticContainer(id, template, renderer, tag === -1 ? null : constants[tag]) //#debug
+                //#production staticContainer(template, renderer, tag === -1 ? null : constants[tag])
+                pc = next
+                break
+            }
+            case OP_IF_STATEMENT:
+            case OP_IF_STATEMENT_UNCHECKED: {
+                const next = program[pc++], start = pc
+                const ifTrue = () => runBytecode(program, constants, start, next)
+                if (opcode === OP_IF_STATEMENT) ifStatement(id, ifTrue) //#debug
+                else ifStatementUnchecked(id, ifTrue) //#debug
+                //#production if (opcode === OP_IF_STATEMENT) ifStatement(ifTrue)
+                //#production else ifStatementUnchecked(ifTrue)
+                pc = next
+                break
+            }
+            case OP_ELEM:
+                elem(id, constants[program[pc++]]) //#debug
+                //#production elem(constants[program[pc++]])
+                break
+            case OP_RAW_VALUE: {
+                const unsafeInnerHTML = program[pc++] === 1
+                const value = bytecodeValue(program[pc++], constants[program[pc++]])
+                rawValue(id, unsafeInnerHTML, value) //#debug
+                //#production rawValue(unsafeInnerHTML, value)
+                break
+            }
+            case OP_CALL:
+                call(id, constants[program[pc++]]) //#debug
+                //#production call(constants[program[pc++]])
+                break
+            case OP_RENDER:
+                scheduleRender(id) //#debug
+                //#production scheduleRender()
+                break
+            case OP_ADD_EVENT_LISTENER: {
+                const type = constants[program[pc++]], listener = constants[program[pc++]]
+                eventListen(id, type, listener) //#debug
+                //#production eventListen(type, listener)
+                break
+            }
+            case OP_STACK_PUSH: {
+                const value = bytecodeValue(program[pc++], constants[program[pc++]])
+                stackPush(id, value) //#debug
+                //#production stackPush(value)
+                break
+            }
+            case OP_STACK_PUSH_UNCHECKED: {
+                const value = bytecodeValue(program[pc++], constants[program[pc++]])
+                stackPushUnchecked(id, value) //#debug
+                //#production stackPushUnchecked(value)
+                break
+            }
+            case OP_STACK_COPY:
+                stackCopy(id) //#debug
+                //#production stackCopy()
+                break
+            case OP_STACK_COPY_UNCHECKED:
+                stackCopyUnchecked(id) //#debug
+                //#production stackCopyUnchecked()
+                break
+            case OP_STACK_POP:
+                stackPop(id) //#debug
+                //#production stackPop()
+                break
+            case OP_STACK_POP_UNCHECKED:
+                stackPopUnchecked(id) //#debug
+                //#production stackPopUnchecked()
+                break
+            case OP_STACK_SWAP: {
+                const offA = constants[program[pc++]], offB = constants[program[pc++]]
+                stackSwap(id, offA, offB) //#debug
+                //#production stackSwap(offA, offB)
+                break
+            }
+            case OP_STACK_SWAP_UNCHECKED: {
+                const offA = constants[program[pc++]], offB = constants[program[pc++]]
+                stackSwapUnchecked(id, offA, offB) //#debug
+                //#production stackSwapUnchecked(offA, offB)
+                break
+            }
+            case OP_COMPARE:
+                compare(id) //#debug
+                //#production compare()
+                break
+            case OP_COMPARE_UNCHECKED:
+                compareUnchecked(id) //#debug
+                //#production compareUnchecked()
+                break
+            case OP_READ:
+                read(id) //#debug
+                //#production read()
+                break
+            case OP_MATH_OP:
+                calc(id, constants[program[pc++]]) //#debug
+                //#production calc(constants[program[pc++]])
+                break
+            case OP_MATH_OP_UNCHECKED:
+                calcUnchecked(id, constants[program[pc++]]) //#debug
+                //#production calcUnchecked(constants[program[pc++]])
+                break
+            default:
+                throw new Error("Unknown bytecode instruction: " + opcode)
+        }
+    }
+}
+
+function bytecodeValue(kind, constant) {
+    switch (kind) {
+        case VALUE_STRING:
+            return getString(constant)
+        case VALUE_CONSTANT:
+            return getConstant(constant)
+        case VALUE_STACK:
+            return getStack(constant)
+        case VALUE_STACK_UNCHECKED:
+            return getStackUnchecked(constant)
+        default:
+            return constant
+    }
+}
+
 function setUnsafeMode(newUnsafeMode) {
     unsafeMode = newUnsafeMode
 }
 
+function setRenderScheduler(newFrameBudget, newRenderLoopLimit) {
+    frameBudget = newFrameBudget
+    renderLoopLimit = newRenderLoopLimit
+}
+
 function main(target) {
     // EsoML COMPILED CODE
 
+    rootElement = target
     try {
-        renderingStack.push(new RenderingStackEntry(rootID, new CodeSection(root, true, null), target))
+        renderingStack.push(new RenderingStackEntry(rootID, new CodeSection(root, true, null), target)) //#debug
+        //#production renderingStack.push(new RenderingStackEntry(null, new CodeSection(root, true, null), target))
 
-        if (codeMap.has("init")) call(rootID, "init", MUST_BE_CALLABLE)
+        if (codeMap.has("init")) call(rootID, "init", MUST_BE_CALLABLE) //#debug
+        //#production if (codeMap.has("init")) call("init", MUST_BE_CALLABLE)
 
+        hydrating = target.hasAttribute("data-prerendered")
         render()
     } catch (e) {
         renderError(e)
     } finally {
 
     }
-
-    // Reset the counter every second lazily
-    setInterval(() => {
-        scheduledRendersWhileRendering = 0
-    }, 1000)
 }
 
 function render() {
-    console.time("Render")
-    log.groupCollapsed("Render")
+    console.time("Render") //#debug
+    log.groupCollapsed("Render") //#debug
+    const start = performance.now()
     shouldRerender = false
-    renderingStack[0].element.innerHTML = "" // Could be done better, but whatever
+    const target = renderingStack[0].element
+    const isHydrating = hydrating
+    hydrating = false
+    // The live elements stay in place, they're only patched once the render is done
+    renderingStack[0].element = document.createElement(target.tagName)
+    if (isHydrating) hydratedElements = []
+    let error = null
     try {
-        call(rootID, "main", MUST_BE_RENDERABLE)
-        if (!unsafeMode && (scheduledRendersWhileRendering > MAX_RE_RENDERS_PER_SECOND)) {
+        call(rootID, "main", MUST_BE_RENDERABLE) //#debug
+        //#production call("main", MUST_BE_RENDERABLE)
+        selfScheduledRenders = shouldRerender ? selfScheduledRenders + 1 : 0
+        if (!unsafeMode && selfScheduledRenders > renderLoopLimit) {
             shouldRerender = false
-            throw new Error(`The amount of scheduled re-renders from the render sections or unknown section exceeded ${MAX_RE_RENDERS_PER_SECOND} per second, infinite loop prevented.\nMaybe you want to add the unsafe_mode section to your code (will not log anything other than timing)`)
+            throw new Error(`The render sections scheduled a re-render in more than ${renderLoopLimit} renders in a row, infinite loop prevented.\nMaybe you want to add the unsafe_mode section to your code (will not log anything other than timing)`)
         }
     } catch (e) {
-        renderError(e)
+        error = e
+    }
+    if (isHydrating) hydrate(target, error === null)
+    else {
+        const rendered = renderingStack[0].element
+        renderingStack[0].element = target
+        if (error === null) reconcile(target, rendered)
+    }
+    if (error !== null) renderError(error)
+    if (shouldRerender) {
+        // A render loop keeps to the frame budget by skipping the frames its last render overran
+        const duration = performance.now() - start
+        log.info("Render took", duration, "ms of the", frameBudget, "ms budget") //#debug
+        requestRender(Math.floor(duration / frameBudget))
+    }
+    log.groupEnd() //#debug
+    console.timeEnd("Render") //#debug
+}
+
+function hydrate(target, succeeded) {
+    // Keeps the prerendered elements if they're the same as the rendered ones, only adding the
+    // event listeners to them, otherwise reconciles them
+    const rendered = renderingStack[0].element
+    const elements = hydratedElements
+    renderingStack[0].element = target
+    hydratedElements = null
+    target.removeAttribute("data-prerendered")
+    if (!succeeded) return
+
+    const markup = rendered.cloneNode(true)
+    for (const element of markup.querySelectorAll("[x-id]")) element.removeAttribute("x-id") //#debug
+    if (markup.innerHTML !== target.innerHTML) {
+        log.info("The prerendered elements differ from the rendered ones, patching them") //#debug
+        reconcile(target, rendered)
+        return
+    }
+    for (const element of new Set(elements)) {
+        // The listeners of the elements not in the rendered tree (e.g. root containers) never run
+        const path = []
+        let node = element
+        while (node !== rendered && node.parentNode !== null) {
+            path.push(Array.prototype.indexOf.call(node.parentNode.childNodes, node))
+            node = node.parentNode
+        }
+        if (node !== rendered) continue
+        let hydrated = target
+        for (let i = path.length - 1; i >= 0; i--) hydrated = hydrated.childNodes[path[i]]
+        patchListeners(hydrated, element)
+    }
+    log.info("Hydrated the prerendered elements:", target) //#debug
+}
+
+function reconcile(live, rendered) {
+    // Patches the children of the live element to be the same as the children of the rendered one.
+    // The children are matched by their x-id (only by their tag in production, which has no IDs),
+    // so the elements that didn't change are kept, together with their focus, input values and
+    // scroll position. A created or removed subtree counts as a single patched node.
+    patchedNodes = 0
+    reusedNodes = 0
+    const stack = [[live, rendered]]
+    while (stack.length > 0) {
+        const [liveParent, renderedParent] = stack.pop()
+        const candidates = new Map() // Key --> the live children with it, the first one last
+        const liveChildren = Array.from(liveParent.childNodes)
+        for (let i = liveChildren.length - 1; i >= 0; i--) {
+            const key = nodeKey(liveChildren[i])
+            if (!candidates.has(key)) candidates.set(key, [])
+            candidates.get(key).push(liveChildren[i])
+        }
+        let next = liveParent.firstChild // The live child at the position of the rendered one
+        for (const child of Array.from(renderedParent.childNodes)) {
+            const matches = candidates.get(nodeKey(child))
+            const match = matches !== undefined && matches.length > 0 ? matches.pop() : null
+            if (match === null) {
+                liveParent.insertBefore(child, next)
+                patchedNodes++
+                continue
+            }
+            if (match === next) next = next.nextSibling
+            else liveParent.insertBefore(match, next)
+            if (patchNode(match, child)) patchedNodes++
+            else reusedNodes++
+            if (match.nodeType === Node.ELEMENT_NODE) stack.push([match, child])
+        }
+        while (next !== null) {
+            // The children that are no longer rendered
+            const removed = next
+            next = next.nextSibling
+            liveParent.removeChild(removed)
+            patchedNodes++
+        }
     }
-    if (shouldRerender) setTimeout(render, RERENDER_TIMEOUT)
-    log.groupEnd()
-    console.timeEnd("Render")
+    log.info("Reconciled:", patchedNodes, "nodes patched,", reusedNodes, "reused") //#debug
+}
+
+function nodeKey(node) {
+    if (node.nodeType !== Node.ELEMENT_NODE) return node.nodeName
+    return node.tagName.concat(node.getAttribute("x-id") || "") //#debug
+    //#production return node.tagName
+}
+
+function patchNode(live, rendered) {
+    // Returns whether the live node changed
+    if (live.nodeType !== Node.ELEMENT_NODE) {
+        if (live.nodeValue === rendered.nodeValue) return false
+        live.nodeValue = rendered.nodeValue
+        return true
+    }
+    let changed = false
+    for (const name of live.getAttributeNames()) {
+        if (rendered.hasAttribute(name)) continue
+        live.removeAttribute(name)
+        changed = true
+    }
+    for (const name of rendered.getAttributeNames()) {
+        const value = rendered.getAttribute(name)
+        if (live.getAttribute(name) === value) continue
+        live.setAttribute(name, value)
+        changed = true
+    }
+    return patchListeners(live, rendered) || changed
+}
+
+function patchListeners(live, rendered) {
+    // The live element takes over the listeners of the rendered one from the table the events are
+    // dispatched by, returns whether they changed
+    const liveListeners = elementListeners.get(live) || []
+    const renderedListeners = elementListeners.get(rendered) || []
+    elementListeners.set(live, renderedListeners)
+    return liveListeners.length !== renderedListeners.length || liveListeners.some(
+        ([type, label], i) => type !== renderedListeners[i][0] || label !== renderedListeners[i][1])
 }
 
 function renderError(e) {
-    for (let i = 0; i < renderingStack.length; i++) log.groupEnd()
+    for (let i = 0; i < renderingStack.length; i++) log.groupEnd() //#debug
     renderingStack[0].element.style.color = "red"
     const err = (e.stack || e.toString()).replaceAll("<", "&lt;").replaceAll("\n", "<br>")
     renderingStack[0].element.innerHTML = "<h1>An error occurred</h1>".concat(err)
-    log.error(e)
+    log.error(e) //#debug
+    //#production console.error(e)
 }
 
 main(document.getElementById("root"))
@@ -78,6 +78,26 @@ class ROMEntryNode(LocalizedSectionEntryNode[int]):
 
 
 # CODE
+# A value known at compile time, put in place of a ValueRef by the optimizer (e.g. a folded
+# constant). Compiles to a plain JavaScript number.
+class LiteralValue:
+    __slots__ = ("value",)
+
+    value: int
+
+    def __init__(self, value: int):
+        self.value = value
+
+    def __str__(self):
+        return str(self.value)
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, LiteralValue) and other.value == self.value
+
+    def __hash__(self) -> int:
+        return hash((LiteralValue, self.value))
+
+
 class SectionCodeNode(ASTNode):
     label: str
     isRender: bool
@@ -109,10 +129,10 @@ class ElemNode(ASTNode):
 
 
 class RawValueNode(ASTNode):
-    value: ValueRef  # Reference to the value in the string table
+    value: ValueRef | LiteralValue  # Reference to the value in the string table
     injectRaw: bool  # Set with innerText (False) or innerHTML (True)
 
-    def __init__(self, value: ValueRef, injectRaw: bool):
+    def __init__(self, value: ValueRef | LiteralValue, injectRaw: bool):
         super().__init__(NodeType.RAW_VALUE, (value, injectRaw))
         self.value = value
         self.injectRaw = injectRaw
@@ -142,9 +162,9 @@ class AddEventListenerNode(ASTNode):
 
 
 class StackPushNode(ASTNode):
-    value: ValueRef
+    value: ValueRef | LiteralValue
 
-    def __init__(self, value: ValueRef):
+    def __init__(self, value: ValueRef | LiteralValue):
         super().__init__(NodeType.STACK_PUSH, value)
         self.value = value
 
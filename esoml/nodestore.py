@@ -0,0 +1,181 @@
+#  -*- coding: utf-8 -*-
+__author__ = "kubik.augustyn@post.cz"
+
+from array import array
+from typing import Any, Iterator, Callable, Final
+
+from kutil.language.AST import AST, ASTNode
+
+from esoml.nodes import *
+
+NO_OPERAND: Final[int] = -1
+
+# NodeType.value --> NodeType, indexing a tuple is a lot faster than calling the enum
+nodeTypes: Final[tuple[NodeType | None, ...]] = tuple(
+    next((nodeType for nodeType in NodeType if nodeType.value == value), None)
+    for value in range(max(nodeType.value for nodeType in NodeType) + 1)
+)
+
+
+# A struct-of-arrays alternative to the AST, a node takes 17 bytes instead of a few hundreds.
+# Every node has a type, two operands and a range of children. The operands are either plain
+# numbers (flags) or indices into the pool, which holds every distinct string, key, ValueRef etc.
+# only once. Children have to be added right after each other (as the parser does), so that
+# a range describes them.
+# It can be used in place of the AST, the nodes are then materialized on demand, but the compiler
+# walks the columns directly.
+class NodeStore(AST):
+    types: array  # 'b', NodeType.value
+    operandsA: array  # 'i'
+    operandsB: array  # 'i'
+    childStarts: array  # 'i', the index of the first child
+    childEnds: array  # 'i', the index after the last child
+    pool: list[Any]
+    poolIndices: dict[Any, int]  # Pool entry --> its index
+    valueCodes: dict[int, str]  # Pool index of a ValueRef --> its compiled code, filled lazily
+    roots: list[int]
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.types = array("b")
+        self.operandsA = array("i")
+        self.operandsB = array("i")
+        self.childStarts = array("i")
+        self.childEnds = array("i")
+        self.pool = []
+        self.poolIndices = {}
+        self.valueCodes = {}
+        self.roots = []
+
+    def intern(self, value: Any) -> int:
+        # The type is a part of the key, so that e.g. True and 1 don't share an entry
+        key = (type(value), value)
+        index: int | None = self.poolIndices.get(key)
+        if index is None:
+            index = self.poolIndices[key] = len(self.pool)
+            self.pool.append(value)
+        return index
+
+    def addNode(self, node: ASTNode) -> int:
+        encode: Callable[[NodeStore, Any], tuple[int, int]] | None = nodeEncoders.get(node.type)
+        if encode is None:
+            raise TypeError(f"Bad node type: {type(node)}")
+        a, b = encode(self, node)
+        children: list[int] = getattr(node, "children", ())
+        if children and children[-1] - children[0] + 1 != len(children):
+            raise ValueError("The children of a node must be added right after each other")
+        self.types.append(node.type.value)
+        self.operandsA.append(a)
+        self.operandsB.append(b)
+        self.childStarts.append(children[0] if children else 0)
+        self.childEnds.append(children[-1] + 1 if children else 0)
+        return len(self.types) - 1
+
+    def addNodes(self, nodes: list[ASTNode]) -> list[int]:
+        return [self.addNode(node) for node in nodes]
+
+    def addRootNode(self, nodeI: int) -> None:
+        if not isinstance(nodeI, int):
+            raise TypeError("Node index should be int")
+        self.roots.append(nodeI)
+
+    def getNode(self, nodeI: int) -> ASTNode:
+        # Materializes the node, so its every call returns a new object
+        nodeType: NodeType = nodeTypes[self.types[nodeI]]
+        a, b = self.operandsA[nodeI], self.operandsB[nodeI]
+        pool: list[Any] = self.pool
+        children: list[int] = list(range(self.childStarts[nodeI], self.childEnds[nodeI]))
+        if nodeType is NodeType.CONTAINER:
+            return ContainerNode(None if a == NO_OPERAND else pool[a], children)
+        elif nodeType is NodeType.IF_STATEMENT:
+            return IfStatementNode(children)
+        elif nodeType is NodeType.SECTION_CODE:
+            return SectionCodeNode(pool[a], bool(b), children)
+        elif nodeType in {NodeType.SECTION_STRINGS, NodeType.SECTION_ROM}:
+            section: LocalizedSectionNode = SectionStringsNode(pool[a]) if \
+                nodeType is NodeType.SECTION_STRINGS else SectionROMNode(pool[a])
+            section.children.extend(children)
+            return section
+        elif nodeType is NodeType.STRING_ENTRY:
+            return StringEntryNode(pool[a], pool[b])
+        elif nodeType is NodeType.ROM_ENTRY:
+            return ROMEntryNode(pool[a], pool[b])
+        elif nodeType is NodeType.ELEM:
+            return ElemNode(pool[a])
+        elif nodeType is NodeType.RAW_VALUE:
+            return RawValueNode(pool[a], bool(b))
+        elif nodeType is NodeType.CALL:
+            return CallNode(pool[a])
+        elif nodeType is NodeType.RENDER:
+            return RenderNode()
+        elif nodeType is NodeType.ADD_EVENT_LISTENER:
+            return AddEventListenerNode(pool[a], pool[b])
+        elif nodeType is NodeType.STACK_PUSH:
+            return StackPushNode(pool[a])
+        elif nodeType is NodeType.STACK_COPY:
+            return StackCopyNode()
+        elif nodeType is NodeType.STACK_POP:
+            return StackPopNode()
+        elif nodeType is NodeType.STACK_SWAP:
+            return StackSwapNode(pool[a], pool[b])
+        elif nodeType is NodeType.COMPARE:
+            return CompareNode()
+        elif nodeType is NodeType.READ:
+            return ReadNode()
+        elif nodeType is NodeType.MATH_OP:
+            return MathOpNode(pool[a])
+        raise NotImplementedError(f"Cannot materialize node of type {nodeType.name}")
+
+    def getNodes(self, nodeIs: list[int]) -> list[ASTNode]:
+        return [self.getNode(nodeI) for nodeI in nodeIs]
+
+    def rootNodes(self) -> Iterator[ASTNode]:
+        for nodeI in self.roots:
+            yield self.getNode(nodeI)
+
+    def valueCode(self, poolIndex: int) -> str:
+        code: str | None = self.valueCodes.get(poolIndex)
+        if code is None:
+            code = self.valueCodes[poolIndex] = str(self.pool[poolIndex])
+        return code
+
+    def nbytes(self) -> int:
+        # The size of the columns, without the pool
+        return sum(column.itemsize * len(column) for column in (
+            self.types, self.operandsA, self.operandsB, self.childStarts, self.childEnds))
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def __repr__(self) -> str:
+        return (f"NodeStore(nodes={len(self)}, roots={len(self.roots)}, pool={len(self.pool)}, "
+                f"columns={self.nbytes()}B)")
+
+
+NO_OPERANDS: Final[tuple[int, int]] = (NO_OPERAND, NO_OPERAND)
+
+# NodeType --> A function returning the two operands of a node
+nodeEncoders: Final[dict[NodeType, Callable[[NodeStore, Any], tuple[int, int]]]] = {
+    NodeType.SECTION_STRINGS: lambda store, node: (store.intern(node.locale), NO_OPERAND),
+    NodeType.STRING_ENTRY: lambda store, node: (store.intern(node.key), store.intern(node.value)),
+    NodeType.SECTION_ROM: lambda store, node: (store.intern(node.locale), NO_OPERAND),
+    NodeType.ROM_ENTRY: lambda store, node: (store.intern(node.key), store.intern(node.value)),
+    NodeType.SECTION_CODE: lambda store, node: (store.intern(node.label), int(node.isRender)),
+    NodeType.CONTAINER: lambda store, node:
+    (NO_OPERAND if node.element is None else store.intern(node.element), NO_OPERAND),
+    NodeType.ELEM: lambda store, node: (store.intern(node.element), NO_OPERAND),
+    NodeType.RAW_VALUE: lambda store, node: (store.intern(node.value), int(node.injectRaw)),
+    NodeType.CALL: lambda store, node: (store.intern(node.label), NO_OPERAND),
+    NodeType.RENDER: lambda store, node: NO_OPERANDS,
+    NodeType.ADD_EVENT_LISTENER: lambda store, node:
+    (store.intern(node.event), store.intern(node.listener)),
+    NodeType.STACK_PUSH: lambda store, node: (store.intern(node.value), NO_OPERAND),
+    NodeType.STACK_COPY: lambda store, node: NO_OPERANDS,
+    NodeType.STACK_POP: lambda store, node: NO_OPERANDS,
+    # The offsets can be arbitrarily large
+    NodeType.STACK_SWAP: lambda store, node: (store.intern(node.offA), store.intern(node.offB)),
+    NodeType.COMPARE: lambda store, node: NO_OPERANDS,
+    NodeType.READ: lambda store, node: NO_OPERANDS,
+    NodeType.MATH_OP: lambda store, node: (store.intern(node.operation), NO_OPERAND),
+    NodeType.IF_STATEMENT: lambda store, node: NO_OPERANDS,
+}
@@ -0,0 +1,457 @@
+#  -*- coding: utf-8 -*-
+__author__ = "kubik.augustyn@post.cz"
+
+import logging
+from math import floor
+from typing import Any, Callable, Final, Iterator
+
+from kutil.language.AST import AST
+
+from esoml.nodes import *
+from esoml.nodestore import NodeStore
+from esoml.stats import CompileStats
+from esoml.tokens import ValueRef
+from esoml.types import EsoMLOptions, OptimizationLevel
+
+logger = logging.getLogger(__name__)
+
+# Number.MAX_SAFE_INTEGER, the runtime refuses to push anything out of the safe range
+MAX_SAFE_INTEGER: Final[int] = 2 ** 53 - 1
+
+
+def isSafeInteger(value: Any) -> bool:
+    return type(value) is int and -MAX_SAFE_INTEGER <= value <= MAX_SAFE_INTEGER
+
+
+# What is known about the constant tables of the program. Only what holds for every locale is
+# used, so the optimized code is the same for all of them (and can be shared across them).
+class ProgramConstants:
+    rom: dict[int, int]  # Key --> value of the ROM constants that are the same in every locale
+    romKeys: frozenset[int]  # The keys defined in every ROM section
+    stringKeys: frozenset[int]  # The keys defined in every strings section
+    safeROMKeys: frozenset[int]  # The keys with a safe integer value in every ROM section
+
+    def __init__(self, rom: dict[int, int] | None = None, romKeys: frozenset[int] = frozenset(),
+                 stringKeys: frozenset[int] = frozenset(),
+                 safeROMKeys: frozenset[int] = frozenset()) -> None:
+        self.rom = rom if rom is not None else {}
+        self.romKeys = romKeys
+        self.stringKeys = stringKeys
+        self.safeROMKeys = safeROMKeys
+
+    @staticmethod
+    def fromAST(ast: AST) -> "ProgramConstants":
+        romTables: list[dict[int, int]] = []
+        stringKeySets: list[frozenset[int]] = []
+        for root in ast.rootNodes():
+            if root.type is NodeType.SECTION_ROM:
+                romTables.append({entry.key: entry.value for entry in ast.getNodes(root.children)})
+            elif root.type is NodeType.SECTION_STRINGS:
+                stringKeySets.append(frozenset(entry.key for entry in
+                                               ast.getNodes(root.children)))
+        romKeys: frozenset[int] = frozenset.intersection(*map(frozenset, romTables)) \
+            if romTables else frozenset()
+        stringKeys: frozenset[int] = frozenset.intersection(*stringKeySets) \
+            if stringKeySets else frozenset()
+        rom: dict[int, int] = {}
+        for key in romKeys:
+            value: int = romTables[0][key]
+            if isSafeInteger(value) and all(table[key] == value for table in romTables):
+                rom[key] = value
+        # A key missing in some locale doesn't matter, getConstant() throws before pushing anything
+        unsafeKeys: set[int] = {key for table in romTables for key, value in table.items()
+                                if not isSafeInteger(value)}
+        safeROMKeys: frozenset[int] = frozenset(key for table in romTables for key in table
+                                                if key not in unsafeKeys)
+        return ProgramConstants(rom, romKeys, stringKeys, safeROMKeys)
+
+    def __repr__(self) -> str:
+        return (f"ProgramConstants(rom={len(self.rom)}, romKeys={len(self.romKeys)}, "
+                f"stringKeys={len(self.stringKeys)}, safeROMKeys={len(self.safeROMKeys)})")
+
+
+# The runtime's calc(), None if the result can't be folded: it would be out of the safe range,
+# NaN, an infinity or a negative zero, which the runtime would either refuse or handle differently
+def calculate(operation: MathOpNode.Operation, a: int, b: int) -> int | None:
+    if operation is MathOpNode.Operation.ADD:
+        result: int = a + b
+    elif operation is MathOpNode.Operation.SUB:
+        result: int = a - b
+    elif operation is MathOpNode.Operation.MUL:
+        if (a == 0 and b < 0) or (b == 0 and a < 0):
+            return None
+        result: int = a * b
+    elif operation is MathOpNode.Operation.DIV:
+        if b == 0 or (a == 0 and b < 0):
+            return None
+        # Both are exact doubles and the int division is correctly rounded, just like in JS
+        result: int = floor(a / b)
+    else:
+        raise NotImplementedError(f"Cannot fold the operation {operation}")
+    return result if isSafeInteger(result) else None
+
+
+# Rewrites the parsed program into a fresh AST (the parsed one is shared and never mutated).
+# Every block (the children of a section, container or if statement) is optimized with peephole
+# rules applied to the end of the already optimized part of the block, so a rewrite can enable
+# another one right away. The rules are grouped into passes, which count the removed instructions.
+class EsoMLOptimizer:
+    level: OptimizationLevel
+    constants: ProgramConstants
+    removed: dict[str, int]  # Pass --> the number of instructions (or entries) it removed
+    removedSections: list[str]  # The labels of the unreachable code sections
+
+    def __init__(self) -> None:
+        self.level = OptimizationLevel.O0
+        self.constants = ProgramConstants()
+        self.removed = {}
+        self.removedSections = []
+
+    def optimize(self, ast: AST, options: EsoMLOptions, stats: CompileStats | None = None,
+                 wholeProgram: bool = True) -> AST:
+        # Only the constants and the reachability of the whole program can be relied on, a part
+        # of a program (e.g. a single section) is only optimized on its own
+        self.level = options.getCompilerOptions().optimizationLevel
+        if self.level is OptimizationLevel.O0:
+            return ast
+        stats: CompileStats = stats if stats is not None else CompileStats()
+        with stats.measure("optimize"):
+            self.constants = ProgramConstants.fromAST(ast) if wholeProgram else \
+                ProgramConstants()
+            self.removed = {name: 0 for name, level in optimizationPasses.items()
+                            if level <= self.level}
+            self.removedSections = []
+            result: AST = self.optimizeAST(ast, wholeProgram)
+        for name, removed in self.removed.items():
+            stats.optimizations[name] = stats.optimizations.get(name, 0) + removed
+        stats.removedSections.extend(self.removedSections)
+        logger.info("Optimized with %s, removed per pass: %r", self.level.name,
+                    self.removed)
+        if self.removedSections:
+            logger.info("Removed the unreachable sections: %s", ", ".join(self.removedSections))
+        return result
+
+    def optimizeAST(self, ast: AST, wholeProgram: bool) -> AST:
+        result: AST = NodeStore() if isinstance(ast, NodeStore) else AST()
+        roots: list[ASTNode] = list(ast.rootNodes())
+        blocks: dict[int, list[ASTNode]] = {
+            i: self.optimizeBlock(ast, root) for i, root in enumerate(roots)
+            if root.type is NodeType.SECTION_CODE
+        }
+        references: SectionReferences | None = self.findReferences(roots, blocks) if \
+            wholeProgram else None
+
+        for i, root in enumerate(roots):
+            if root.type is NodeType.SECTION_CODE:
+                assert isinstance(root, SectionCodeNode)
+                if references is not None and root.label not in references.labels:
+                    self.remove("dead-sections", self.countNodes(blocks[i]))
+                    self.removedSections.append(root.label)
+                    continue
+                children: list[int] = self.addBlock(result, blocks[i])
+                section: ASTNode = SectionCodeNode(root.label, root.isRender, children)
+            elif root.type in {NodeType.SECTION_STRINGS, NodeType.SECTION_ROM}:
+                assert isinstance(root, LocalizedSectionNode)
+                isStrings: bool = root.type is NodeType.SECTION_STRINGS
+                section: LocalizedSectionNode = SectionStringsNode(root.locale) if isStrings \
+                    else SectionROMNode(root.locale)
+                entries: list[ASTNode] = ast.getNodes(root.children)
+                if references is not None:
+                    used: set[int] = references.strings if isStrings else references.rom
+                    entries = self.usedEntries(entries, used,
+                                               "unused-strings" if isStrings else "unused-rom")
+                section.children.extend(result.addNodes(entries))
+            else:
+                raise NotImplementedError(f"Cannot optimize section {root.type.name}")
+            result.addRootNode(result.addNode(section))
+        return result
+
+    def findReferences(self, roots: list[ASTNode],
+                       blocks: dict[int, list[ASTNode]]) -> "SectionReferences":
+        # Returns the labels of the sections reachable from main and init (the runtime runs only
+        # those on its own) through the calls and event listeners, and the constants they use
+        referencesByLabel: dict[str, list[SectionReferences]] = {}
+        for i, block in blocks.items():
+            referencesByLabel.setdefault(roots[i].label, []).append(
+                SectionReferences.fromBlock(block))
+        reachable: SectionReferences = SectionReferences()
+        pending: list[str] = [label for label in ("main", "init") if label in referencesByLabel]
+        reachable.labels.update(pending)
+        while pending:
+            for references in referencesByLabel[pending.pop()]:
+                for label in references.labels - reachable.labels:
+                    if label in referencesByLabel:
+                        reachable.labels.add(label)
+                        pending.append(label)
+                reachable.strings |= references.strings
+                reachable.rom |= references.rom
+        return reachable
+
+    def usedEntries(self, entries: list[ASTNode], used: set[int],
+                    passName: str) -> list[ASTNode]:
+        # Keeps the redefined keys, so that the compiler still reports them
+        counts: dict[int, int] = {}
+        for entry in entries:
+            counts[entry.key] = counts.get(entry.key, 0) + 1
+        kept: list[ASTNode] = [entry for entry in entries if entry.key in used or
+                               counts[entry.key] > 1]
+        self.remove(passName, len(entries) - len(kept))
+        return kept
+
+    def optimizeBlock(self, ast: AST, root: SectionCodeNode) -> list[ASTNode]:
+        # Returns the optimized children of the section. Until added to the new AST, the optimized
+        # parents hold the lists of their child nodes instead of the indices.
+        # Each level: (the parent, its children not optimized yet, the optimized ones)
+        stack: list[tuple[ASTNode, Iterator[ASTNode], list[ASTNode]]] = [
+            (root, iter(ast.getNodes(root.children)), [])
+        ]
+        while True:
+            node, children, block = stack[-1]
+            for child in children:
+                if child.type in {NodeType.CONTAINER, NodeType.IF_STATEMENT}:
+                    stack.append((child, iter(ast.getNodes(child.children)), []))
+                    break
+                self.append(block, child)
+            else:
+                stack.pop()
+                if not stack:
+                    return block
+                if node.type is NodeType.CONTAINER:
+                    assert isinstance(node, ContainerNode)
+                    self.append(stack[-1][2], ContainerNode(node.element, block))
+                else:
+                    self.append(stack[-1][2], IfStatementNode(block))
+
+    def append(self, block: list[ASTNode], node: ASTNode) -> None:
+        pending: list[ASTNode] = [node]  # Reversed, a rule can put nodes back to be appended
+        while pending:
+            block.append(self.foldValue(pending.pop()))
+            while self.reduce(block, pending):
+                pass
+
+    def foldValue(self, node: ASTNode) -> ASTNode:
+        # Replaces the references to the ROM constants, which are the same in every locale
+        if node.type not in {NodeType.STACK_PUSH, NodeType.RAW_VALUE}:
+            return node
+        value: ValueRef | LiteralValue = node.value
+        if not isinstance(value, ValueRef) or value.kind is not ValueRef.ValueRefKind.CONSTANT or \
+                value.key not in self.constants.rom:
+            return node
+        literal: LiteralValue = LiteralValue(self.constants.rom[value.key])
+        if node.type is NodeType.STACK_PUSH:
+            return StackPushNode(literal)
+        assert isinstance(node, RawValueNode)
+        return RawValueNode(literal, node.injectRaw)
+
+    def reduce(self, block: list[ASTNode], pending: list[ASTNode]) -> bool:
+        # Applies the first matching rule to the end of the block, returns whether any did
+        if not block:
+            return False
+        rule: Callable[[EsoMLOptimizer, list[ASTNode], list[ASTNode]], bool] | None = \
+            peepholeRules.get(block[-1].type)
+        return rule is not None and rule(self, block, pending)
+
+    def remove(self, passName: str, count: int) -> None:
+        self.removed[passName] += count
+
+    def isEnabled(self, passName: str) -> bool:
+        return optimizationPasses[passName] <= self.level
+
+    @staticmethod
+    def literalAt(block: list[ASTNode], index: int) -> int | None:
+        # The value pushed by a push of a literal at the index (from the end), None otherwise
+        if len(block) < -index:
+            return None
+        node: ASTNode = block[index]
+        if node.type is not NodeType.STACK_PUSH or not isinstance(node.value, LiteralValue):
+            return None
+        return node.value.value
+
+    def isSafePush(self, node: ASTNode) -> bool:
+        # Whether removing the push can't change anything, reading the value can't fail
+        if node.type is not NodeType.STACK_PUSH:
+            return False
+        value: ValueRef | LiteralValue = node.value
+        if isinstance(value, LiteralValue):
+            return True
+        if value.kind is ValueRef.ValueRefKind.CONSTANT:
+            # Defined in every locale, with a value the runtime accepts
+            return value.key in self.constants.romKeys and value.key in self.constants.safeROMKeys
+        if value.kind is ValueRef.ValueRefKind.STRING:
+            return value.key in self.constants.stringKeys
+        # The offset could be out of bounds
+        return self.isEnabled("stack-shuffle")
+
+    def reduceMathOp(self, block: list[ASTNode], _: list[ASTNode]) -> bool:
+        # push B; push A; mop --> push (A op B)
+        a, b = self.literalAt(block, -2), self.literalAt(block, -3)
+        if a is None or b is None:
+            return False
+        node: ASTNode = block[-1]
+        assert isinstance(node, MathOpNode)
+        result: int | None = calculate(node.operation, a, b)
+        if result is None:
+            return False
+        block[-3:] = [StackPushNode(LiteralValue(result))]
+        self.remove("constant-folding", 2)
+        return True
+
+    def reduceCompare(self, block: list[ASTNode], _: list[ASTNode]) -> bool:
+        # push B; push A; comp --> push (A === B)
+        a, b = self.literalAt(block, -2), self.literalAt(block, -3)
+        if a is None or b is None:
+            return False
+        block[-3:] = [StackPushNode(LiteralValue(int(a == b)))]
+        self.remove("constant-folding", 2)
+        return True
+
+    def reduceSwap(self, block: list[ASTNode], _: list[ASTNode]) -> bool:
+        node: ASTNode = block[-1]
+        assert isinstance(node, StackSwapNode)
+        offsets: tuple[int, int] = (node.offA, node.offB)
+        if offsets in {(0, 1), (1, 0)} and self.literalAt(block, -2) is not None and \
+                self.literalAt(block, -3) is not None:
+            # push A; push B; swap --> push B; push A
+            block[-3:] = [block[-2], block[-3]]
+            self.remove("constant-folding", 1)
+            return True
+        if not self.isEnabled("stack-shuffle"):
+            return False
+        if node.offA == node.offB:
+            # Swapping a value with itself only checks the offset
+            del block[-1]
+            self.remove("stack-shuffle", 1)
+            return True
+        previous: ASTNode | None = block[-2] if len(block) > 1 else None
+        if previous is not None and previous.type is NodeType.STACK_SWAP:
+            assert isinstance(previous, StackSwapNode)
+            if {previous.offA, previous.offB} == {node.offA, node.offB}:
+                # The second swap undoes the first one
+                del block[-2:]
+                self.remove("stack-shuffle", 2)
+                return True
+        return False
+
+    def reducePop(self, block: list[ASTNode], _: list[ASTNode]) -> bool:
+        if len(block) < 2:
+            return False
+        previous: ASTNode = block[-2]
+        if self.isSafePush(previous):
+            # push X; pops --> nothing
+            del block[-2:]
+            self.remove("dead-push", 2)
+            return True
+        if previous.type is NodeType.STACK_COPY and self.isEnabled("stack-shuffle"):
+            # copy; pops --> nothing
+            del block[-2:]
+            self.remove("stack-shuffle", 2)
+            return True
+        return False
+
+    def reduceIfStatement(self, block: list[ASTNode], pending: list[ASTNode]) -> bool:
+        # push L; ifis ... endi --> the contents if L === 1, otherwise nothing
+        condition: int | None = self.literalAt(block, -2)
+        if condition is None:
+            return False
+        node: ASTNode = block[-1]
+        assert isinstance(node, IfStatementNode)
+        del block[-2:]
+        if condition == 1:
+            # Running the contents in the if statement or without it makes no difference
+            pending.extend(reversed(node.children))
+            self.remove("constant-if", 2)
+        else:
+            self.remove("constant-if", 2 + self.countNodes(node.children))
+        return True
+
+    @staticmethod
+    def countNodes(block: list[ASTNode]) -> int:
+        count: int = 0
+        stack: list[ASTNode] = list(block)
+        while stack:
+            node: ASTNode = stack.pop()
+            count += 1
+            if node.type in {NodeType.CONTAINER, NodeType.IF_STATEMENT}:
+                stack.extend(node.children)
+        return count
+
+    @staticmethod
+    def addBlock(result: AST, block: list[ASTNode]) -> list[int]:
+        # Adds the optimized nodes to the AST in post-order and replaces the lists of the child
+        # nodes with their indices, so that the children of every node are right after each other
+        # Each level: (the parent, its children not added yet, the children ready to be added)
+        stack: list[tuple[ASTNode | None, Iterator[ASTNode], list[ASTNode]]] = [
+            (None, iter(block), [])
+        ]
+        while True:
+            parent, children, ready = stack[-1]
+            for child in children:
+                if child.type in {NodeType.CONTAINER, NodeType.IF_STATEMENT}:
+                    stack.append((child, iter(child.children), []))
+                    break
+                ready.append(child)
+            else:
+                stack.pop()
+                indices: list[int] = result.addNodes(ready)
+                if parent is None:
+                    return indices
+                parent.children[:] = indices
+                stack[-1][2].append(parent)
+
+
+# The labels of the sections a code section calls or listens with, and the constants it uses
+class SectionReferences:
+    labels: set[str]
+    strings: set[int]
+    rom: set[int]
+
+    def __init__(self) -> None:
+        self.labels = set()
+        self.strings = set()
+        self.rom = set()
+
+    @staticmethod
+    def fromBlock(block: list[ASTNode]) -> "SectionReferences":
+        references: SectionReferences = SectionReferences()
+        stack: list[ASTNode] = list(block)
+        while stack:
+            node: ASTNode = stack.pop()
+            if node.type in {NodeType.CONTAINER, NodeType.IF_STATEMENT}:
+                stack.extend(node.children)
+            elif node.type is NodeType.CALL:
+                references.labels.add(node.label)
+            elif node.type is NodeType.ADD_EVENT_LISTENER:
+                references.labels.add(node.listener)
+            elif node.type in {NodeType.STACK_PUSH, NodeType.RAW_VALUE} and \
+                    isinstance(node.value, ValueRef):
+                if node.value.kind is ValueRef.ValueRefKind.STRING:
+                    references.strings.add(node.value.key)
+                elif node.value.kind is ValueRef.ValueRefKind.CONSTANT:
+                    references.rom.add(node.value.key)
+        return references
+
+    def __repr__(self) -> str:
+        return (f"SectionReferences(labels={len(self.labels)}, strings={len(self.strings)}, "
+                f"rom={len(self.rom)})")
+
+
+# The optimization passes --> the lowest level enabling them
+optimizationPasses: Final[dict[str, OptimizationLevel]] = {
+    "constant-folding": OptimizationLevel.O1,  # ROM constants, arithmetic, comparisons, swaps
+    "dead-push": OptimizationLevel.O1,  # A push of a value that is popped right away
+    "constant-if": OptimizationLevel.O1,  # An if statement on a known condition
+    "stack-shuffle": OptimizationLevel.O2,  # Swaps and copies cancelling each other out
+    "dead-sections": OptimizationLevel.O1,  # Code sections never called nor listened with
+    "unused-strings": OptimizationLevel.O1,  # Entries, not instructions
+    "unused-rom": OptimizationLevel.O1,
+}
+
+# The type of the last node of a block --> the rule trying to simplify the end of the block
+peepholeRules: Final[dict[NodeType, Callable[[EsoMLOptimizer, list[ASTNode], list[ASTNode]],
+                                              bool]]] = {
+    NodeType.MATH_OP: EsoMLOptimizer.reduceMathOp,
+    NodeType.COMPARE: EsoMLOptimizer.reduceCompare,
+    NodeType.STACK_SWAP: EsoMLOptimizer.reduceSwap,
+    NodeType.STACK_POP: EsoMLOptimizer.reducePop,
+    NodeType.IF_STATEMENT: EsoMLOptimizer.reduceIfStatement,
+}
@@ -1,6 +1,7 @@
 #  -*- coding: utf-8 -*-
 __author__ = "kubik.augustyn@post.cz"
 
+import logging
 from typing import Iterator
 from kutil.language import Parser, Options
 from kutil.language.Token import TokenOutput, Token
@@ -8,11 +9,20 @@ from kutil.language.AST import AST, ASTNode
 
 from esoml.tokens import *
 from esoml.nodes import *
+from esoml.nodestore import NodeStore
+
+logger = logging.getLogger(__name__)
 
 
 class EsoMLParser(Parser):
+    useNodeStore: bool  # Whether to fill a (compact) NodeStore instead of an AST
+
+    def __init__(self, useNodeStore: bool = False) -> None:
+        super().__init__()
+        self.useNodeStore = useNodeStore
+
     def parseInner(self, tokens: TokenOutput, options: Options) -> AST:
-        ast: AST = AST()
+        ast: AST = NodeStore() if self.useNodeStore else AST()
 
         while True:
             token = tokens.nextTokenDef(default=None)
@@ -60,8 +70,8 @@ class EsoMLParser(Parser):
         if section.kind is SectionKind.STRINGS:
             return self.parseStringsSection(ast, tokens, section)
         elif section.kind in {SectionKind.CODE, SectionKind.RENDER}:
-            print(f"Section {ascii(section.argument)}: "
-                  f"{'call' if section.kind is SectionKind.CODE else 'render'} only")
+            logger.debug("Section %s: %s only", ascii(section.argument),
+                         'call' if section.kind is SectionKind.CODE else 'render')
             return self.parseCodeSection(ast, tokens, section)
         elif section.kind is SectionKind.ROM:
             return self.parseROMSection(ast, tokens, section)
@@ -73,7 +83,7 @@ class EsoMLParser(Parser):
                             section: Section) -> SectionStringsNode:
         root = SectionStringsNode(section.argument)
 
-        print(f"Strings for the locale {section.argument}:")
+        logger.debug("Strings for the locale %s:", section.argument)
         for token in tokens:
             if token.kind is TokenKind.SECTION_END:
                 continue
@@ -85,7 +95,7 @@ class EsoMLParser(Parser):
                 StringEntryNode(token.key, token.string)
             ))
 
-            print(f"    {token.key} --> {ascii(token.string)}")
+            logger.debug("    %s --> %s", token.key, ascii(token.string))
 
         return root
 
@@ -93,7 +103,7 @@ class EsoMLParser(Parser):
     def parseROMSection(self, ast: AST, tokens: TokenOutput, section: Section) -> SectionROMNode:
         root = SectionROMNode(section.argument)
 
-        print(f"ROM for the locale {section.argument}:")
+        logger.debug("ROM for the locale %s:", section.argument)
         for token in tokens:
             if token.kind is TokenKind.SECTION_END:
                 continue
@@ -105,7 +115,7 @@ class EsoMLParser(Parser):
                 ROMEntryNode(token.key, token.number)
             ))
 
-            print(f"    {token.key} --> {token.number}")
+            logger.debug("    %s --> %s", token.key, token.number)
 
         return root
 
@@ -117,24 +127,24 @@ class EsoMLParser(Parser):
                                container.children)
         return root
 
-    def parseIfStatement(self, ast: AST, tokens: TokenOutput, section: Section) -> IfStatementNode:
-        container = self.parseContainerContents(ast, tokens, section, "if")
-
-        ifStatement = IfStatementNode(container.children)
-        return ifStatement
-
     def parseContainerContents(self, ast: AST, tokens: TokenOutput,
                                section: Section, element: str) -> ContainerNode:
-        children: list[ASTNode] = []
+        # Nested containers and if statements are parsed with an explicit stack instead of
+        # recursion, so the nesting depth is only limited by the memory
+        # Each level: (element, whether it's an if statement, children)
+        stack: list[tuple[str | None, bool, list[ASTNode]]] = [(element, False, [])]
 
         for token in tokens:
+            children: list[ASTNode] = stack[-1][2]
             if section.kind is not SectionKind.RENDER:
                 if token.kind in rendererOnlyTokens:
                     raise ValueError(f"Prohibited use of a render-section-only "
                                      f"token {token.kind.name}")
 
             if token.kind in {TokenKind.END_CONTAINER, TokenKind.SECTION_END, TokenKind.END_IF}:
-                break
+                container: ContainerNode = self.closeContainer(ast, stack)
+                if not stack:
+                    return container
             elif token.kind is TokenKind.START_CONTAINER:
                 assert isinstance(token, StartContainerToken)
 
@@ -150,14 +160,13 @@ class EsoMLParser(Parser):
                 # out: TokenOutput = TokenOutput()
                 # iterator = self.iterUntilToken(tokens, TokenKind.END_CONTAINER, False, False)
                 # out.setIterator(iterator)
-                out = tokens
 
                 if token.element in {"root", "if"}:
                     raise ValueError("Cannot use neither the root nor if element LOL")
-                children.append(self.parseContainerContents(ast, out, section, token.element))
+                stack.append((token.element, False, []))
             elif token.kind is TokenKind.START_IF:
                 assert isinstance(token, StartIfToken)
-                children.append(self.parseIfStatement(ast, tokens, section))
+                stack.append(("if", True, []))
             elif token.kind is TokenKind.ELEM:
                 assert isinstance(token, ElemToken)
                 children.append(ElemNode(token.element))
@@ -204,4 +213,18 @@ class EsoMLParser(Parser):
             else:
                 raise ValueError(f"Unexpected token: {token.kind.name}")
 
-        return ContainerNode(element, ast.addNodes(children))
+        # The tokens ended, which closes all the levels
+        while True:
+            container: ContainerNode = self.closeContainer(ast, stack)
+            if not stack:
+                return container
+
+    @staticmethod
+    def closeContainer(ast: AST, stack: list[tuple[str | None, bool, list[ASTNode]]]) -> \
+            ContainerNode:
+        # Pops the innermost level and adds it to the children of the enclosing one
+        element, isIfStatement, children = stack.pop()
+        container: ContainerNode = ContainerNode(element, ast.addNodes(children))
+        if stack:
+            stack[-1][2].append(IfStatementNode(container.children) if isIfStatement else container)
+        return container
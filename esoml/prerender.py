@@ -0,0 +1,363 @@
+#  -*- coding: utf-8 -*-
+__author__ = "kubik.augustyn@post.cz"
+
+import logging
+import math
+import re
+from enum import Enum, unique, auto
+from html import escape
+from typing import Final, Iterator, Callable
+
+from kutil.language.AST import AST
+
+from esoml.nodes import *
+from esoml.optimizer import isSafeInteger
+from esoml.program import ParsedProgram
+from esoml.tokens import ValueRef
+
+logger = logging.getLogger(__name__)
+
+MAX_CALL_DEPTH: Final[int] = 1000  # Deeper calls are left to the browser (and its stack limit)
+MAX_STEPS: Final[int] = 1_000_000  # The instructions run at most, so a request can't take forever
+
+
+# The program can't be prerendered, it either fails or does something only the browser can do.
+# The page is then rendered by the runtime alone, just like without prerendering.
+class PrerenderError(Exception):
+    pass
+
+
+@unique
+class CodeType(Enum):
+    # The same as the runtime's
+    MUST_BE_RENDERABLE = auto()
+    MUST_BE_CALLABLE = auto()
+    CAN_BE_ANY = auto()
+
+
+class PrerenderedElement:
+    __slots__ = ("tag", "children")
+
+    tag: str
+    children: list["PrerenderedElement | str"]  # The elements and the HTML of the raw values
+
+    def __init__(self, tag: str) -> None:
+        self.tag = tag
+        self.children = []
+
+
+# Runs init and the first render of main just like the runtime does when the page loads, and
+# returns the HTML the render produces, so it can be served in the root element right away. The
+# runtime then renders it again into a detached element and only adds the event listeners to the
+# served elements if they are the same, otherwise it replaces them. Only what is surely the same as
+# in the browser is prerendered, anything else (read, failing programs, strings used as numbers,
+# markup the HTML parser would change...) raises a PrerenderError.
+class Prerenderer:
+    ast: AST
+    strings: dict[int, str]
+    rom: dict[int, int]
+    sections: dict[str, SectionCodeNode]  # Label --> the last section with it, like in the runtime
+    valueStack: list[str | int]
+    renderingStack: list[PrerenderedElement]
+    currentSection: SectionCodeNode | None  # None for the root, which is renderable
+    currentType: CodeType
+    steps: int
+
+    def __init__(self, program: ParsedProgram, locale: str) -> None:
+        self.ast = program.ast
+        self.strings = {}
+        self.rom = {}
+        self.sections = {}
+        self.valueStack = []
+        self.renderingStack = []
+        self.currentSection = None
+        self.currentType = CodeType.CAN_BE_ANY
+        self.steps = 0
+
+        for root in self.ast.rootNodes():
+            if root.type is NodeType.SECTION_CODE:
+                assert isinstance(root, SectionCodeNode)
+                self.sections[root.label] = root
+            elif isinstance(root, LocalizedSectionNode) and root.locale == locale:
+                target: dict = self.strings if root.type is NodeType.SECTION_STRINGS else self.rom
+                for entry in self.ast.getNodes(root.children):
+                    assert isinstance(entry, LocalizedSectionEntryNode)
+                    target[entry.key] = entry.value
+
+    def prerender(self) -> str:
+        root: PrerenderedElement = PrerenderedElement("div")
+        self.renderingStack.append(root)
+        if "init" in self.sections:
+            self.run("init", CodeType.MUST_BE_CALLABLE)
+        self.run("main", CodeType.MUST_BE_RENDERABLE)
+        return serialize(root)
+
+    def run(self, label: str, codeType: CodeType) -> None:
+        # Each level: (its children not run yet, the code run when it's left)
+        stack: list[tuple[Iterator[int], Callable[[], None] | None]] = []
+        self.enterSection(label, codeType, stack)
+        while stack:
+            children, leave = stack[-1]
+            for nodeI in children:
+                self.steps += 1
+                if self.steps > MAX_STEPS:
+                    raise PrerenderError("The render is too long")
+                node: ASTNode = self.ast.getNode(nodeI)
+                if node.type is NodeType.CONTAINER:
+                    assert isinstance(node, ContainerNode)
+                    self.enterContainer(node.children, node.element, stack)
+                    break
+                if node.type is NodeType.IF_STATEMENT:
+                    assert isinstance(node, IfStatementNode)
+                    if self.pop() == 1:
+                        self.renderingStack.append(self.renderingStack[-1])
+                        stack.append((iter(node.children), self.renderingStack.pop))
+                        break
+                    continue
+                if node.type is NodeType.CALL:
+                    assert isinstance(node, CallNode)
+                    if len(stack) > MAX_CALL_DEPTH:
+                        raise PrerenderError("The calls are nested too deep")
+                    self.enterSection(node.label, CodeType.CAN_BE_ANY, stack)
+                    break
+                self.runLeafNode(node)
+            else:
+                stack.pop()
+                if leave is not None:
+                    leave()
+
+    def enterSection(self, label: str, codeType: CodeType,
+                     stack: list[tuple[Iterator[int], Callable[[], None] | None]]) -> None:
+        # The runtime's call
+        if label not in self.sections:
+            raise PrerenderError(f"Cannot call an undefined section {label!r}")
+        section: SectionCodeNode = self.sections[label]
+        if (codeType is CodeType.MUST_BE_RENDERABLE and not section.isRender) or \
+                (codeType is CodeType.MUST_BE_CALLABLE and section.isRender):
+            raise PrerenderError(f"Cannot call the section {label!r} from here")
+        oldSection, oldType = self.currentSection, self.currentType
+
+        def leave() -> None:
+            self.currentSection, self.currentType = oldSection, oldType
+
+        self.currentSection, self.currentType = section, codeType
+        stack.append((iter(()), leave))
+        self.enterContainer(section.children, "root", stack)
+
+    def enterContainer(self, children: list[int], tag: str | None,
+                       stack: list[tuple[Iterator[int], Callable[[], None] | None]]) -> None:
+        renderable: bool = self.currentSection is None or self.currentSection.isRender
+        if not renderable or self.currentType is CodeType.MUST_BE_CALLABLE:
+            stack.append((iter(children), None))
+            return
+        element: PrerenderedElement = self.createElement(tag or "div")
+
+        def leave() -> None:
+            self.renderingStack.pop()
+            parent: PrerenderedElement = self.renderingStack[-1]
+            if tag != "root":
+                parent.children.append(element)
+            else:
+                # Only the elements are moved, there are no text nodes among the children anyway
+                parent.children.extend(element.children)
+
+        self.renderingStack.append(element)
+        stack.append((iter(children), leave))
+
+    def runLeafNode(self, node: ASTNode) -> None:
+        if node.type is NodeType.ELEM:
+            assert isinstance(node, ElemNode)
+            self.renderingStack[-1].children.append(self.createElement(node.element))
+        elif node.type is NodeType.RAW_VALUE:
+            assert isinstance(node, RawValueNode)
+            content: str = toJSString(self.getValue(node.value))
+            self.renderingStack[-1].children.append(
+                rawHTML(content) if node.injectRaw else textHTML(content))
+        elif node.type is NodeType.RENDER:
+            pass  # The first render never trips the runtime's render loop limit
+        elif node.type is NodeType.ADD_EVENT_LISTENER:
+            pass  # Added by the runtime when it hydrates the prerendered elements
+        elif node.type is NodeType.STACK_PUSH:
+            assert isinstance(node, StackPushNode)
+            self.push(self.getValue(node.value))
+        elif node.type is NodeType.STACK_COPY:
+            self.checkOffset(0)
+            self.valueStack.append(self.valueStack[-1])
+        elif node.type is NodeType.STACK_POP:
+            self.pop()
+        elif node.type is NodeType.STACK_SWAP:
+            assert isinstance(node, StackSwapNode)
+            self.checkOffset(node.offA)
+            self.checkOffset(node.offB)
+            stack: list[str | int] = self.valueStack
+            stack[-1 - node.offA], stack[-1 - node.offB] = \
+                stack[-1 - node.offB], stack[-1 - node.offA]
+        elif node.type is NodeType.COMPARE:
+            a, b = self.pop(), self.pop()
+            self.push(int(type(a) is type(b) and a == b))
+        elif node.type is NodeType.MATH_OP:
+            assert isinstance(node, MathOpNode)
+            a, b = self.pop(), self.pop()
+            self.push(calculate(node.operation, a, b))
+        elif node.type is NodeType.READ:
+            raise PrerenderError("Cannot read the contents of an element on the server")
+        else:
+            raise NotImplementedError(f"Cannot prerender node of type {node.type.name}")
+
+    def getValue(self, value: ValueRef | LiteralValue) -> str | int:
+        if isinstance(value, LiteralValue):
+            return value.value
+        if value.kind is ValueRef.ValueRefKind.STRING:
+            if value.key not in self.strings:
+                raise PrerenderError(f"String {value.key} not found")
+            return self.strings[value.key]
+        if value.kind is ValueRef.ValueRefKind.CONSTANT:
+            if value.key not in self.rom:
+                raise PrerenderError(f"ROM constant {value.key} not found")
+            return self.rom[value.key]
+        self.checkOffset(value.key)
+        return self.valueStack[-1 - value.key]
+
+    def checkOffset(self, offset: int) -> None:
+        if offset < 0 or len(self.valueStack) <= offset:
+            raise PrerenderError(f"Stack offset {offset} out of bounds")
+
+    def push(self, value: str | int) -> None:
+        if not isinstance(value, str) and not isSafeInteger(value):
+            raise PrerenderError(f"Cannot have a value on the stack that is out of bounds: {value}")
+        self.valueStack.append(value)
+
+    def pop(self) -> str | int:
+        if not self.valueStack:
+            raise PrerenderError("Cannot pop a value off the stack, because it's empty")
+        return self.valueStack.pop()
+
+    @staticmethod
+    def createElement(tag: str) -> PrerenderedElement:
+        tag = tag.lower()
+        if not TAG_PATTERN.fullmatch(tag) or tag in unsupportedElements:
+            raise PrerenderError(f"Cannot prerender the element {tag!r}")
+        return PrerenderedElement(tag)
+
+
+def calculate(operation: MathOpNode.Operation, a: str | int, b: str | int) -> str | int:
+    # The runtime's calculate, a result it refuses fails the render too
+    if operation is MathOpNode.Operation.ADD and (isinstance(a, str) or isinstance(b, str)):
+        return toJSString(a) + toJSString(b)
+    if isinstance(a, str) or isinstance(b, str):
+        raise PrerenderError("Cannot prerender strings used as numbers")
+    if operation is MathOpNode.Operation.ADD:
+        return a + b
+    if operation is MathOpNode.Operation.SUB:
+        return a - b
+    if operation is MathOpNode.Operation.MUL:
+        return a * b
+    if b == 0:
+        raise PrerenderError("Division by zero")
+    # Both are exact as doubles and the division is rounded the same way, so is the result
+    return math.floor(a / b)
+
+
+def toJSString(value: str | int) -> str:
+    if isinstance(value, str):
+        return value
+    if not isSafeInteger(value):
+        raise PrerenderError(f"Cannot prerender the number {value}")
+    return str(value)
+
+
+def textHTML(content: str) -> str:
+    # A span with its innerText set, which turns the line breaks into <br> elements
+    if "\0" in content:
+        raise PrerenderError("Cannot prerender a NUL character")
+    return "<span>" + LINE_BREAK_PATTERN.sub("<br>", escape(content, quote=False)) + "</span>"
+
+
+def rawHTML(content: str) -> str:
+    # A span with its innerHTML set, only its first child is kept, if it's an element. Only the
+    # balanced markup is let through, if the HTML parser still builds something else from it (e.g.
+    # a div in a p), the runtime finds out when hydrating and replaces the prerendered elements.
+    if content == "" or content.startswith(("<!", "</", "<?")):
+        raise PrerenderError("Cannot prerender raw HTML not starting with an element or a text")
+    if not START_TAG_PATTERN.match(content):
+        return textHTML(content)
+    openTags: list[str] = []
+    position: int = 0
+    while True:
+        match: re.Match | None = TAG_PATTERN_IN_HTML.match(content, position)
+        if match is None:
+            raise PrerenderError("Cannot prerender raw HTML the HTML parser would change")
+        isEnd, tag, isSelfClosing = match.group(1) == "/", match.group(2).lower(), match.group(4)
+        position = match.end()
+        if tag in unsupportedElements:
+            raise PrerenderError(f"Cannot prerender the raw HTML element {tag!r}")
+        if isEnd:
+            closed: str | None = openTags.pop() if openTags else None
+            # Any heading end tag closes the open heading too
+            if closed != tag and not (closed in headingElements and tag in headingElements):
+                raise PrerenderError("Cannot prerender raw HTML with mismatched tags")
+        elif tag not in voidElements:
+            if isSelfClosing:
+                raise PrerenderError("Cannot prerender raw HTML with self-closing elements")
+            openTags.append(tag)
+        if not openTags:
+            return content[:position]
+        # The text up to the next tag
+        nextTag: int = content.find("<", position)
+        if nextTag == -1:
+            raise PrerenderError("Cannot prerender raw HTML with unclosed elements")
+        position = nextTag
+
+
+def serialize(root: PrerenderedElement) -> str:
+    parts: list[str] = []
+    stack: list[tuple[PrerenderedElement, Iterator[PrerenderedElement | str]]] = \
+        [(root, iter(root.children))]
+    while stack:
+        element, children = stack[-1]
+        for child in children:
+            if isinstance(child, str):
+                parts.append(child)
+                continue
+            if child.tag in voidElements:
+                if child.children:
+                    raise PrerenderError(f"Cannot prerender the element {child.tag!r} with "
+                                         f"children")
+                parts.append(f"<{child.tag}>")
+                continue
+            parts.append(f"<{child.tag}>")
+            stack.append((child, iter(child.children)))
+            break
+        else:
+            stack.pop()
+            if stack:
+                parts.append(f"</{element.tag}>")
+    return "".join(parts)
+
+
+def prerenderMain(program: ParsedProgram, locale: str) -> str | None:
+    # The HTML of the first render of the page, None if it can't be prerendered
+    try:
+        return Prerenderer(program, locale).prerender()
+    except PrerenderError as e:
+        logger.info("Not prerendering the page: %s", e)
+        return None
+
+
+TAG_PATTERN: Final[re.Pattern[str]] = re.compile(r"[a-z][a-z0-9-]*")
+START_TAG_PATTERN: Final[re.Pattern[str]] = re.compile(r"<[a-zA-Z]")
+# A start or end tag, with the attributes quoted or not
+TAG_PATTERN_IN_HTML: Final[re.Pattern[str]] = re.compile(
+    r"<(/?)([a-zA-Z][a-zA-Z0-9-]*)((?:\s+[^\s\"'/<>=]+(?:\s*=\s*(?:\"[^\"]*\"|'[^']*'|"
+    r"[^\s\"'=<>`]+))?)*)\s*(/?)>")
+LINE_BREAK_PATTERN: Final[re.Pattern[str]] = re.compile(r"\r\n|\r|\n")
+voidElements: Final[frozenset[str]] = frozenset({
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track",
+    "wbr"
+})
+# Parsed differently from how they are created: raw text, other namespaces, templates...
+unsupportedElements: Final[frozenset[str]] = frozenset({
+    "script", "style", "textarea", "title", "xmp", "iframe", "noembed", "noframes", "noscript",
+    "plaintext", "template", "svg", "math", "html", "head", "body", "frameset", "frame"
+})
+headingElements: Final[frozenset[str]] = frozenset({"h1", "h2", "h3", "h4", "h5", "h6"})
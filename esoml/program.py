@@ -0,0 +1,42 @@
+#  -*- coding: utf-8 -*-
+__author__ = "kubik.augustyn@post.cz"
+
+from typing import Any, NoReturn
+
+from kutil.language.AST import AST
+
+from esoml.compiler import EsoMLCompiler
+from esoml.stats import CompileStats
+from esoml.tokens import Section
+
+
+# The lexed and parsed source, independent of the locale and any other compiler options,
+# so it can be compiled any number of times. Nothing is allowed to mutate it (nor its AST).
+class ParsedProgram:
+    __slots__ = ("ast", "sections", "locales", "unsafeMode", "sourceHash", "stats")
+
+    ast: AST
+    sections: tuple[Section, ...]
+    locales: tuple[str, ...]
+    unsafeMode: bool  # Whether the source contains the unsafe_mode section
+    sourceHash: str
+    stats: CompileStats  # Of the lex and parse phases, copied into every compiled file
+
+    def __init__(self, ast: AST, sections: tuple[Section, ...], unsafeMode: bool,
+                 sourceHash: str, stats: CompileStats) -> None:
+        object.__setattr__(self, "ast", ast)
+        object.__setattr__(self, "sections", sections)
+        object.__setattr__(self, "locales", tuple(EsoMLCompiler.findLocales(ast)))
+        object.__setattr__(self, "unsafeMode", unsafeMode)
+        object.__setattr__(self, "sourceHash", sourceHash)
+        object.__setattr__(self, "stats", stats)
+
+    def __setattr__(self, key: str, value: Any) -> NoReturn:
+        raise AttributeError(f"Cannot set {key}, a parsed program is immutable")
+
+    def __delattr__(self, key: str) -> NoReturn:
+        raise AttributeError(f"Cannot delete {key}, a parsed program is immutable")
+
+    def __repr__(self) -> str:
+        return (f"ParsedProgram(sections={len(self.sections)}, locales={self.locales}, "
+                f"unsafeMode={self.unsafeMode}, sourceHash={self.sourceHash[:12]})")
@@ -0,0 +1,161 @@
+#  -*- coding: utf-8 -*-
+__author__ = "kubik.augustyn@post.cz"
+
+import re
+from functools import lru_cache
+from os import stat
+from os.path import dirname, abspath, join
+from typing import Final
+
+from kutil import readFile
+
+RUNTIME_PATH: Final[str] = join(dirname(abspath(__file__)), "lib.js")
+COMPILED_CODE_MARKER: Final[str] = "// EsoML COMPILED CODE"
+
+IDENTIFIER_CHARS: Final[frozenset[str]] = frozenset(
+    "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_$")
+# A newline after these can never end a statement
+JOINING_CHARS: Final[frozenset[str]] = frozenset("{;,([")
+
+# A line of lib.js only in the debug build, "//#debug" at its end
+DEBUG_LINE_PATTERN: Final[re.Pattern[str]] = re.compile(r"[ \t]*//#debug[ \t]*$")
+# A line only in the production build, commented out by "//#production " at its start, so that
+# lib.js as written is the debug build and stays valid JS
+PRODUCTION_LINE_PATTERN: Final[re.Pattern[str]] = re.compile(r"([ \t]*)//#production (.*)")
+# "//#if debug" or "//#if production" ... "//#endif" on their own lines for whole blocks
+BUILD_BLOCK_PATTERN: Final[re.Pattern[str]] = re.compile(
+    r"\s*//#(?:if (debug|production)|(endif))\s*")
+
+
+def loadRuntime(minified: bool = False, production: bool = False) -> tuple[str, str]:
+    # Returns the runtime split into the part before and after the compiled code
+    # The modification time is a part of the cache key, so that edits of lib.js are picked up
+    return _loadRuntime(minified, production, stat(RUNTIME_PATH).st_mtime_ns)
+
+
+@lru_cache(maxsize=8)
+def _loadRuntime(minified: bool, production: bool, _mtime: int) -> tuple[str, str]:
+    lib: str = selectBuild(readFile(RUNTIME_PATH, "text"), production)
+    if COMPILED_CODE_MARKER not in lib:
+        raise ValueError(f"The runtime is missing the {COMPILED_CODE_MARKER!r} marker")
+    before, after = lib.split(COMPILED_CODE_MARKER, maxsplit=1)
+    if minified:
+        return minifyJS(before), minifyJS(after)
+    return before, after
+
+
+def selectBuild(code: str, production: bool) -> str:
+    # Keeps only the lines of the debug or the production runtime and drops the markers, the debug
+    # build is the runtime as written. The production one makes no log calls and keeps no CallIDs,
+    # its functions take no ID as the compiled code doesn't pass any.
+    build: str = "production" if production else "debug"
+    result: list[str] = []
+    blockBuild: str | None = None  # The build of the block being read
+    for line in code.splitlines(keepends=True):
+        blockMatch: re.Match[str] | None = BUILD_BLOCK_PATTERN.fullmatch(line)
+        if blockMatch is not None:
+            if blockMatch.group(2) is None and blockBuild is not None:
+                raise ValueError(f"Nested runtime blocks are not supported: {line.strip()!r}")
+            if blockMatch.group(2) is not None and blockBuild is None:
+                raise ValueError("A runtime block ended without starting")
+            blockBuild = blockMatch.group(1)
+            continue
+        if blockBuild is not None and blockBuild != build:
+            continue
+        content: str = line.rstrip("\r\n")
+        productionMatch: re.Match[str] | None = PRODUCTION_LINE_PATTERN.fullmatch(content)
+        if productionMatch is not None:
+            if production:
+                result.append(productionMatch.group(1) + productionMatch.group(2) +
+                              line[len(content):])
+            continue
+        debugMatch: re.Match[str] | None = DEBUG_LINE_PATTERN.search(content)
+        if debugMatch is None:
+            result.append(line)
+        elif not production:
+            result.append(content[:debugMatch.start()] + line[len(content):])
+    if blockBuild is not None:
+        raise ValueError(f"The runtime block of the {blockBuild} build is not ended")
+    return "".join(result)
+
+
+def minifyJS(code: str) -> str:
+    # Strips comments and whitespace that isn't needed. Newlines are kept (unless it's certain
+    # they can't end a statement), because the runtime relies on the automatic semicolon insertion.
+    # Only supports what the runtime uses, notably there must be no regular expression literals.
+    result: list[str] = []
+    # The closing quote of each string that is being read, "}" for the code inside a template
+    # literal's ${...} and "{" for a block inside such code
+    nesting: list[str] = []
+    pendingSpace: bool = False
+    pendingNewline: bool = False
+    i: int = 0
+
+    def lastChar() -> str:
+        return result[-1][-1] if result else "\n"
+
+    def emit(chunk: str) -> None:
+        nonlocal pendingSpace, pendingNewline
+        if pendingNewline and lastChar() not in JOINING_CHARS and lastChar() != "\n" and \
+                chunk[0] not in "})]":
+            result.append("\n")
+        elif pendingSpace or pendingNewline:
+            prev, current = lastChar(), chunk[0]
+            if (prev in IDENTIFIER_CHARS and current in IDENTIFIER_CHARS) or \
+                    (prev in "+-" and current in "+-"):
+                result.append(" ")
+        pendingSpace = pendingNewline = False
+        result.append(chunk)
+
+    while i < len(code):
+        char: str = code[i]
+        if nesting and nesting[-1] in "\"'`":
+            quote: str = nesting[-1]
+            start: int = i
+            while i < len(code):
+                if code[i] == "\\":
+                    i += 2
+                    continue
+                if code[i] == quote:
+                    nesting.pop()
+                    i += 1
+                    break
+                if quote == "`" and code.startswith("${", i):
+                    nesting.append("}")
+                    i += 2
+                    break
+                i += 1
+            result.append(code[start:i])
+            continue
+
+        if code.startswith("//", i):
+            end: int = code.find("\n", i)
+            i = len(code) if end == -1 else end
+        elif code.startswith("/*", i):
+            end: int = code.find("*/", i + 2)
+            if end == -1:
+                raise ValueError("Unterminated block comment")
+            i = end + 2
+            pendingSpace = True
+        elif char == "\n":
+            pendingNewline = True
+            i += 1
+        elif char.isspace():
+            pendingSpace = True
+            i += 1
+        elif char in "\"'`":
+            emit(char)
+            nesting.append(char)
+            i += 1
+        else:
+            if char == "{" and nesting:
+                nesting.append("{")
+            elif char == "}" and nesting:
+                # Either the end of a block or the end of a template literal's ${...}
+                if nesting.pop() == "}":
+                    result.append(char)
+                    i += 1
+                    continue
+            emit(char)
+            i += 1
+    return "".join(result)
@@ -0,0 +1,125 @@
+#  -*- coding: utf-8 -*-
+__author__ = "kubik.augustyn@post.cz"
+
+import tracemalloc
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Iterator
+
+from kutil.language.AST import AST
+
+from esoml.nodestore import NodeStore
+
+
+class PhaseStats:
+    wallTime: float  # In seconds, summed over all the runs of the phase
+    peakMemory: int | None  # In bytes above the memory usage at the start, None if not traced
+
+    def __init__(self) -> None:
+        self.wallTime = 0
+        self.peakMemory = None
+
+    def addPeakMemory(self, peakMemory: int) -> None:
+        self.peakMemory = max(self.peakMemory or 0, peakMemory)
+
+    def __repr__(self) -> str:
+        memory: str = "" if self.peakMemory is None else f", peakMemory={self.peakMemory}"
+        return f"PhaseStats(wallTime={self.wallTime * 1000:.3f}ms{memory})"
+
+
+# The peak memory is only measured while tracemalloc is tracing (e.g. python -X tracemalloc)
+class CompileStats:
+    phases: dict[str, PhaseStats]
+    tokenCount: int
+    nodeCount: int
+    sectionCount: int
+    outputSize: int | None  # In characters, None until exported
+    optimizations: dict[str, int]  # Optimization pass --> the number of instructions it removed
+    removedSections: list[str]  # The labels of the code sections removed as unreachable
+
+    def __init__(self) -> None:
+        self.phases = {}
+        self.tokenCount = 0
+        self.nodeCount = 0
+        self.sectionCount = 0
+        self.outputSize = None
+        self.optimizations = {}
+        self.removedSections = []
+
+    def phase(self, name: str) -> PhaseStats:
+        if name not in self.phases:
+            self.phases[name] = PhaseStats()
+        return self.phases[name]
+
+    @contextmanager
+    def measure(self, name: str) -> Iterator[PhaseStats]:
+        phase: PhaseStats = self.phase(name)
+        tracing: bool = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            startMemory: int = tracemalloc.get_traced_memory()[0]
+        start: float = perf_counter()
+        try:
+            yield phase
+        finally:
+            phase.wallTime += perf_counter() - start
+            if tracing and tracemalloc.is_tracing():
+                phase.addPeakMemory(tracemalloc.get_traced_memory()[1] - startMemory)
+
+    def measureIterator(self, name: str, chunks: Iterator[str]) -> Iterator[str]:
+        # Only measures producing the chunks, not what the consumer does in between
+        phase: PhaseStats = self.phase(name)
+        tracing: bool = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            startMemory: int = tracemalloc.get_traced_memory()[0]
+        size: int = 0
+        while True:
+            start: float = perf_counter()
+            chunk: str | None = next(chunks, None)
+            phase.wallTime += perf_counter() - start
+            if chunk is None:
+                break
+            size += len(chunk)
+            yield chunk
+        self.outputSize = size
+        if tracing and tracemalloc.is_tracing():
+            phase.addPeakMemory(tracemalloc.get_traced_memory()[1] - startMemory)
+
+    def copy(self) -> "CompileStats":
+        stats: CompileStats = CompileStats()
+        for name, phase in self.phases.items():
+            copied: PhaseStats = stats.phase(name)
+            copied.wallTime, copied.peakMemory = phase.wallTime, phase.peakMemory
+        stats.tokenCount = self.tokenCount
+        stats.nodeCount = self.nodeCount
+        stats.sectionCount = self.sectionCount
+        stats.outputSize = self.outputSize
+        stats.optimizations = self.optimizations.copy()
+        stats.removedSections = self.removedSections.copy()
+        return stats
+
+    def serverTiming(self) -> str:
+        # The value of the Server-Timing HTTP header
+        return ", ".join(f"{name};dur={phase.wallTime * 1000:.3f}"
+                         for name, phase in self.phases.items())
+
+    def __repr__(self) -> str:
+        return (f"CompileStats(phases={self.phases}, tokens={self.tokenCount}, "
+                f"nodes={self.nodeCount}, sections={self.sectionCount}, "
+                f"outputSize={self.outputSize}, optimizations={self.optimizations}, "
+                f"removedSections={self.removedSections})")
+
+
+def countNodes(ast: AST) -> int:
+    if isinstance(ast, NodeStore):
+        return len(ast)
+    count: int = 0
+    stack: list = list(ast.rootNodes())
+    while stack:
+        node = stack.pop()
+        count += 1
+        children: list[int] | None = getattr(node, "children", None)
+        if children:
+            stack.extend(ast.getNodes(children))
+    return count
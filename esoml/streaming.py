@@ -0,0 +1,131 @@
+#  -*- coding: utf-8 -*-
+__author__ = "kubik.augustyn@post.cz"
+
+import logging
+from typing import Iterator, Iterable, TextIO
+
+from kutil.language.AST import AST
+from kutil.language.Token import TokenOutput, Token
+from kutil.language.Error import CompilerError, LexerError
+
+from esoml.lexer import EsoMLLexer
+from esoml.parser import EsoMLParser
+from esoml.compiler import EsoMLCompiler, EsoMLCompiledFile
+from esoml.nodes import *
+from esoml.optimizer import EsoMLOptimizer
+from esoml.stats import countNodes
+from esoml.types import EsoMLOptions, CompilerOptions
+
+logger = logging.getLogger(__name__)
+
+
+def numberLines(fp: TextIO) -> Iterator[tuple[int, str]]:
+    # Numbers the lines exactly like str.splitlines() would, without reading the whole file
+    lineNumber: int = 0
+    for rawLine in fp:
+        for line in rawLine.splitlines(keepends=False):
+            lineNumber += 1
+            yield lineNumber, line
+
+
+def splitSections(numberedLines: Iterable[tuple[int, str]]) -> Iterator[list[tuple[int, str]]]:
+    # Groups the lines by section, only a single section is kept in memory at a time
+    current: list[tuple[int, str]] = []
+    for lineNumber, line in numberedLines:
+        if not line and not current:
+            continue  # Empty lines before the first section
+        if line.startswith(".") and current:
+            yield current
+            current = []
+        current.append((lineNumber, line))
+    if current:
+        yield current
+
+
+# Lexes, parses and compiles one section at a time and drops its tokens and nodes right after,
+# so the memory usage depends on the largest section, not on the size of the whole program.
+# At -O0 the output is the same as the one of the whole program compiled at once. The optimizer
+# only sees one section at a time though, so at -O1 and -O2 the whole-program optimizations (ROM
+# folding, dead section removal, inlining, unchecked helpers and static containers) are skipped.
+class StreamingCompiler:
+    lexer: EsoMLLexer
+    parser: EsoMLParser
+    compiler: EsoMLCompiler
+    optimizer: EsoMLOptimizer
+
+    def __init__(self, useNodeStore: bool = False) -> None:
+        self.lexer = EsoMLLexer()
+        self.parser = EsoMLParser(useNodeStore)
+        self.compiler = EsoMLCompiler()
+        self.optimizer = EsoMLOptimizer()
+
+    def compileFile(self, path: str, options: EsoMLOptions) -> EsoMLCompiledFile:
+        with open(path, "r", encoding="utf-8") as f:
+            return self.compileLines(numberLines(f), options)
+
+    def compileLines(self, numberedLines: Iterable[tuple[int, str]],
+                     options: EsoMLOptions) -> EsoMLCompiledFile:
+        compilerOptions: CompilerOptions = options.getCompilerOptions()
+        logger.info("Streaming a compilation with these compiler options: %r", compilerOptions)
+        locale: str = compilerOptions.locale
+        file: EsoMLCompiledFile = EsoMLCompiledFile(compilerOptions.unsafeMode, locale,
+                                                    compilerOptions.outputMode,
+                                                    compilerOptions.production,
+                                                    compilerOptions.backend,
+                                                    compilerOptions.frameBudget,
+                                                    compilerOptions.renderLoopLimit)
+        localized: set[NodeType] = set()  # The constant sections of the locale already compiled
+        redefined: set[NodeType] = set()
+
+        for section in splitSections(numberedLines):
+            ast: AST = self.parseSection(section, options, file)
+            # The sections yet to come aren't known, so the constants aren't folded
+            ast = self.optimizer.optimize(ast, options, file.stats, wholeProgram=False)
+            with file.stats.measure("compile"):
+                for root in ast.rootNodes():
+                    if root.type is NodeType.SECTION_CODE:
+                        assert isinstance(root, SectionCodeNode)
+                        self.compiler.compileCodeSection(ast, root, file)
+                        continue
+                    if root.type is NodeType.SECTION_STRINGS:
+                        entryType, targetMap, kind = StringEntryNode, file.strings, "strings"
+                    elif root.type is NodeType.SECTION_ROM:
+                        entryType, targetMap, kind = ROMEntryNode, file.rom, "rom"
+                    else:
+                        raise CompilerError(
+                            NotImplementedError(f"Cannot compile section {root.type.name}"))
+                    assert isinstance(root, LocalizedSectionNode)
+                    if root.locale != locale:
+                        continue  # Other locales are only checked for errors
+                    if root.type in localized:
+                        redefined.add(root.type)
+                        continue
+                    localized.add(root.type)
+                    self.compiler.compileConstantEntries(ast, root, entryType, targetMap, kind)
+
+        # The same order of the checks as when compiling the whole program
+        file.unsafeMode = compilerOptions.unsafeMode
+        self.compiler.checkHasMain(file)
+        for nodeType, kind in ((NodeType.SECTION_STRINGS, "strings"),
+                               (NodeType.SECTION_ROM, "rom")):
+            if nodeType in redefined:
+                raise self.compiler.localeRedefinedError(locale)
+            if nodeType not in localized:
+                raise self.compiler.localeMissingError(locale, kind)
+        return file
+
+    def parseSection(self, section: list[tuple[int, str]], options: EsoMLOptions,
+                     file: EsoMLCompiledFile) -> AST:
+        with file.stats.measure("lex"):
+            try:
+                tokens: list[Token] = list(self.lexer.tokenizeLines(section, options))
+            except LexerError:
+                raise
+            except Exception as e:
+                raise LexerError(e) from None
+        file.stats.tokenCount += len(tokens)
+        file.stats.sectionCount += 1
+        with file.stats.measure("parse"):
+            ast: AST = self.parser.parse(TokenOutput(iter(tokens)), options)
+        file.stats.nodeCount += countNodes(ast)
+        return ast
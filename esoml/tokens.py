@@ -2,6 +2,7 @@
 __author__ = "kubik.augustyn@post.cz"
 
 from enum import StrEnum, Enum, unique, auto
+from functools import lru_cache
 from typing import Final
 
 from kutil.language.Token import Token
@@ -17,10 +18,12 @@ class SectionKind(StrEnum):
 
 
 class Section:
+    __slots__ = ("kind", "argument", "startsAtLine", "lines")
+
     kind: SectionKind
     argument: str
     startsAtLine: int  # The line number of the first contained line!
-    lines: list[str]
+    lines: list[str] | None  # Only kept if the lexer is asked to
 
     def __repr__(self):
         return f"Section(kind={self.kind.name}, argument={self.argument}, line={self.startsAtLine})"
@@ -70,6 +73,8 @@ class ValueRef:
         CONSTANT = 'c'
         STACK = 's'
 
+    __slots__ = ("kind", "key")
+
     kind: ValueRefKind
     key: int
 
@@ -86,14 +91,33 @@ class ValueRef:
 
     def parse(self, strVersion: str):
         try:
-            self.kind = ValueRef.ValueRefKind(strVersion[-1])
+            self.kind = valueRefKinds[strVersion[-1]]
             self.key = int(strVersion[:-1])
-        except (ValueError, TypeError, IndexError):
+        except (ValueError, TypeError, IndexError, KeyError):
             from kutil.language.Error import LexerError
             raise LexerError(ValueError(f"Failed to parse a value reference {ascii(strVersion)}"))
 
 
-class SectionStartToken(Token):
+# The suffix --> ValueRefKind, faster than calling the enum
+valueRefKinds: Final[dict[str, ValueRef.ValueRefKind]] = {kind.value: kind for kind in
+                                                           ValueRef.ValueRefKind}
+
+
+# The same references (e.g. 0s) repeat a lot, nothing mutates a ValueRef, so they can be shared
+@lru_cache(maxsize=4096)
+def internValueRef(strVersion: str) -> ValueRef:
+    return ValueRef(strVersion)
+
+
+# The kutil Token has no __slots__, so without redefining its attributes here, every token
+# would carry a __dict__
+class SlottedToken(Token):
+    __slots__ = ("kind", "content")
+
+
+class SectionStartToken(SlottedToken):
+    __slots__ = ("section",)
+
     section: Section
 
     def __init__(self, kind: Section):
@@ -101,13 +125,17 @@ class SectionStartToken(Token):
         self.section = kind
 
 
-class SectionEndToken(Token):
+class SectionEndToken(SlottedToken):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(TokenKind.SECTION_END, None)
 
 
 # STRINGS
-class StringEntryToken(Token):
+class StringEntryToken(SlottedToken):
+    __slots__ = ("key", "string")
+
     key: int
     string: str
 
@@ -118,7 +146,9 @@ class StringEntryToken(Token):
 
 
 # ROM
-class ROMEntryToken(Token):
+class ROMEntryToken(SlottedToken):
+    __slots__ = ("key", "number")
+
     key: int
     number: int
 
@@ -129,7 +159,9 @@ class ROMEntryToken(Token):
 
 
 # CODE
-class StartContainerToken(Token):
+class StartContainerToken(SlottedToken):
+    __slots__ = ("element",)
+
     element: str | None
 
     def __init__(self, element: str | None):
@@ -137,12 +169,16 @@ class StartContainerToken(Token):
         self.element = element
 
 
-class EndContainerToken(Token):
+class EndContainerToken(SlottedToken):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(TokenKind.END_CONTAINER, None)
 
 
-class ElemToken(Token):
+class ElemToken(SlottedToken):
+    __slots__ = ("element",)
+
     element: str
 
     def __init__(self, element: str):
@@ -150,7 +186,9 @@ class ElemToken(Token):
         self.element = element
 
 
-class CallToken(Token):
+class CallToken(SlottedToken):
+    __slots__ = ("label",)
+
     label: str  # Reference to the code section to be called
 
     def __init__(self, label: str):
@@ -158,26 +196,34 @@ class CallToken(Token):
         self.label = label
 
 
-class ShowToken(Token):
+class ShowToken(SlottedToken):
+    __slots__ = ()
+
     content: ValueRef
 
     def __init__(self, content: ValueRef):
         super().__init__(TokenKind.SHOW, content)
 
 
-class TextToken(Token):
+class TextToken(SlottedToken):
+    __slots__ = ()
+
     content: ValueRef
 
     def __init__(self, content: ValueRef):
         super().__init__(TokenKind.TEXT, content)
 
 
-class RenderToken(Token):
+class RenderToken(SlottedToken):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(TokenKind.RENDER, None)
 
 
-class AddEventListenerToken(Token):
+class AddEventListenerToken(SlottedToken):
+    __slots__ = ("event", "listener")
+
     event: str  # The event type
     listener: str  # A label to the listener
 
@@ -187,24 +233,32 @@ class AddEventListenerToken(Token):
         self.listener = listener
 
 
-class StackPushToken(Token):
+class StackPushToken(SlottedToken):
+    __slots__ = ()
+
     content: ValueRef
 
     def __init__(self, content: ValueRef):
         super().__init__(TokenKind.STACK_PUSH, content)
 
 
-class StackCopyToken(Token):
+class StackCopyToken(SlottedToken):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(TokenKind.STACK_COPY, None)
 
 
-class StackPopToken(Token):
+class StackPopToken(SlottedToken):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(TokenKind.STACK_POP, None)
 
 
-class StackSwapToken(Token):
+class StackSwapToken(SlottedToken):
+    __slots__ = ("offA", "offB")
+
     offA: int
     offB: int
 
@@ -214,41 +268,64 @@ class StackSwapToken(Token):
         self.offB = offB
 
 
-class CompareToken(Token):
+class CompareToken(SlottedToken):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(TokenKind.COMPARE, None)
 
 
-class ReadToken(Token):
+class ReadToken(SlottedToken):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(TokenKind.READ, None)
 
 
-class MathAddToken(Token):
+class MathAddToken(SlottedToken):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(TokenKind.MATH_ADD, None)
 
 
-class MathSubToken(Token):
+class MathSubToken(SlottedToken):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(TokenKind.MATH_SUB, None)
 
 
-class MathMulToken(Token):
+class MathMulToken(SlottedToken):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(TokenKind.MATH_MUL, None)
 
 
-class MathDivToken(Token):
+class MathDivToken(SlottedToken):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(TokenKind.MATH_DIV, None)
 
 
-class StartIfToken(Token):
+class StartIfToken(SlottedToken):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(TokenKind.START_IF, None)
 
 
-class EndIfToken(Token):
+class EndIfToken(SlottedToken):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(TokenKind.END_IF, None)
+
+
+# Tokens without any arguments carry no state, so a single shared instance of each is enough
+sharedTokens: Final[dict[type[Token], Token]] = {tokenType: tokenType() for tokenType in (
+    SectionEndToken, EndContainerToken, RenderToken, StackCopyToken, StackPopToken, CompareToken,
+    ReadToken, MathAddToken, MathSubToken, MathMulToken, MathDivToken, StartIfToken, EndIfToken
+)}
@@ -1,27 +1,86 @@
 #  -*- coding: utf-8 -*-
 __author__ = "kubik.augustyn@post.cz"
 
+from enum import StrEnum, IntEnum, unique
+from math import isfinite
+
 from kutil.language.Language import CompiledLanguageOptions  # Don't care it's not exported
 from locale import getdefaultlocale
 
 
+@unique
+class OutputMode(StrEnum):
+    PRETTY = "pretty"  # Beautified runtime and compiled code, good for debugging
+    COMPACT = "compact"  # The compiled code as emitted, without running the beautifier
+    MINIFIED = "minified"  # Like compact, but the runtime's whitespace and comments are stripped
+
+
+@unique
+class Backend(StrEnum):
+    CLOSURES = "closures"  # Every instruction is a runtime call, the blocks are arrow functions
+    BYTECODE = "bytecode"  # Every section is an array of instructions run by an interpreter
+
+
+@unique
+class OptimizationLevel(IntEnum):
+    O0 = 0  # The code is compiled as written
+    O1 = 1  # Constant folding, removal of dead code and inlining of small sections, keeping the
+    # exact behaviour (errors too)
+    O2 = 2  # Also cancels stack shuffles, which could only change a too shallow stack's error
+
+
 class CompilerOptions:
     locale: str
     unsafeMode: bool
+    outputMode: OutputMode
+    production: bool  # No logging and no IDs in the runtime nor in the compiled code
+    optimizationLevel: OptimizationLevel
+    inlineThreshold: int  # The biggest section (in nodes) inlined into its callers at O1+, 0 = none
+    backend: Backend
+    frameBudget: float  # The milliseconds a render loop may render for in a frame, > 0, see lib.js
+    renderLoopLimit: int  # The most renders in a row scheduled by the render before them, >= 1
 
-    def __init__(self, locale: str | None = None, unsafeMode: bool = False) -> None:
+    def __init__(self, locale: str | None = None, unsafeMode: bool = False,
+                 outputMode: OutputMode = OutputMode.PRETTY, production: bool = False,
+                 optimizationLevel: OptimizationLevel = OptimizationLevel.O0,
+                 inlineThreshold: int = 32, backend: Backend = Backend.CLOSURES,
+                 frameBudget: float = 8, renderLoopLimit: int = 60) -> None:
         self.locale = locale if locale is not None else getdefaultlocale()[0]
         self.unsafeMode = unsafeMode
+        self.outputMode = OutputMode(outputMode)
+        self.production = production
+        self.optimizationLevel = OptimizationLevel(optimizationLevel)
+        self.inlineThreshold = inlineThreshold
+        self.backend = Backend(backend)
+        # Both end up in the bundle as JS number literals
+        if isinstance(frameBudget, bool) or not isinstance(frameBudget, (int, float)) or \
+                not isfinite(frameBudget) or frameBudget <= 0:
+            raise ValueError(f"The frame budget must be a finite number > 0, not {frameBudget!r}")
+        if isinstance(renderLoopLimit, bool) or not isinstance(renderLoopLimit, int) or \
+                renderLoopLimit < 1:
+            raise ValueError(f"The render loop limit must be an int >= 1, not {renderLoopLimit!r}")
+        self.frameBudget = frameBudget
+        self.renderLoopLimit = renderLoopLimit
 
     def __repr__(self) -> str:
-        return f"CompilerOptions(locale={self.locale}, unsafeMode={self.unsafeMode})"
+        return (f"CompilerOptions(locale={self.locale}, unsafeMode={self.unsafeMode}, "
+                f"outputMode={self.outputMode}, production={self.production}, "
+                f"optimizationLevel={self.optimizationLevel.name}, "
+                f"inlineThreshold={self.inlineThreshold}, backend={self.backend}, "
+                f"frameBudget={self.frameBudget}, renderLoopLimit={self.renderLoopLimit})")
 
 
 class EsoMLOptions(CompiledLanguageOptions[None, None, CompilerOptions]):
     compilerOptions: CompilerOptions | None
 
-    def __init__(self, locale: str | None = None, unsafeMode: bool = False) -> None:
-        self.compilerOptions = CompilerOptions(locale, unsafeMode)
+    def __init__(self, locale: str | None = None, unsafeMode: bool = False,
+                 outputMode: OutputMode = OutputMode.PRETTY, production: bool = False,
+                 optimizationLevel: OptimizationLevel = OptimizationLevel.O0,
+                 inlineThreshold: int = 32, backend: Backend = Backend.CLOSURES,
+                 frameBudget: float = 8, renderLoopLimit: int = 60) -> None:
+        self.compilerOptions = CompilerOptions(locale, unsafeMode, outputMode, production,
+                                               optimizationLevel, inlineThreshold, backend,
+                                               frameBudget, renderLoopLimit)
 
     def getLexerOptions(self) -> None:
         raise NotImplementedError
@@ -1,3 +1,4 @@
+import logging
 import os.path
 import re
 from typing import Final
@@ -5,7 +6,12 @@ from urllib.parse import urlparse, parse_qs
 from kutil import HTTPServer, HTTPServerConnection, ProtocolConnection, readFile, writeFile
 from kutil.protocol.HTTP import HTTPRequest, HTTPResponse, HTTPHeaders
 
-from esoml.compile import compileEsoML, EsoMLOptions
+from esoml.cache import LRUCache, hashSource
+from esoml.compile import EsoMLOptions, prerenderEsoML
+from esoml.incremental import IncrementalCompiler
+from esoml.stats import CompileStats
+
+logger = logging.getLogger(__name__)
 
 print("main.py:10: You can hardcode the source EsoML file's path here! Default is 'main.eml'")
 EML_PATH: Final[str] = "main.eml"
@@ -13,26 +19,45 @@ EML_PATH: Final[str] = "main.eml"
 # EML_PATH: Final[str] = "examples/counter.eml"
 # EML_PATH: Final[str] = "examples/layout.eml"
 
-lastEMLContents: str | None = None
-lastCompiledFile: str | None = None
+# (source hash, locale, unsafe mode) --> exported and encoded JS bundle with its stats
+compiledCache: LRUCache[tuple[str, str, bool], tuple[bytes, CompileStats]] = LRUCache(maxSize=16)
+# (source hash, locale) --> the prerendered HTML of the root element, "" if it can't be prerendered
+prerenderedCache: LRUCache[tuple[str, str], str] = LRUCache(maxSize=16)
+# Only recompiles the sections changed since the last compilation
+incrementalCompiler: IncrementalCompiler = IncrementalCompiler()
+
 
+def compile(locale: str | None = None, unsafeMode: bool = False) -> bytes:
+    return compileWithStats(locale, unsafeMode)[0]
 
-def compile(locale: str | None = None) -> str:
-    global lastEMLContents, lastCompiledFile
 
+def compileWithStats(locale: str | None = None, unsafeMode: bool = False) -> \
+        tuple[bytes, CompileStats]:
+    options = EsoMLOptions(locale=locale, unsafeMode=unsafeMode)
     contents: str = readFile(EML_PATH, "text")
-    if lastEMLContents == contents:
-        return lastCompiledFile
+    key = (hashSource(contents), options.getCompilerOptions().locale, unsafeMode)
+
+    def compileContents() -> tuple[bytes, CompileStats]:
+        logger.info("Compiling EsoML...")
 
-    print()
-    print("Compiling EsoML...")
+        file = incrementalCompiler.compile(contents, options)
+        logger.info("Compiled: %s", file)
+        logger.info("%s", incrementalCompiler)
+        logger.info("%s", compiledCache)
+        # Encodes the bundle chunk by chunk, so there's never a full str copy of it besides the bytes
+        js: bytes = b"".join(chunk.encode("utf-8") for chunk in file.iterExport())
+        logger.info("Stats: %s", file.stats)
+        return js, file.stats
 
-    file = compileEsoML(contents, EsoMLOptions(locale=locale))
-    lastEMLContents = contents
-    lastCompiledFile = file.export()
-    print("Compiled:", file)
-    print()
-    return lastCompiledFile
+    return compiledCache.getOrCompute(key, compileContents)
+
+
+def prerender(locale: str | None = None) -> str:
+    # Runs init and the first render on the server, so the page shows up before the JS runs
+    locale = EsoMLOptions(locale=locale).getCompilerOptions().locale
+    contents: str = readFile(EML_PATH, "text")
+    key = (hashSource(contents), locale)
+    return prerenderedCache.getOrCompute(key, lambda: prerenderEsoML(contents, locale) or "")
 
 
 def build(locale: str | None = None) -> str:
@@ -50,9 +75,18 @@ def build(locale: str | None = None) -> str:
     html: str = rf'build/index.{locale}.html'
 
     writeFile(js, compile(locale))
+    prerendered: str = prerender(locale)
     templateHTML: str = readFile("index.html", "text")
-    writeFile(html, templateHTML.replace("{COMPILED_SRC}", jsFromDir))
-    return templateHTML.replace("{COMPILED_SRC}", jsFromHTML)
+    writeFile(html, injectPrerendered(templateHTML.replace("{COMPILED_SRC}", jsFromDir),
+                                      prerendered))
+    return injectPrerendered(templateHTML.replace("{COMPILED_SRC}", jsFromHTML), prerendered)
+
+
+def injectPrerendered(templateHTML: str, prerendered: str) -> str:
+    # The prerendered HTML goes in last, so that no placeholder is replaced inside of it
+    return templateHTML \
+        .replace("{PRERENDERED_ATTRIBUTE}", " data-prerendered" if prerendered else "") \
+        .replace("{PRERENDERED_HTML}", prerendered)
 
 
 def checkLocale(locale: str | None = None) -> bool:
@@ -82,8 +116,9 @@ def onData(conn: HTTPServerConnection, req: HTTPRequest):
             resp = HTTPResponse(200, "OK", headers, html)
             headers["Content-Type"] = "text/html, encoding=utf-8"
         elif uri.path == "/index.js":
-            js: bytes = compile(locale).encode("utf-8")
+            js, stats = compileWithStats(locale)
             resp = HTTPResponse(200, "OK", headers, js)
+            headers["Server-Timing"] = stats.serverTiming()
             headers["Content-Type"] = "application/javascript, encoding=utf-8"
         else:
             resp = HTTPResponse(404, "Not Found", headers,
@@ -106,6 +141,8 @@ def onConnection(conn: ProtocolConnection):
 
 
 if __name__ == '__main__':
+    # Use logging.DEBUG to see the parsed sections, strings and ROM entries
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     host, port = addr = ("localhost", 5555)
     server: HTTPServer = HTTPServer(addr, onConnection)
     print(f"Server open on http://{host}:{port}")
@@ -0,0 +1,47 @@
+#  -*- coding: utf-8 -*-
+__author__ = "kubik.augustyn@post.cz"
+
+import unittest
+
+from esoml.types import OptimizationLevel
+
+from tests.util import compileCode
+
+
+class StackAnalysisTest(unittest.TestCase):
+    def testNegativeOffsetsStayChecked(self) -> None:
+        # A negative offset is out of bounds whatever the depth is, the runtime must throw
+        code: str = compileCode("""
+.code init
+push 78t
+push -1s
+
+.render main
+text -1s
+""", OptimizationLevel.O1)
+        self.assertIn("stackPush(0x2,getStack(-0x1))", code)
+        self.assertIn("rawValue(0x4,!1,getStack(-0x1))", code)
+        self.assertNotIn("getStackUnchecked", code)
+
+
+    def testFailedMathOpLowersTheStack(self) -> None:
+        # A failed calculation in main leaves the stack two values lower than before it, so what
+        # init leaves on the stack can't be relied on by the next renders
+        code: str = compileCode("""
+.code init
+push 78t
+push 78t
+
+.render main
+push 78t
+madd
+copy
+text 0s
+pops
+""", OptimizationLevel.O1)
+        self.assertIn("calc(0x5,'+')", code)
+        self.assertIn("stackCopy(0x6)", code)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+#  -*- coding: utf-8 -*-
+__author__ = "kubik.augustyn@post.cz"
+
+import unittest
+
+from kutil.language.Error import LexerError
+
+from esoml.language import EsoML
+from esoml.lexer import EsoMLLexer
+from esoml.tokens import TokenKind
+
+from tests.util import HEADER
+
+
+class EsoMLLexerTest(unittest.TestCase):
+    def testRepeatedLinesShareTokens(self) -> None:
+        lexer: EsoMLLexer = EsoMLLexer(keepLines=True)
+        tokens = list(lexer.tokenizeInner(HEADER + """
+.code init
+push 78t
+push 78t
+
+.render main
+push 78t
+""", EsoML.optionsClass(), None))
+        pushes = [token for token in tokens if token.kind is TokenKind.STACK_PUSH]
+        self.assertEqual(len(pushes), 3)
+        self.assertTrue(all(push is pushes[0] for push in pushes))
+        sections = [token.content for token in tokens if token.kind is TokenKind.SECTION_START]
+        self.assertEqual(sections[-2].lines, ["push 78t", "push 78t"])
+        self.assertEqual(sections[-1].lines, ["push 78t"])
+
+    def testErrorAfterRepeatedLinesHasItsLineNumber(self) -> None:
+        with self.assertRaises(LexerError) as context:
+            EsoML().parse(HEADER + """
+.code init
+push 78t
+push 78t
+push
+""")
+        self.assertIn("at line 10", str(context.exception.exceptions[-1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
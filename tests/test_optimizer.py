@@ -0,0 +1,55 @@
+#  -*- coding: utf-8 -*-
+__author__ = "kubik.augustyn@post.cz"
+
+import unittest
+
+from esoml.types import OptimizationLevel
+
+from tests.util import compileCode
+
+UNSAFE_ROM_HEADER: str = """.strings en_US
+Let 1 be translated to a.
+
+.rom en_US
+Remember that 1 will always be aaaaaaaaaaaaaaaaaaaa.
+"""
+
+
+class EsoMLOptimizerTest(unittest.TestCase):
+    def testUnusedSafeConstantIsRemoved(self) -> None:
+        code: str = compileCode("""
+.code init
+push 78c
+pops
+
+.render main
+text 78t
+""", OptimizationLevel.O1)
+        self.assertNotIn("getConstant", code)
+
+    def testUnusedUnsafeConstantIsKept(self) -> None:
+        # Pushing a value that isn't a safe integer throws, so the push must stay
+        code: str = compileCode("""
+.code init
+push 78c
+pops
+
+.render main
+text 78t
+""", OptimizationLevel.O1, UNSAFE_ROM_HEADER)
+        self.assertIn("stackPush(0x1,getConstant(0x4e))", code)
+
+    def testUnusedMissingConstantIsKept(self) -> None:
+        code: str = compileCode("""
+.code init
+push 90c
+pops
+
+.render main
+text 78t
+""", OptimizationLevel.O1)
+        self.assertIn("getConstant(0x5a)", code)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+#  -*- coding: utf-8 -*-
+__author__ = "kubik.augustyn@post.cz"
+
+import subprocess
+import unittest
+from os import remove
+from shutil import which
+from tempfile import NamedTemporaryFile
+
+from kutil import readFile
+
+from esoml.runtime import RUNTIME_PATH, selectBuild
+
+
+def checkSyntax(path: str) -> subprocess.CompletedProcess:
+    return subprocess.run(["node", "--check", path], capture_output=True, text=True)
+
+
+@unittest.skipIf(which("node") is None, "node was not found")
+class RuntimeSyntaxTest(unittest.TestCase):
+    def testRuntimeIsValidJS(self) -> None:
+        result: subprocess.CompletedProcess = checkSyntax(RUNTIME_PATH)
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+    def testBuildsAreValidJS(self) -> None:
+        for production in (False, True):
+            with NamedTemporaryFile("w", suffix=".js", encoding="utf-8", delete=False) as f:
+                f.write(selectBuild(readFile(RUNTIME_PATH, "text"), production))
+            try:
+                result: subprocess.CompletedProcess = checkSyntax(f.name)
+            finally:
+                remove(f.name)
+            self.assertEqual(result.returncode, 0, result.stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,24 @@
+#  -*- coding: utf-8 -*-
+__author__ = "kubik.augustyn@post.cz"
+
+import unittest
+from glob import glob
+from os.path import dirname, join
+
+from esoml.compile import compileEsoML, compileEsoMLFile
+from esoml.types import EsoMLOptions, Backend
+
+EXAMPLES: list[str] = sorted(glob(join(dirname(dirname(__file__)), "examples", "*.eml")))
+
+
+class StreamingCompilerTest(unittest.TestCase):
+    def testSameOutputAtO0(self) -> None:
+        for path, backend in ((path, backend) for path in EXAMPLES for backend in Backend):
+            with self.subTest(path=path, backend=backend), open(path, encoding="utf-8") as f:
+                self.assertEqual(
+                    compileEsoMLFile(path, EsoMLOptions("en_US", backend=backend)).export(),
+                    compileEsoML(f.read(), EsoMLOptions("en_US", backend=backend)).export())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,26 @@
+#  -*- coding: utf-8 -*-
+__author__ = "kubik.augustyn@post.cz"
+
+import unittest
+
+from esoml.types import CompilerOptions, EsoMLOptions
+
+
+class CompilerOptionsTest(unittest.TestCase):
+    def testDefaultRenderSchedulerIsValid(self) -> None:
+        options: CompilerOptions = EsoMLOptions(locale="en_US").getCompilerOptions()
+        self.assertEqual((options.frameBudget, options.renderLoopLimit), (8, 60))
+
+    def testInvalidFrameBudgetIsRejected(self) -> None:
+        for frameBudget in (float("inf"), float("-inf"), float("nan"), 0, -1, True, "8"):
+            with self.subTest(frameBudget=frameBudget), self.assertRaises(ValueError):
+                CompilerOptions("en_US", frameBudget=frameBudget)
+
+    def testInvalidRenderLoopLimitIsRejected(self) -> None:
+        for renderLoopLimit in (-1, 0, 1.5, float("inf"), True, "60"):
+            with self.subTest(renderLoopLimit=renderLoopLimit), self.assertRaises(ValueError):
+                CompilerOptions("en_US", renderLoopLimit=renderLoopLimit)
+
+
+if __name__ == '__main__':
+    unittest.main()
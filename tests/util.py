@@ -0,0 +1,21 @@
+#  -*- coding: utf-8 -*-
+__author__ = "kubik.augustyn@post.cz"
+
+from esoml.language import EsoML
+from esoml.types import EsoMLOptions, OutputMode, OptimizationLevel
+
+# The constants of the programs of the tests, the code sections are appended
+HEADER: str = """.strings en_US
+Let 1 be translated to a.
+
+.rom en_US
+Remember that 1 will always be 0.
+"""
+
+
+def compileCode(source: str, optimizationLevel: OptimizationLevel,
+                header: str = HEADER) -> str:
+    # The compiled code sections of the program
+    file = EsoML().compile(header + source, EsoMLOptions(
+        locale="en_US", outputMode=OutputMode.COMPACT, optimizationLevel=optimizationLevel))
+    return file.exportCodes()